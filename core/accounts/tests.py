@@ -1,3 +1,32 @@
 from django.test import TestCase
+from django.core.cache import cache
 
-# Create your tests here.
+from visa_setup.tests import Budget, QueryBudgetMixin
+
+
+class AccountsQueryBudgetTests(QueryBudgetMixin, TestCase):
+    registration = {
+        'email': 'new@example.com', 'username': 'newcomer', 'password': 'Budget#pass42',
+        'password2': 'Budget#pass42', 'first_name': 'New', 'last_name': 'Comer',
+    }
+
+    def seed(self, size):
+        context = super().seed(size)
+        # Codes the OTP flows expect to find in the cache
+        cache.set(f"otp:login:{context['email']}", '123456')
+        cache.set(f"otp:register:{self.registration['email']}", '123456')
+        cache.set(f"register:payload:{self.registration['email']}", self.registration)
+        return context
+
+    budgets = (
+        Budget('POST', '/api/accounts/register/', 4, registration),
+        Budget('POST', '/api/accounts/login/', 2, {'email': '{email}', 'password': '{password}'}),
+        Budget('POST', '/api/accounts/login/refresh/', 1, {'refresh': '{refresh}'}),
+        Budget('POST', '/api/accounts/logout/', 8, {'refresh_token': '{refresh}'}, auth='user'),
+        Budget('GET', '/api/accounts/profile/', 1, auth='user'),
+        Budget('PUT', '/api/accounts/profile/', 2, {'address': '1 Main Street'}, auth='user'),
+        Budget('POST', '/api/accounts/otp/send/', 0, {'email': '{email}'}),
+        Budget('POST', '/api/accounts/otp/verify/', 0, {'email': '{email}', 'otp': '123456'}),
+        Budget('POST', '/api/accounts/otp/verify/', 6, {'email': registration['email'], 'otp': '123456'}, status=201),
+        Budget('POST', '/api/accounts/otp/resend/', 0, {'email': '{email}'}),
+    )
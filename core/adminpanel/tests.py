@@ -1,3 +1,82 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 
-# Create your tests here.
+from visa_setup.tests import Budget, QueryBudgetMixin
+
+VISA_TYPE = {'name': 'Work', 'headings': 'Work abroad', 'price': '99.00'}
+
+
+class AdminPanelQueryBudgetTests(QueryBudgetMixin, TestCase):
+    budgets = (
+        Budget('POST', '/api/admin/login/', 2, {'email': '{admin_email}', 'password': '{password}'}),
+        Budget('POST', '/api/admin/logout/', 8, {'refresh': '{refresh}'}, status=205, auth='admin'),
+        Budget('POST', '/api/admin/token/refresh/', 1, {'refresh': '{refresh}'}),
+
+        Budget('GET', '/api/admin/notes/', 2, auth='admin'),
+        Budget('POST', '/api/admin/notes/', 2, {'notes': 'Bring originals'}, status=201, auth='admin'),
+        Budget('GET', '/api/admin/notes/{note}/', 2, auth='admin'),
+        Budget('PUT', '/api/admin/notes/{note}/', 3, {'notes': 'Bring copies'}, auth='admin'),
+        Budget('DELETE', '/api/admin/notes/{note}/', 4, status=204, auth='admin'),
+
+        Budget('GET', '/api/admin/visa-process/', 2, auth='admin'),
+        Budget('POST', '/api/admin/visa-process/', 2, {'points': 'Apply online'}, status=201, auth='admin'),
+        Budget('GET', '/api/admin/visa-process/{process}/', 2, auth='admin'),
+        Budget('PUT', '/api/admin/visa-process/{process}/', 3, {'points': 'Apply in person'}, auth='admin'),
+        Budget('DELETE', '/api/admin/visa-process/{process}/', 4, status=204, auth='admin'),
+
+        Budget('GET', '/api/admin/visa-overview/', 2, auth='admin'),
+        Budget('POST', '/api/admin/visa-overview/', 2, {'points': 'Fees', 'overview': 'Paid upfront'}, status=201, auth='admin'),
+        Budget('GET', '/api/admin/visa-overview/{overview}/', 2, auth='admin'),
+        Budget('PUT', '/api/admin/visa-overview/{overview}/', 3, {'points': 'Fees', 'overview': 'Paid on arrival'}, auth='admin'),
+        Budget('DELETE', '/api/admin/visa-overview/{overview}/', 4, status=204, auth='admin'),
+
+        Budget('GET', '/api/admin/required-documents/', 2, auth='admin'),
+        Budget('POST', '/api/admin/required-documents/', 2, {'document_name': 'Photo'}, status=201, auth='admin'),
+        Budget('GET', '/api/admin/required-documents/{document}/', 2, auth='admin'),
+        Budget('PUT', '/api/admin/required-documents/{document}/', 3, {'description': 'Recent'}, auth='admin'),
+        Budget('DELETE', '/api/admin/required-documents/{document}/', 7, status=204, auth='admin'),
+
+        Budget('GET', '/api/admin/countries/', 3, auth='admin'),
+        Budget('POST', '/api/admin/countries/', 14, {
+            'name': 'Norway', 'description': 'Fjords', 'code': 'NO', 'type_ids': '{visa_type}',
+        }, status=201, auth='admin'),
+        Budget('GET', '/api/admin/countries/{country}/', 7, auth='admin'),
+        Budget('PUT', '/api/admin/countries/{country}/', 8, {'description': 'Updated'}, auth='admin'),
+        Budget('DELETE', '/api/admin/countries/{country}/', 9, status=204, auth='admin'),
+        Budget('GET', '/api/admin/countries-with-visa-types/', 7, auth='admin'),
+
+        Budget('GET', '/api/admin/visa-types/', 6, auth='admin'),
+        Budget('POST', '/api/admin/visa-types/', 12, {**VISA_TYPE, 'note_ids': '{note}'}, status=201, auth='admin'),
+        Budget('GET', '/api/admin/visa-types/{visa_type}/', 6, auth='admin'),
+        Budget('PUT', '/api/admin/visa-types/{visa_type}/', 7, {'price': '120.00'}, auth='admin'),
+        Budget('DELETE', '/api/admin/visa-types/{visa_type}/', 13, status=204, auth='admin'),
+
+        Budget('GET', '/api/admin/countries/{country}/visa-types/', 7, auth='admin'),
+        Budget('POST', '/api/admin/countries/{country}/visa-types/', 9, VISA_TYPE, status=201, auth='admin'),
+        Budget('GET', '/api/admin/countries/{country}/visa-types/{visa_type}/', 8, auth='admin'),
+        Budget('PUT', '/api/admin/countries/{country}/visa-types/{visa_type}/', 9, {'price': '120.00'}, auth='admin'),
+        Budget('DELETE', '/api/admin/countries/{country}/visa-types/{visa_type}/', 5, status=204, auth='admin'),
+        Budget('POST', '/api/admin/countries/{country}/bulk-assign-visa-types/', 4,
+               {'visa_type_ids': '{visa_type}'}, auth='admin'),
+
+        Budget('GET', '/api/admin/form-data/visa-type/', 5, auth='admin'),
+        Budget('GET', '/api/admin/form-data/country/', 6, auth='admin'),
+
+        Budget('GET', '/api/admin/visa-applications/', 5, auth='admin'),
+        Budget('GET', '/api/admin/visa-applications/{application}/', 5, auth='admin'),
+        Budget('PUT', '/api/admin/visa-applications/{application}/', 13, {
+            'status': 'approved', 'document_status[{document}]': 'approved',
+        }, auth='admin'),
+        Budget('PUT', '/api/admin/visa-applications/{application}/', 21, lambda c: {
+            f"required_documents[{c['document']}]": SimpleUploadedFile('passport.pdf', b'%PDF-1.4'),
+        }, auth='admin'),
+        Budget('DELETE', '/api/admin/visa-applications/{application}/', 6, status=204, auth='admin'),
+
+        Budget('GET', '/api/admin/consultations/', 2, auth='admin'),
+        Budget('GET', '/api/admin/consultations/{consultation}/', 2, auth='admin'),
+        Budget('PUT', '/api/admin/consultations/{consultation}/', 3, {'close': 'true'}, auth='admin'),
+        Budget('DELETE', '/api/admin/consultations/{consultation}/', 3, status=204, auth='admin'),
+
+        Budget('GET', '/api/admin/settings/', 2, auth='admin'),
+        Budget('PUT', '/api/admin/settings/', 3, {'address': '1 Main Street'}, auth='admin'),
+    )
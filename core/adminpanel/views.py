@@ -7,16 +7,16 @@ from rest_framework.permissions import AllowAny
 from .serializers import ConsultationSerializer, SettingsSerializer,countrybaseSerializer
 from .permissions import IsSuperUser
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.core.cache import cache
 from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
 from django.shortcuts import get_object_or_404
+from visa_setup import application_cache
+from visa_setup.upload_spool import spool_documents
 from visa_setup.models import Consultation, Notes, Settings, VisaProcess, VisaOverview, RequiredDocuments,Country, VisaType,VisaApplication,ApplicationDocument
-from django.db.models.signals import post_save, post_delete, m2m_changed
-from django.core.cache import cache
+from django.db.models import Prefetch, prefetch_related_objects
 from django.conf import settings
 import logging
 
@@ -31,6 +31,11 @@ from .serializers import (
     UserVisaApplicationSerializer
 )
 
+# Nested relations VisaTypeSerializer renders for every visa type
+VISA_TYPE_RELATIONS = ('processes', 'overviews', 'notes', 'required_documents')
+# ... and CountrySerializer for the visa types of every country
+COUNTRY_RELATIONS = tuple(f'types__{name}' for name in VISA_TYPE_RELATIONS)
+
 class AdminLoginView(APIView):
     """
     Allows only superusers to log in.
@@ -302,7 +307,8 @@ class CountryListCreateView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get(self, request):
-        countries = Country.objects.all()
+        # The serializer lists the ids of each country's visa types
+        countries = Country.objects.prefetch_related(Prefetch('types', queryset=VisaType.objects.only('id')))
         serializer = countrybaseSerializer(countries, many=True)
         return Response(serializer.data)
 
@@ -332,6 +338,7 @@ class CountryListCreateView(APIView):
         serializer = CountrySerializer(data=data)
         if serializer.is_valid():
             country = serializer.save()
+            prefetch_related_objects([country], *COUNTRY_RELATIONS)
             return Response(CountrySerializer(country).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -341,7 +348,7 @@ class CountryDetailView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get(self, request, pk):
-        country = get_object_or_404(Country, pk=pk)
+        country = get_object_or_404(Country.objects.prefetch_related(*COUNTRY_RELATIONS), pk=pk)
         return Response(CountrySerializer(country).data)
 
     def put(self, request, pk):
@@ -373,6 +380,7 @@ class CountryDetailView(APIView):
         if serializer.is_valid():
             serializer.save()
             # Optional: ensure cache is fresh immediately (signals already clear + warm)
+            prefetch_related_objects([country], *COUNTRY_RELATIONS)
             return Response(CountrySerializer(country).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -389,7 +397,7 @@ class VisaTypeListCreateView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get(self, request):
-        visatypes = VisaType.objects.all()
+        visatypes = VisaType.objects.prefetch_related(*VISA_TYPE_RELATIONS)
         serializer = VisaTypeSerializer(visatypes, many=True)
         return Response(serializer.data)
 
@@ -478,7 +486,7 @@ class CountryVisaTypesView(APIView):
     def get(self, request, country_id):
         """Get all visa types for a specific country"""
         country = get_object_or_404(Country, pk=country_id)
-        visa_types = country.types.all()
+        visa_types = country.types.prefetch_related(*VISA_TYPE_RELATIONS)
         serializer = VisaTypeSerializer(visa_types, many=True)
         return Response(serializer.data)
 
@@ -527,7 +535,7 @@ class CountryVisaTypeDetailView(APIView):
         visa_type = get_object_or_404(VisaType, pk=visa_type_id)
         
         # Check if the visa type belongs to the country
-        if visa_type not in country.types.all():
+        if not country.types.filter(pk=visa_type.pk).exists():
             return Response({"error": "Visa type not found for this country"}, status=status.HTTP_404_NOT_FOUND)
         
         return Response(VisaTypeSerializer(visa_type).data)
@@ -538,7 +546,7 @@ class CountryVisaTypeDetailView(APIView):
         visa_type = get_object_or_404(VisaType, pk=visa_type_id)
         
         # Check if the visa type belongs to the country
-        if visa_type not in country.types.all():
+        if not country.types.filter(pk=visa_type.pk).exists():
             return Response({"error": "Visa type not found for this country"}, status=status.HTTP_404_NOT_FOUND)
         
         # Handle image upload if provided
@@ -576,7 +584,7 @@ class CountryVisaTypeDetailView(APIView):
         visa_type = get_object_or_404(VisaType, pk=visa_type_id)
         
         # Check if the visa type belongs to the country
-        if visa_type not in country.types.all():
+        if not country.types.filter(pk=visa_type.pk).exists():
             return Response({"error": "Visa type not found for this country"}, status=status.HTTP_404_NOT_FOUND)
         
         # Remove the visa type from the country
@@ -608,7 +616,7 @@ class CountryFormDataView(APIView):
     def get(self, request):
         """Get all available visa types for country creation"""
         data = {
-            'visa_types': VisaTypeSerializer(VisaType.objects.all(), many=True).data,
+            'visa_types': VisaTypeSerializer(VisaType.objects.prefetch_related(*VISA_TYPE_RELATIONS), many=True).data,
         }
         return Response(data)
 
@@ -619,7 +627,7 @@ class CountriesWithVisaTypesView(APIView):
 
     def get(self, request):
         """Get all countries with their associated visa types"""
-        countries = Country.objects.prefetch_related('types').all()
+        countries = Country.objects.prefetch_related(*COUNTRY_RELATIONS)
         serializer = CountrySerializer(countries, many=True)
         return Response(serializer.data)
 
@@ -670,7 +678,7 @@ class UserVisaApplicationView(APIView):
                     id=application_id
                 ).select_related(
                     'country', 'visa_type', 'user'
-                ).prefetch_related('documents__required_document').first()
+                ).prefetch_related('documents__required_document', 'visa_type__required_documents').first()
                 
                 if not visa_application:
                     return Response({"error": "Application not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -683,7 +691,7 @@ class UserVisaApplicationView(APIView):
             """Get all visa applications for admin with documents"""
             visa_applications = VisaApplication.objects.all().select_related(
                 'country', 'visa_type', 'user'
-            ).prefetch_related('documents__required_document').order_by('-created_at')
+            ).prefetch_related('documents__required_document', 'visa_type__required_documents').order_by('-created_at')
             serializer = UserVisaApplicationSerializer(visa_applications, many=True)
             return Response({"message":"Applications fetched successfully", "Applications":serializer.data}, status=status.HTTP_200_OK)
 
@@ -691,20 +699,15 @@ class UserVisaApplicationView(APIView):
         serializer = UserVisaApplicationSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             visa_application = serializer.save()
-            # Invalidate and warm per-user caches
-            user_id = visa_application.user_id
-            list_key = f"user:{user_id}:applications"
-            detail_key = f"user:{user_id}:application:{visa_application.id}"
-            cache.delete(list_key)
-            cache.delete(detail_key)
-            cache.set(detail_key, UserVisaApplicationSerializer(visa_application).data, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            apps_qs = VisaApplication.objects.filter(user_id=user_id).select_related('country', 'visa_type', 'user').prefetch_related('documents__required_document')
-            cache.set(list_key, UserVisaApplicationSerializer(apps_qs, many=True).data, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            logger.info("Admin created application %s; rewarmed cache: %s, %s", visa_application.id, list_key, detail_key)
-            return Response({
+            # Add it to the owner's cached application lists
+            application_cache.put(visa_application)
+            response = {
                 "message": "Application created successfully",
                 "Application": UserVisaApplicationSerializer(visa_application).data
-            }, status=status.HTTP_201_CREATED)
+            }
+            if serializer.upload_errors:
+                response["upload_errors"] = serializer.upload_errors
+            return Response(response, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def put(self, request, application_id=None):
@@ -795,7 +798,8 @@ class UserVisaApplicationView(APIView):
                 except (IndexError, ValueError):
                     continue
 
-        # Handle file uploads
+        # Handle file uploads: validate every file before uploading any
+        uploads = {}
         for key in request.FILES:
             if key.startswith("required_documents["):
                 try:
@@ -813,58 +817,21 @@ class UserVisaApplicationView(APIView):
                 if not any(file.name.lower().endswith(ext) for ext in allowed_extensions):
                     return Response({'error': 'File type not allowed. Use PDF, DOCX, DOC, JPG, JPEG, or PNG'}, status=status.HTTP_400_BAD_REQUEST)
 
-                try:
-                    required_doc = RequiredDocuments.objects.get(id=doc_id)
-                except RequiredDocuments.DoesNotExist:
-                    return Response({'error': f'Required document with ID {doc_id} does not exist'}, status=status.HTTP_404_NOT_FOUND)
+                uploads[doc_id] = file
 
-                # Upload to Supabase
-                try:
-                    from core.supabase_client import upload_file_to_supabase
-                    file_url = upload_file_to_supabase(file)
-                    
-                    # Update or create ApplicationDocument with Supabase URL
-                    app_doc, created = ApplicationDocument.objects.get_or_create(
-                        application=app,
-                        required_document=required_doc,
-                        defaults={'file': file_url}
-                    )
-
-                    if not created:
-                        app_doc.file = file_url
-                        app_doc.status = 'pending'  # Reset status after upload
-                        app_doc.admin_notes = ''
-                        app_doc.rejection_reason = ''
-                        app_doc.save()
-                        
-                except Exception as e:
-                    # Fallback to local storage if Supabase upload fails
-                    app_doc, created = ApplicationDocument.objects.get_or_create(
-                        application=app,
-                        required_document=required_doc,
-                        defaults={'file': None}
-                    )
-
-                    if not created:
-                        app_doc.file = None
-                        app_doc.status = 'pending'  # Reset status after upload
-                        app_doc.admin_notes = ''
-                        app_doc.rejection_reason = ''
-                        app_doc.save()
+        unknown = set(uploads) - set(RequiredDocuments.objects.filter(id__in=uploads).values_list('id', flat=True))
+        if unknown:
+            return Response({'error': f'Required document with ID {min(unknown)} does not exist'}, status=status.HTTP_404_NOT_FOUND)
 
-                updated = True
+        # Spool for the upload worker; the documents are 'uploading' until it is done
+        if uploads:
+            spool_documents(app, uploads)
+            updated = True
 
         if updated:
-            # Invalidate and warm per-user caches
-            user_id = app.user_id
-            list_key = f"user:{user_id}:applications"
-            detail_key = f"user:{user_id}:application:{app.id}"
-            cache.delete(list_key)
-            cache.delete(detail_key)
-            cache.set(detail_key, UserVisaApplicationSerializer(app).data, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            apps_qs = VisaApplication.objects.filter(user_id=user_id).select_related('country', 'visa_type', 'user').prefetch_related('documents__required_document')
-            cache.set(list_key, UserVisaApplicationSerializer(apps_qs, many=True).data, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            logger.info("Admin updated application %s; rewarmed cache: %s, %s", app.id, list_key, detail_key)
+            # Replace only this application in the owner's cached lists
+            application_cache.put(app)
+            logger.info("Admin updated application %s", app.id)
             return Response({
                 'message': 'Application updated successfully',
                 'application': UserVisaApplicationSerializer(app).data
@@ -881,13 +848,8 @@ class UserVisaApplicationView(APIView):
             app = VisaApplication.objects.get(pk=application_id)
             user_id = app.user_id
             app.delete()
-            # Invalidate and warm list cache (detail no longer exists)
-            list_key = f"user:{user_id}:applications"
-            detail_key = f"user:{user_id}:application:{application_id}"
-            cache.delete(detail_key)
-            apps_qs = VisaApplication.objects.filter(user_id=user_id).select_related('country', 'visa_type', 'user').prefetch_related('documents__required_document')
-            cache.set(list_key, UserVisaApplicationSerializer(apps_qs, many=True).data, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            logger.info("Admin deleted application %s; rewarmed list cache: %s and cleared %s", application_id, list_key, detail_key)
+            application_cache.remove(user_id, application_id)
+            logger.info("Admin deleted application %s", application_id)
             return Response({'message': 'Application deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
         except VisaApplication.DoesNotExist:
             return Response({'error': 'Application not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -64,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'visa_setup.middleware.DeferredCatalogRebuildMiddleware',
 ]
 
 #delete after development
@@ -96,16 +97,98 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Use local-memory cache by default. Override via environment in production if needed.
 # Default TTL set to 30 days
 CACHE_DEFAULT_TTL = int(os.getenv('CACHE_DEFAULT_TIMEOUT', str(60 * 60 * 24 * 30)))
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'visa_v1_local_cache',
-        'TIMEOUT': CACHE_DEFAULT_TTL,
-        'OPTIONS': {
-            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '1000')),
-        },
-    }
+
+# Catalog snapshot TTLs per key family (seconds). Past 'soft' an entry is still
+# served while a single background refresh rebuilds it; past 'hard' it is evicted.
+CATALOG_CACHE_TTLS = {
+    'countries': {'soft': int(os.getenv('CATALOG_COUNTRIES_SOFT_TTL', str(60 * 60))), 'hard': CACHE_DEFAULT_TTL},
+    'visa_types': {'soft': int(os.getenv('CATALOG_VISA_TYPES_SOFT_TTL', str(60 * 60))), 'hard': CACHE_DEFAULT_TTL},
+    'country_visa_types': {'soft': int(os.getenv('CATALOG_COUNTRY_VISA_TYPES_SOFT_TTL', str(60 * 60))), 'hard': CACHE_DEFAULT_TTL},
+    'settings': {'soft': int(os.getenv('CATALOG_SETTINGS_SOFT_TTL', str(60 * 60 * 6))), 'hard': CACHE_DEFAULT_TTL},
+    'bootstrap': {'soft': int(os.getenv('CATALOG_BOOTSTRAP_SOFT_TTL', str(60 * 60))), 'hard': CACHE_DEFAULT_TTL},
 }
+CATALOG_REFRESH_IN_BACKGROUND = True
+
+# CACHE_URL selects a cache shared by every worker/instance, so catalog
+# generation bumps, OTPs and per-user caches are seen everywhere at once:
+#   redis://host:6379/0        Redis (needs the `redis` package)
+#   file:///var/tmp/visa-cache file-based stand-in shared by workers on one host
+# Without it each process keeps its own local-memory cache.
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+            'TIMEOUT': CACHE_DEFAULT_TTL,
+            'KEY_PREFIX': 'visa_v1',
+        }
+    }
+elif CACHE_URL.startswith('file://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_URL[len('file://'):],
+            'TIMEOUT': CACHE_DEFAULT_TTL,
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '1000')),
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'visa_v1_local_cache',
+            'TIMEOUT': CACHE_DEFAULT_TTL,
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '1000')),
+            },
+        }
+    }
+# Rebuild dirty catalog snapshots right after the admin write commits.
+# When disabled they are rebuilt lazily by the next public read.
+CATALOG_REBUILD_ON_COMMIT = os.getenv('CATALOG_REBUILD_ON_COMMIT', 'True') == 'True'
+# Per-process L1 in front of the shared cache for catalog snapshots (TTL in seconds)
+CATALOG_L1_TTL = int(os.getenv('CATALOG_L1_TTL', '60'))
+CATALOG_L1_MAX_ENTRIES = int(os.getenv('CATALOG_L1_MAX_ENTRIES', '256'))
+# Single-flight catalog fills: one request rebuilds a missing entry while the
+# others serve the previous build or wait up to CATALOG_FILL_WAIT seconds
+CATALOG_FILL_LOCK_TIMEOUT = 30
+CATALOG_FILL_WAIT = 2.0
+CATALOG_FILL_POLL_INTERVAL = 0.05
+# Keyset pages of the public country / visa type lists (?limit= / ?cursor=)
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', '20'))
+CATALOG_MAX_PAGE_SIZE = 100
+# Largest ?ids= batch accepted by the visa type and country lists
+CATALOG_MAX_BATCH_IDS = 50
+# Visa type cards included in the /api/bootstrap/ document
+CATALOG_BOOTSTRAP_VISA_TYPES = int(os.getenv('CATALOG_BOOTSTRAP_VISA_TYPES', '6'))
+# Catalog snapshots carry precompressed gzip (and brotli, when the `brotli`
+# package is installed) variants of bodies at least this large
+CATALOG_COMPRESS_MIN_SIZE = 512
+
+# Document files of one submission uploaded to storage at the same time
+STORAGE_UPLOAD_CONCURRENCY = int(os.getenv('STORAGE_UPLOAD_CONCURRENCY', '4'))
+# Backend of direct-to-storage uploads (upload intents); core.storage_backends.LocalStorage
+# keeps files under LOCAL_STORAGE_ROOT for development without Supabase
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'core.storage_backends.SupabaseStorage')
+STORAGE_BUCKET = os.getenv('STORAGE_BUCKET', 'visa')
+LOCAL_STORAGE_ROOT = os.getenv('LOCAL_STORAGE_ROOT') or None
+# Absolute URL LOCAL_STORAGE_ROOT is served from (MEDIA_ROOT/storage by default)
+LOCAL_STORAGE_URL = os.getenv('LOCAL_STORAGE_URL', 'http://localhost:8000/media/storage/')
+# Seconds an upload intent (and its signed upload URL) stays valid
+UPLOAD_INTENT_MAX_AGE = int(os.getenv('UPLOAD_INTENT_MAX_AGE', '900'))
+# Document uploads are spooled here and sent to storage by `manage.py run_upload_worker`,
+# retried with exponential backoff (seconds) until UPLOAD_MAX_ATTEMPTS. The directory must
+# be writable and shared with the worker; the BASE_DIR default is read-only on Vercel,
+# where only the per-instance /tmp is writable. `manage.py check` reports an unwritable one.
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR', os.path.join(BASE_DIR, 'upload_spool'))
+UPLOAD_RETRY_BASE_DELAY = 5
+UPLOAD_RETRY_MAX_DELAY = 600
+UPLOAD_MAX_ATTEMPTS = int(os.getenv('UPLOAD_MAX_ATTEMPTS', '8'))
+# A claimed job becomes due again after this many seconds if its worker dies
+UPLOAD_CLAIM_LEASE = 300
 
 # Email (Gmail SMTP) configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
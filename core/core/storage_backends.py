@@ -0,0 +1,132 @@
+"""
+Storage backends for direct-to-storage uploads.
+
+A client asks the API for an upload intent, sends the file bytes straight to
+the URL the backend signs for it, then confirms; Django never sees the bytes.
+``STORAGE_BACKEND`` names the backend class: ``SupabaseStorage`` in
+production, ``LocalStorage`` to develop and test without network access.
+"""
+import os
+from pathlib import Path
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+
+class StorageBackend:
+    """What the upload intent and confirm endpoints need from a storage service."""
+
+    def __init__(self, bucket=None):
+        self.bucket = bucket or getattr(settings, 'STORAGE_BUCKET', 'visa')
+
+    def create_upload(self, path) -> dict:
+        """
+        Where and how to send the bytes of the object at ``path``:
+        ``{"url", "method", "headers"}``.
+        """
+        raise NotImplementedError
+
+    def size(self, path):
+        """Size in bytes of the object at ``path``, None when there is no such object."""
+        raise NotImplementedError
+
+    def delete(self, path) -> None:
+        raise NotImplementedError
+
+    def public_url(self, path) -> str:
+        raise NotImplementedError
+
+
+class SupabaseStorage(StorageBackend):
+    """Supabase storage; uploads go to a signed upload URL of the bucket."""
+
+    def _bucket(self):
+        from core.supabase_client import get_supabase
+        return get_supabase().storage.from_(self.bucket)
+
+    def create_upload(self, path) -> dict:
+        signed = self._bucket().create_signed_upload_url(path)
+        return {'url': signed['signed_url'], 'method': 'PUT', 'headers': {}}
+
+    def size(self, path):
+        # This storage3 version has no stat call: search the object's folder
+        folder, _, name = path.rpartition('/')
+        found = self._bucket().list(folder, {'search': name, 'limit': 100})
+        for item in found or ():
+            if item.get('name') == name:
+                return (item.get('metadata') or {}).get('size', 0)
+        return None
+
+    def delete(self, path) -> None:
+        self._bucket().remove([path])
+
+    def public_url(self, path) -> str:
+        return self._bucket().get_public_url(path)
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files under ``LOCAL_STORAGE_ROOT``, served from ``LOCAL_STORAGE_URL``.
+    Upload URLs point at the local upload endpoint and carry a signed,
+    expiring token, the way a storage service would sign them.
+    """
+    salt = 'core.storage_backends.LocalStorage'
+
+    def __init__(self, bucket=None):
+        super().__init__(bucket)
+        root = getattr(settings, 'LOCAL_STORAGE_ROOT', None) or os.path.join(settings.MEDIA_ROOT, 'storage')
+        self.root = Path(root) / self.bucket
+
+    def create_upload(self, path) -> dict:
+        token = signing.dumps({'bucket': self.bucket, 'path': path}, salt=self.salt)
+        return {
+            'url': reverse('local-storage-upload', kwargs={'token': token}),
+            'method': 'PUT',
+            'headers': {},
+        }
+
+    def path_for_token(self, token, max_age) -> str:
+        """The object path a token was signed for; raises ``signing.BadSignature`` (or its subclass ``SignatureExpired``)."""
+        data = signing.loads(token, salt=self.salt, max_age=max_age)
+        if data.get('bucket') != self.bucket:
+            raise signing.BadSignature('Token was signed for another bucket')
+        return data['path']
+
+    def local_path(self, path) -> Path:
+        full = (self.root / path).resolve()
+        if not full.is_relative_to(self.root.resolve()):
+            raise ValueError(f"{path!r} is outside the storage root")
+        return full
+
+    def save(self, path, chunks) -> int:
+        """Write the object from an iterable of byte chunks; returns its size."""
+        full = self.local_path(path)
+        full.parent.mkdir(parents=True, exist_ok=True)
+        size = 0
+        with open(full, 'wb') as out:
+            for chunk in chunks:
+                out.write(chunk)
+                size += len(chunk)
+        return size
+
+    def size(self, path):
+        try:
+            return self.local_path(path).stat().st_size
+        except (ValueError, FileNotFoundError):
+            return None
+
+    def delete(self, path) -> None:
+        self.local_path(path).unlink(missing_ok=True)
+
+    def public_url(self, path) -> str:
+        base = getattr(settings, 'LOCAL_STORAGE_URL', 'http://localhost:8000/media/storage/')
+        return urljoin(base.rstrip('/') + '/', f"{self.bucket}/{path}")
+
+
+def get_storage(bucket=None) -> StorageBackend:
+    """An instance of the configured ``STORAGE_BACKEND``."""
+    backend = getattr(settings, 'STORAGE_BACKEND', 'core.storage_backends.SupabaseStorage')
+    return import_string(backend)(bucket)
@@ -3,7 +3,7 @@ from django.contrib import admin
 # Register your models here.
 
 
-from .models import VisaType, Country, VisaProcess, VisaOverview, Notes, RequiredDocuments,VisaApplication,ApplicationDocument
+from .models import VisaType, Country, VisaProcess, VisaOverview, Notes, RequiredDocuments,VisaApplication,ApplicationDocument,UploadJob,StoredObject
 
 admin.site.register(VisaType)
 admin.site.register(Country)    
@@ -12,4 +12,6 @@ admin.site.register(VisaOverview)
 admin.site.register(Notes)
 admin.site.register(RequiredDocuments)
 admin.site.register(VisaApplication)
-admin.site.register(ApplicationDocument)
\ No newline at end of file
+admin.site.register(ApplicationDocument)
+admin.site.register(UploadJob)
+admin.site.register(StoredObject)
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+Per-user cache of serialized visa applications.
+
+Each application is cached once per response shape under its own key, and
+every user has an ordered index of application ids per shape. Lists are read
+back with one ``get_many`` over the index, serializing only entries that have
+expired. Writes replace or drop the entry of the application that changed and
+patch the index, so a document upload costs one application's serialization
+however many applications the user has. Index patches hold a short lock so
+concurrent writers cannot drop each other's change; a writer that cannot get
+it drops the index instead, and the next read rebuilds it.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import VisaApplication
+from .serializers import UserVisaApplicationSerializer, VisaApplicationSerializer
+
+logger = logging.getLogger(__name__)
+
+# Response shapes: the v1 and v2 application endpoints render differently
+V1 = 'v1'
+V2 = 'v2'
+SHAPES = {
+    V1: VisaApplicationSerializer,
+    V2: UserVisaApplicationSerializer,
+}
+
+# Lists are newest first, so a new application goes to the front of the index
+ORDERING = ('-created_at', '-id')
+
+# Seconds an index patch may hold its lock (it covers one get and one set) and how
+# long a writer waits for it; a lock still busy then belongs to a writer that died
+INDEX_LOCK_TIMEOUT = 5
+INDEX_LOCK_WAIT = 0.5
+
+
+def _ttl() -> int:
+    return getattr(settings, 'CACHE_DEFAULT_TTL', 300)
+
+
+def index_key(user_id, shape) -> str:
+    return f"user:{user_id}:applications:{shape}"
+
+
+def entry_key(user_id, shape, application_id) -> str:
+    return f"user:{user_id}:application:{shape}:{application_id}"
+
+
+def applications():
+    """Applications with everything the serializers read prefetched."""
+    return VisaApplication.objects.select_related('country', 'visa_type', 'user').prefetch_related(
+        'documents__required_document', 'visa_type__required_documents'
+    )
+
+
+def _serialize(shape, queryset) -> dict:
+    """id -> serialized application, in queryset order."""
+    return {item['id']: item for item in SHAPES[shape](queryset, many=True).data}
+
+
+def _store(user_id, shape, entries) -> None:
+    cache.set_many({entry_key(user_id, shape, pk): entry for pk, entry in entries.items()}, _ttl())
+
+
+def _patch_index(user_id, shape, change) -> None:
+    """Apply ``change(ids) -> ids`` to a cached index under its lock."""
+    key = index_key(user_id, shape)
+    lock_key = f"{key}:lock"
+    deadline = time.monotonic() + INDEX_LOCK_WAIT
+    while not cache.add(lock_key, 1, INDEX_LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            cache.delete(key)
+            logger.warning("Dropped application index of user %s (%s), its lock was busy", user_id, shape)
+            return
+        time.sleep(0.01)
+    try:
+        ids = cache.get(key)
+        if ids is not None:
+            patched = change(ids)
+            if patched != ids:
+                cache.set(key, patched, _ttl())
+    finally:
+        cache.delete(lock_key)
+
+
+def get_list(user_id, shape) -> list:
+    """A user's serialized applications, newest first."""
+    ids = cache.get(index_key(user_id, shape))
+    if ids is None:
+        entries = _serialize(shape, applications().filter(user_id=user_id).order_by(*ORDERING))
+        _store(user_id, shape, entries)
+        cache.set(index_key(user_id, shape), list(entries), _ttl())
+        logger.info("Cached %s application list of user %s (%d entries)", shape, user_id, len(entries))
+        return list(entries.values())
+
+    keys = {entry_key(user_id, shape, pk): pk for pk in ids}
+    entries = {keys[key]: entry for key, entry in cache.get_many(list(keys)).items()}
+    missing = [pk for pk in ids if pk not in entries]
+    if missing:
+        found = _serialize(shape, applications().filter(user_id=user_id, id__in=missing))
+        _store(user_id, shape, found)
+        entries.update(found)
+        if len(found) < len(missing):
+            # Deleted without the index being patched
+            ids = [pk for pk in ids if pk in entries]
+            _patch_index(user_id, shape, lambda current: [pk for pk in current if pk in entries or pk not in missing])
+    return [entries[pk] for pk in ids]
+
+
+def get_detail(user_id, shape, application_id):
+    """One of the user's serialized applications, None when it is not theirs."""
+    key = entry_key(user_id, shape, application_id)
+    entry = cache.get(key)
+    if entry is None:
+        application = applications().filter(id=application_id, user_id=user_id).first()
+        if application is None:
+            return None
+        entry = SHAPES[shape](application).data
+        cache.set(key, entry, _ttl())
+    return entry
+
+
+def put(application) -> None:
+    """Re-serialize a created or changed application into every shape."""
+    application = applications().get(pk=application.pk)
+    user_id = application.user_id
+    for shape, serializer in SHAPES.items():
+        cache.set(entry_key(user_id, shape, application.id), serializer(application).data, _ttl())
+        _patch_index(user_id, shape, lambda ids: ids if application.id in ids else [application.id, *ids])
+    logger.info("Updated cached application %s of user %s", application.id, user_id)
+
+
+def remove(user_id, application_id) -> None:
+    """Drop a deleted application's entries and take it out of the indexes."""
+    for shape in SHAPES:
+        cache.delete(entry_key(user_id, shape, application_id))
+        _patch_index(user_id, shape, lambda ids: [pk for pk in ids if pk != application_id])
+    logger.info("Removed cached application %s of user %s", application_id, user_id)
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class VisaSetupConfig(AppConfig):
@@ -7,4 +8,7 @@ class VisaSetupConfig(AppConfig):
 
     def ready(self):
         # Import signal handlers
-        from . import signals  # noqa: F401
\ No newline at end of file
+        from . import checks, signals  # noqa: F401
+        from .search import ensure_indexes
+        # Search indexes are raw SQL (GIN expressions, pg_trgm), kept out of the models
+        post_migrate.connect(ensure_indexes, sender=self)
\ No newline at end of file
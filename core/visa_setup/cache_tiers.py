@@ -0,0 +1,140 @@
+"""
+Two-tier cache used by the catalog: a tiny per-process L1 (bounded LRU with a
+TTL in seconds) in front of the shared L2 Django cache.
+
+Only immutable entries belong in L1. Catalog snapshots qualify because their
+keys carry the generation they were built for; generation counters and other
+mutable keys must go through ``shared`` so every worker sees changes at once.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+_MISSING = object()
+
+
+class LocalCache:
+    """Bounded in-process LRU whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache:
+    """L1 in-process / L2 shared cache facade with batched multi-key access."""
+
+    def __init__(self, alias: str = 'default', l1_max_entries: int = 256, l1_ttl: float = 60):
+        self.alias = alias
+        self.local = LocalCache(l1_max_entries, l1_ttl)
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def shared(self):
+        # Resolved per call so settings overrides (and per-thread connections) apply
+        return caches[self.alias]
+
+    def _count(self, tier: str, hits: int, misses: int) -> None:
+        with self._stats_lock:
+            self._stats[tier]['hits'] += hits
+            self._stats[tier]['misses'] += misses
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is not _MISSING:
+            self._count('l1', 1, 0)
+            return value
+        self._count('l1', 0, 1)
+        value = self.shared.get(key, _MISSING)
+        if value is _MISSING:
+            self._count('l2', 0, 1)
+            return default
+        self._count('l2', 1, 0)
+        self.local.set(key, value)
+        return value
+
+    def get_many(self, keys) -> dict:
+        found = {}
+        remote_keys = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is _MISSING:
+                remote_keys.append(key)
+            else:
+                found[key] = value
+        self._count('l1', len(found), len(remote_keys))
+        if remote_keys:
+            remote = self.shared.get_many(remote_keys)
+            self._count('l2', len(remote), len(remote_keys) - len(remote))
+            for key, value in remote.items():
+                self.local.set(key, value)
+            found.update(remote)
+        return found
+
+    def set(self, key, value, timeout=None) -> None:
+        self.shared.set(key, value, timeout)
+        self.local.set(key, value)
+
+    def set_many(self, mapping: dict, timeout=None) -> None:
+        if not mapping:
+            return
+        self.shared.set_many(mapping, timeout)
+        for key, value in mapping.items():
+            self.local.set(key, value)
+
+    def delete(self, key) -> None:
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {tier: dict(counts) for tier, counts in self._stats.items()}
+
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self._stats = {
+                'l1': {'hits': 0, 'misses': 0},
+                'l2': {'hits': 0, 'misses': 0},
+            }
+
+
+catalog_cache = TieredCache(
+    l1_max_entries=getattr(settings, 'CATALOG_L1_MAX_ENTRIES', 256),
+    l1_ttl=getattr(settings, 'CATALOG_L1_TTL', 60),
+)
@@ -0,0 +1,710 @@
+"""
+Prerendered snapshots of the public catalog.
+
+Builders render through the values-based path in ``catalog_values``, which
+produces the same bytes as the serializers without instantiating models.
+
+Catalog endpoints are served from the final JSON bytes kept in the cache, so a
+cache hit costs a generation check against the shared cache, an in-process
+(or shared) lookup of the snapshot and writing the body. Keys live in versioned
+namespaces, one generation counter per entity family. The handlers in
+``signals.py`` only mark entities dirty; once the transaction commits a single
+flush bumps each dirty family once and rebuilds the affected entries once.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import brotli
+except ImportError:  # optional, snapshots then only carry a gzip variant
+    brotli = None
+
+from .cache_tiers import catalog_cache
+from .catalog_values import compile_serializer
+from .models import Country, Settings, VisaType
+from .serializers import (
+    CountrySerializer, CountryDetailsSerializer, DetailedVisaTypeSerializer, SettingsSerializer, VisaTypeSerializer,
+)
+
+logger = logging.getLogger(__name__)
+
+# Nested arrays of a visa type, embedded on demand with ?expand=
+VISA_TYPE_NESTED = ('processes', 'overviews', 'notes', 'required_documents')
+
+# Key families, each invalidated as a whole by bumping its generation
+COUNTRIES = 'countries'                     # country list and country details
+VISA_TYPES = 'visa_types'                   # visa type list and visa type details
+COUNTRY_VISA_TYPES = 'country_visa_types'   # per-country visa type lists
+SETTINGS = 'settings'
+BOOTSTRAP = 'bootstrap'                     # first paint document, bumped along with its parts
+
+# Families the bootstrap document is assembled from
+BOOTSTRAP_PARTS = (COUNTRIES, VISA_TYPES, SETTINGS)
+
+LIST_NAME = 'active'
+SETTINGS_NAME = 'site'
+BOOTSTRAP_NAME = 'first-paint'
+
+# Visa type card fields embedded in the bootstrap document
+FEATURED_VISA_TYPE_FIELDS = ('id', 'name', 'headings', 'image', 'price')
+
+# Keyset orderings of the paginated lists, the last column is the unique tiebreaker
+VISA_TYPE_ORDERING = ('-created_at', 'id')
+COUNTRY_ORDERING = ('name', 'id')
+
+
+def _generation_key(family: str) -> str:
+    return f"catalog:gen:{family}"
+
+
+def _entry_key(family: str, generation: int, name) -> str:
+    return f"catalog:{family}:g{generation}:{name}"
+
+
+def _latest_key(family: str, name) -> str:
+    # Points at the generation holding the most recent build of an entry
+    return f"catalog:latest:{family}:{name}"
+
+
+def _lock_key(family: str, generation: int, name) -> str:
+    return f"catalog:lock:{family}:g{generation}:{name}"
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Rendered response body of a catalog endpoint."""
+    body: bytes
+    content_length: int
+    digest: str
+    # Epoch seconds of the first build that produced this body
+    last_modified: int = 0
+    # Epoch seconds of the build that produced this copy, drives the soft TTL
+    built_at: float = 0
+    # Content-Encoding -> precompressed body, only kept when it saves bytes
+    encodings: dict = field(default_factory=dict)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.digest}"'
+
+
+def _ttl() -> int:
+    return getattr(settings, 'CACHE_DEFAULT_TTL', 300)
+
+
+def _ttls(family: str) -> tuple:
+    """(soft, hard) TTL of a family: stale after soft, evicted after hard."""
+    ttls = getattr(settings, 'CATALOG_CACHE_TTLS', {}).get(family, {})
+    hard = ttls.get('hard', _ttl())
+    return ttls.get('soft', hard), hard
+
+
+def compress(body: bytes) -> dict:
+    """Precompressed variants of a body, worth it only for larger payloads."""
+    if len(body) < getattr(settings, 'CATALOG_COMPRESS_MIN_SIZE', 512):
+        return {}
+    # mtime=0 keeps the gzip bytes identical across rebuilds of the same body
+    variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(body, quality=11)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(body)}
+
+
+def render_snapshot(data) -> CatalogSnapshot:
+    body = JSONRenderer().render(data)
+    now = time.time()
+    return CatalogSnapshot(
+        body=body,
+        content_length=len(body),
+        digest=hashlib.sha256(body).hexdigest(),
+        last_modified=int(now),
+        built_at=now,
+        encodings=compress(body),
+    )
+
+
+# Preferred first when the client accepts several encodings equally
+ENCODING_PREFERENCE = ('br', 'gzip')
+
+
+def negotiate_encoding(accept_encoding: str, available) -> str | None:
+    """Pick the best available Content-Encoding, None for the identity body."""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    best, best_quality = None, 0.0
+    for coding in ENCODING_PREFERENCE:
+        if coding not in available:
+            continue
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def _set_validators(response, snapshot: CatalogSnapshot, encoding=None):
+    # Compressed variants are the same representation, so they share a weak ETag
+    response['ETag'] = f'W/{snapshot.etag}' if encoding else snapshot.etag
+    response['Last-Modified'] = http_date(snapshot.last_modified)
+    response['Cache-Control'] = 'public, no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def snapshot_response(request, snapshot: CatalogSnapshot) -> HttpResponse:
+    """
+    Answer with the snapshot body in the best encoding the client accepts,
+    or with a 304 when the client validators (If-None-Match /
+    If-Modified-Since) still match it.
+    """
+    encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), snapshot.encodings)
+    not_modified = get_conditional_response(
+        request, etag=snapshot.etag, last_modified=snapshot.last_modified
+    )
+    if not_modified is not None:
+        return _set_validators(not_modified, snapshot, encoding)
+    body = snapshot.encodings[encoding] if encoding else snapshot.body
+    response = HttpResponse(body, content_type='application/json')
+    response['Content-Length'] = len(body)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return _set_validators(response, snapshot, encoding)
+
+
+def _new_generation() -> int:
+    # Time based so a restarted counter never reuses a generation that is still cached
+    return time.time_ns() // 1000
+
+
+def get_generation(family: str) -> int:
+    # Always read from the shared tier: this is the cross-worker version check
+    shared = catalog_cache.shared
+    key = _generation_key(family)
+    generation = shared.get(key)
+    if generation is None:
+        shared.add(key, _new_generation(), None)
+        generation = shared.get(key)
+    return generation
+
+
+def bump(*families: str) -> None:
+    """
+    Invalidate every entry of the given families with one increment each.
+    The bootstrap document moves on with any of its parts.
+    """
+    if BOOTSTRAP not in families and any(family in BOOTSTRAP_PARTS for family in families):
+        families = (*families, BOOTSTRAP)
+    shared = catalog_cache.shared
+    for family in families:
+        key = _generation_key(family)
+        try:
+            shared.incr(key)
+        except ValueError:
+            shared.set(key, _new_generation(), None)
+        logger.info("Bumped catalog generation for %s", family)
+
+
+# ---------------- Builders ----------------
+# Each builder returns every snapshot it rendered, keyed by entry name, so visa
+# type list builds also hydrate the detail entries of the same family.
+
+def active_country_types():
+    """Visa types shown in a country detail: active ones, only the rendered columns."""
+    return VisaType.objects.filter(active=True).only(*VisaTypeSerializer.Meta.fields)
+
+
+def _country_details(countries) -> list:
+    return compile_serializer(CountryDetailsSerializer).serialize(
+        countries, related={'types': active_country_types()}
+    )
+
+
+def build_countries() -> dict:
+    # The list does not render types, details are built on their own
+    rows = compile_serializer(CountrySerializer).serialize(Country.objects.filter(active=True))
+    logger.info("Built countries snapshot with %d countries", len(rows))
+    return {LIST_NAME: render_snapshot(rows)}
+
+
+def build_country(country_id) -> dict:
+    rendered = _country_details(Country.objects.filter(id=country_id, active=True))
+    if not rendered:
+        return {}
+    return {str(country_id): render_snapshot(rendered[0])}
+
+
+def build_country_visa_types(country_id, shape=None) -> dict:
+    if not Country.objects.filter(id=country_id, active=True).exists():
+        return {}
+    visa_types = VisaType.objects.filter(countries=country_id, active=True)
+    data = compile_serializer(DetailedVisaTypeSerializer).serialize(visa_types, shape)
+    return {_shaped(country_id, shape): render_snapshot(data)}
+
+
+def build_visa_types(shape=None) -> dict:
+    serialized = compile_serializer(DetailedVisaTypeSerializer).serialize(VisaType.objects.filter(active=True), shape)
+    if shape is not None:
+        # Partial rows cannot stand in for the detail entries
+        return {_shaped(LIST_NAME, shape): render_snapshot(serialized)}
+    entries = {str(item['id']): render_snapshot(item) for item in serialized}
+    entries[LIST_NAME] = render_snapshot(serialized)
+    logger.info("Built visa types snapshot and hydrated %d visa type entries", len(serialized))
+    return entries
+
+
+def build_visa_type(visa_type_id) -> dict:
+    rendered = compile_serializer(DetailedVisaTypeSerializer).serialize(VisaType.objects.filter(id=visa_type_id, active=True))
+    if not rendered:
+        return {}
+    return {str(visa_type_id): render_snapshot(rendered[0])}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def visa_type_shape(fields=None, expand=None) -> tuple | None:
+    """
+    Canonical field tuple for ?fields= / ?expand=, None for the full shape.
+
+    ``fields`` picks the top-level fields (all scalar fields when omitted) and
+    ``expand`` names the nested arrays to embed; nested arrays are left out
+    unless expanded or listed in ``fields``.
+    """
+    if fields is None and expand is None:
+        return None
+    available = DetailedVisaTypeSerializer.Meta.fields
+    expand = set(expand or ())
+    if expand - set(VISA_TYPE_NESTED):
+        raise InvalidFields(f"Cannot expand: {', '.join(sorted(expand - set(VISA_TYPE_NESTED)))}")
+    requested = set(fields) if fields is not None else {f for f in available if f not in VISA_TYPE_NESTED}
+    if requested - set(available):
+        raise InvalidFields(f"Unknown fields: {', '.join(sorted(requested - set(available)))}")
+    shape = tuple(f for f in available if f in requested | expand)
+    if not shape:
+        raise InvalidFields("No fields selected")
+    return None if shape == tuple(available) else shape
+
+
+def _shaped(name, shape) -> str:
+    # Every field combination is cached under its own entry name
+    return str(name) if shape is None else f"{name}|{','.join(shape)}"
+
+
+def encode_cursor(position) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(position, list) or len(position) != 2:
+        raise InvalidCursor("Invalid cursor")
+    return position
+
+
+def _visa_types_after(position) -> Q:
+    try:
+        created_at = parse_datetime(str(position[0]))
+    except (ValueError, TypeError):
+        # Well formed but not a real date, e.g. month 13
+        raise InvalidCursor("Invalid cursor")
+    if created_at is None or not isinstance(position[1], int):
+        raise InvalidCursor("Invalid cursor")
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, id__gt=position[1])
+
+
+def _countries_after(position) -> Q:
+    if not isinstance(position[0], str) or not isinstance(position[1], int):
+        raise InvalidCursor("Invalid cursor")
+    return Q(name__gt=position[0]) | Q(name=position[0], id__gt=position[1])
+
+
+def _page_name(limit: int, cursor) -> str:
+    # Cursors are client input of any length, keep the cache key bounded
+    token = hashlib.sha1(cursor.encode()).hexdigest()[:16] if cursor else 'first'
+    return f"page:{limit}:{token}"
+
+
+def _page(queryset, ordering, after, position, limit: int, cursor):
+    """One keyset page: rows strictly after the cursor plus the next cursor."""
+    if cursor:
+        queryset = queryset.filter(after)
+    rows = list(queryset.order_by(*ordering)[:limit + 1])
+    next_cursor = encode_cursor(position(rows[limit - 1])) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def build_visa_type_page(limit: int, cursor, after, shape=None) -> dict:
+    compiled = compile_serializer(DetailedVisaTypeSerializer)
+    rows, next_cursor = _page(
+        compiled.values(VisaType.objects.filter(active=True), shape, extra=('created_at',)),
+        VISA_TYPE_ORDERING, after, lambda row: [row['created_at'].isoformat(), row['id']], limit, cursor,
+    )
+    serialized = compiled.render(rows, shape)
+    page = render_snapshot({'results': serialized, 'next_cursor': next_cursor})
+    if shape is not None:
+        return {_shaped(_page_name(limit, cursor), shape): page}
+    entries = {str(item['id']): render_snapshot(item) for item in serialized}
+    entries[_page_name(limit, cursor)] = page
+    return entries
+
+
+def build_country_page(limit: int, cursor, after) -> dict:
+    compiled = compile_serializer(CountrySerializer)
+    rows, next_cursor = _page(
+        compiled.values(Country.objects.filter(active=True)),
+        COUNTRY_ORDERING, after, lambda row: [row['name'], row['id']], limit, cursor,
+    )
+    return {_page_name(limit, cursor): render_snapshot({'results': compiled.render(rows), 'next_cursor': next_cursor})}
+
+
+def build_settings() -> dict:
+    site_settings = Settings.objects.first()
+    if site_settings is None:
+        return {}
+    return {SETTINGS_NAME: render_snapshot(SettingsSerializer(site_settings).data)}
+
+
+# ---------------- Read path ----------------
+
+def _store(family: str, generation: int, entries: dict) -> dict:
+    """Cache freshly built entries, keeping Last-Modified of unchanged bodies."""
+    if not entries:
+        return entries
+    # Latest pointers are mutable, they only live in the shared tier
+    latest_keys = {name: _latest_key(family, name) for name in entries}
+    latest = catalog_cache.shared.get_many(latest_keys.values())
+    previous_keys = {
+        name: _entry_key(family, latest[key], name)
+        for name, key in latest_keys.items()
+        if key in latest
+    }
+    previous = catalog_cache.get_many(previous_keys.values())
+    snapshots = {}
+    for name, snapshot in entries.items():
+        before = previous.get(previous_keys.get(name))
+        if before is not None and before.digest == snapshot.digest:
+            entries[name] = snapshot = replace(snapshot, last_modified=before.last_modified)
+        snapshots[_entry_key(family, generation, name)] = snapshot
+    hard_ttl = _ttls(family)[1]
+    catalog_cache.set_many(snapshots, hard_ttl)
+    catalog_cache.shared.set_many({key: generation for key in latest_keys.values()}, hard_ttl)
+    return entries
+
+
+def _previous_snapshot(family: str, name) -> CatalogSnapshot | None:
+    generation = catalog_cache.shared.get(_latest_key(family, name))
+    if generation is None:
+        return None
+    return catalog_cache.get(_entry_key(family, generation, name))
+
+
+def _wait_for_fill(key: str, lock_key: str) -> CatalogSnapshot | None:
+    """Poll for the entry another request is building, until its lock goes away."""
+    shared = catalog_cache.shared
+    deadline = time.monotonic() + getattr(settings, 'CATALOG_FILL_WAIT', 2.0)
+    while time.monotonic() < deadline:
+        time.sleep(getattr(settings, 'CATALOG_FILL_POLL_INTERVAL', 0.05))
+        snapshot = catalog_cache.get(key)
+        if snapshot is not None or shared.get(lock_key) is None:
+            return snapshot
+    return None
+
+
+def _is_stale(family: str, snapshot: CatalogSnapshot) -> bool:
+    return time.time() - snapshot.built_at > _ttls(family)[0]
+
+
+def _revalidate(family: str, generation: int, name, builder, *args) -> None:
+    """Refresh a stale entry once, in the background unless disabled."""
+    shared = catalog_cache.shared
+    lock_key = _lock_key(family, generation, name)
+    if not shared.add(lock_key, 1, getattr(settings, 'CATALOG_FILL_LOCK_TIMEOUT', 30)):
+        return
+    in_background = getattr(settings, 'CATALOG_REFRESH_IN_BACKGROUND', True)
+
+    def refresh():
+        try:
+            _store(family, generation, builder(*args))
+            logger.info("Revalidated %s", _entry_key(family, generation, name))
+        except Exception:
+            logger.exception("Failed to revalidate %s", _entry_key(family, generation, name))
+        finally:
+            shared.delete(lock_key)
+            if in_background:
+                connections.close_all()
+
+    if in_background:
+        threading.Thread(target=refresh, daemon=True).start()
+    else:
+        refresh()
+
+
+def _get_or_build(family: str, name, builder, *args) -> CatalogSnapshot | None:
+    generation = get_generation(family)
+    key = _entry_key(family, generation, name)
+    snapshot = catalog_cache.get(key)
+    if snapshot is not None and _is_stale(family, snapshot):
+        # Our L1 copy may predate a refresh another worker already shared
+        fresher = catalog_cache.shared.get(key)
+        if fresher is not None and fresher.built_at > snapshot.built_at:
+            catalog_cache.local.set(key, fresher)
+            snapshot = fresher
+    if snapshot is not None:
+        if _is_stale(family, snapshot):
+            # Stale while revalidate: answer now, one refresh runs behind us
+            _revalidate(family, generation, name, builder, *args)
+        logger.info("Serving %s from cache", key)
+        return snapshot
+
+    # Single flight: one request per key recomputes, the others serve the
+    # previous build or wait briefly for the new one
+    shared = catalog_cache.shared
+    lock_key = _lock_key(family, generation, name)
+    if not shared.add(lock_key, 1, getattr(settings, 'CATALOG_FILL_LOCK_TIMEOUT', 30)):
+        snapshot = _previous_snapshot(family, name) or _wait_for_fill(key, lock_key)
+        if snapshot is not None:
+            logger.info("Serving %s while another request rebuilds it", key)
+            return snapshot
+        logger.info("Gave up waiting for %s, building it here", key)
+        return _store(family, generation, builder(*args)).get(str(name))
+    try:
+        entries = _store(family, generation, builder(*args))
+    finally:
+        shared.delete(lock_key)
+    logger.info("Cached %s", key)
+    return entries.get(str(name))
+
+
+def get_countries() -> CatalogSnapshot:
+    return _get_or_build(COUNTRIES, LIST_NAME, build_countries)
+
+
+def get_country(country_id) -> CatalogSnapshot | None:
+    return _get_or_build(COUNTRIES, country_id, build_country, country_id)
+
+
+def get_country_visa_types(country_id, shape=None) -> CatalogSnapshot | None:
+    return _get_or_build(
+        COUNTRY_VISA_TYPES, _shaped(country_id, shape), build_country_visa_types, country_id, shape
+    )
+
+
+def get_visa_types(shape=None) -> CatalogSnapshot:
+    return _get_or_build(VISA_TYPES, _shaped(LIST_NAME, shape), build_visa_types, shape)
+
+
+def get_visa_type(visa_type_id) -> CatalogSnapshot | None:
+    return _get_or_build(VISA_TYPES, visa_type_id, build_visa_type, visa_type_id)
+
+
+def get_visa_type_page(limit: int, cursor=None, shape=None) -> CatalogSnapshot:
+    """A page of the visa type list; raises InvalidCursor for a bad cursor."""
+    after = _visa_types_after(decode_cursor(cursor)) if cursor else None
+    return _get_or_build(
+        VISA_TYPES, _shaped(_page_name(limit, cursor), shape), build_visa_type_page, limit, cursor, after, shape
+    )
+
+
+def get_country_page(limit: int, cursor=None) -> CatalogSnapshot:
+    """A page of the country list; raises InvalidCursor for a bad cursor."""
+    after = _countries_after(decode_cursor(cursor)) if cursor else None
+    return _get_or_build(COUNTRIES, _page_name(limit, cursor), build_country_page, limit, cursor, after)
+
+
+def build_visa_types_by_id(ids) -> dict:
+    visa_types = VisaType.objects.filter(id__in=ids, active=True)
+    return {str(item['id']): render_snapshot(item)
+            for item in compile_serializer(DetailedVisaTypeSerializer).serialize(visa_types)}
+
+
+def build_countries_by_id(ids) -> dict:
+    countries = Country.objects.filter(id__in=ids, active=True)
+    return {str(item['id']): render_snapshot(item) for item in _country_details(countries)}
+
+
+def _get_many(family: str, ids, build_many, build_one, not_found: str) -> CatalogSnapshot:
+    """
+    Detail entries for ``ids`` as one JSON array in request order: cached entries
+    come from a single multi-get, the misses from one batched build. Unknown ids
+    get an {"id", "error"} marker in their slot.
+    """
+    generation = get_generation(family)
+    keys = {entity_id: _entry_key(family, generation, entity_id) for entity_id in ids}
+    cached = catalog_cache.get_many(set(keys.values()))
+    snapshots = {}
+    for entity_id, key in keys.items():
+        snapshot = cached.get(key)
+        if snapshot is not None:
+            snapshots[entity_id] = snapshot
+            if _is_stale(family, snapshot):
+                _revalidate(family, generation, entity_id, build_one, entity_id)
+    misses = [entity_id for entity_id in keys if entity_id not in snapshots]
+    if misses:
+        built = _store(family, generation, build_many(misses))
+        snapshots.update((entity_id, built[str(entity_id)]) for entity_id in misses if str(entity_id) in built)
+        logger.info("Filled %d of %d %s batch entries with one build", len(misses), len(keys), family)
+    parts = [
+        snapshots[entity_id].body if entity_id in snapshots
+        else JSONRenderer().render({'id': entity_id, 'error': not_found})
+        for entity_id in ids
+    ]
+    body = b'[' + b','.join(parts) + b']'
+    # Assembled per request, so it carries no precompressed variants
+    return CatalogSnapshot(
+        body=body,
+        content_length=len(body),
+        digest=hashlib.sha256(body).hexdigest(),
+        last_modified=max((snapshot.last_modified for snapshot in snapshots.values()), default=int(time.time())),
+        built_at=time.time(),
+    )
+
+
+def get_visa_types_by_id(ids) -> CatalogSnapshot:
+    return _get_many(VISA_TYPES, ids, build_visa_types_by_id, build_visa_type, "Visa type not found")
+
+
+def get_countries_by_id(ids) -> CatalogSnapshot:
+    return _get_many(COUNTRIES, ids, build_countries_by_id, build_country, "Country not found")
+
+
+def _featured_limit() -> int:
+    return getattr(settings, 'CATALOG_BOOTSTRAP_VISA_TYPES', 6)
+
+
+def build_bootstrap() -> dict:
+    """
+    Countries, site settings and the first page of visa type cards in one
+    document, assembled from the cached bodies of its parts.
+    """
+    site_settings = get_settings()
+    body = b''.join([
+        b'{"countries":', get_countries().body,
+        b',"settings":', site_settings.body if site_settings is not None else b'null',
+        b',"visa_types":', get_visa_type_page(_featured_limit(), shape=FEATURED_VISA_TYPE_FIELDS).body,
+        b'}',
+    ])
+    now = time.time()
+    return {BOOTSTRAP_NAME: CatalogSnapshot(
+        body=body,
+        content_length=len(body),
+        digest=hashlib.sha256(body).hexdigest(),
+        last_modified=int(now),
+        built_at=now,
+        encodings=compress(body),
+    )}
+
+
+def get_bootstrap() -> CatalogSnapshot:
+    return _get_or_build(BOOTSTRAP, BOOTSTRAP_NAME, build_bootstrap)
+
+
+def get_settings() -> CatalogSnapshot | None:
+    return _get_or_build(SETTINGS, SETTINGS_NAME, build_settings)
+
+
+def warm() -> None:
+    """Rebuild the list snapshots (visa type lists hydrate their details) ahead of traffic."""
+    get_countries()
+    get_visa_types()
+    get_settings()
+    get_bootstrap()
+
+
+# ---------------- Deferred invalidation ----------------
+
+class _PendingRebuild(threading.local):
+    def __init__(self):
+        self.depth = 0
+        # family -> ids of the entities changed in it
+        self.dirty = {}
+
+
+_pending = _PendingRebuild()
+
+
+def mark_dirty(family: str, entity_id=None) -> None:
+    """Queue a family (and one of its entities) for the next flush."""
+    ids = _pending.dirty.setdefault(family, set())
+    if entity_id is not None:
+        ids.add(entity_id)
+    if not _pending.depth:
+        # flush is idempotent, extra callbacks find nothing left to do
+        transaction.on_commit(flush)
+
+
+@contextmanager
+def deferred_rebuild():
+    """
+    Coalesce every change made inside the block into one flush after commit.
+    Used around each request by the middleware, and usable for bulk imports.
+    """
+    _pending.depth += 1
+    try:
+        yield
+    finally:
+        _pending.depth -= 1
+        if not _pending.depth and _pending.dirty:
+            transaction.on_commit(flush)
+
+
+def flush() -> None:
+    dirty, _pending.dirty = _pending.dirty, {}
+    if not dirty:
+        return
+    bump(*dirty)
+    if not getattr(settings, 'CATALOG_REBUILD_ON_COMMIT', True):
+        return
+    try:
+        rebuild(dirty)
+    except Exception:
+        # Entries are rebuilt lazily by the next read anyway
+        logger.exception("Failed to rebuild catalog snapshots for %s", sorted(dirty))
+
+
+def rebuild(dirty: dict) -> None:
+    """Rebuild each affected entry once; list builds hydrate their details."""
+    if COUNTRIES in dirty:
+        get_countries()
+    if VISA_TYPES in dirty:
+        get_visa_types()
+    if SETTINGS in dirty:
+        get_settings()
+    if dirty.keys() & set(BOOTSTRAP_PARTS):
+        get_bootstrap()
+    for country_id in dirty.get(COUNTRY_VISA_TYPES, ()):
+        get_country_visa_types(country_id)
+    logger.info("Rebuilt catalog snapshots for %s", sorted(dirty))
@@ -0,0 +1,117 @@
+"""
+Values-based read path for the catalog builders.
+
+A read-only ModelSerializer is compiled once into the model columns it reads
+and the field objects that format them. Rows then come from ``.values()``
+queries and many-to-many relations are stitched together in Python, with one
+query per relation, instead of instantiating models and nested serializers
+for every row. Values are still formatted by the serializer's own fields, so
+the rendered JSON is byte-identical to the serializer output.
+"""
+import functools
+from collections import defaultdict
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+
+# SerializerMethodFields the values path knows how to reproduce:
+# field name -> (column, the get_<name> logic applied to the column value)
+METHOD_FIELDS = {
+    'image': ('image', lambda value: value if value else None),
+}
+
+
+def _nullable(to_representation):
+    # Serializer.to_representation renders None without calling the field
+    return lambda value: None if value is None else to_representation(value)
+
+
+class ValuesSerializer:
+    """Compiled form of a read-only ModelSerializer working on ``.values()`` rows."""
+
+    def __init__(self, serializer_class):
+        self.model = serializer_class.Meta.model
+        # (field name, column or None for nested, value -> representation)
+        self.fields = []
+        self.nested = {}
+        for name, field in serializer_class().fields.items():
+            if isinstance(field, serializers.ListSerializer):
+                self.nested[name] = compile_serializer(type(field.child))
+                self.fields.append((name, None, None))
+            elif isinstance(field, serializers.SerializerMethodField):
+                if name not in METHOD_FIELDS:
+                    raise ImproperlyConfigured(
+                        f"{serializer_class.__name__}.{name} has no values-path equivalent in METHOD_FIELDS"
+                    )
+                self.fields.append((name, *METHOD_FIELDS[name]))
+            elif isinstance(field, serializers.BaseSerializer) or '.' in field.source:
+                raise ImproperlyConfigured(
+                    f"{serializer_class.__name__}.{name} is not supported by the values path"
+                )
+            else:
+                self.fields.append((name, field.source, _nullable(field.to_representation)))
+
+    def columns(self, fields=None, extra=()) -> list:
+        """Columns to select for the given field subset; ``id`` is always needed."""
+        columns = {'id', *extra}
+        columns.update(
+            column for name, column, _ in self.fields
+            if column is not None and (fields is None or name in fields)
+        )
+        return sorted(columns)
+
+    def values(self, queryset, fields=None, extra=()):
+        return queryset.values(*self.columns(fields, extra))
+
+    def render(self, rows, fields=None, related=None) -> list:
+        """
+        Representations of raw ``.values()`` rows, in row order. ``related``
+        maps a nested field to the queryset its rows come from, like a
+        ``Prefetch`` queryset; by default every related row is rendered.
+        """
+        ids = [row['id'] for row in rows]
+        querysets = related or {}
+        related = {
+            name: self._related(name, ids, querysets.get(name))
+            for name in self.nested
+            if fields is None or name in fields
+        }
+        rendered = []
+        for row in rows:
+            item = {}
+            for name, column, represent in self.fields:
+                if fields is not None and name not in fields:
+                    continue
+                if column is None:
+                    item[name] = related[name].get(row['id'], [])
+                else:
+                    item[name] = represent(row[column])
+            rendered.append(item)
+        return rendered
+
+    def serialize(self, queryset, fields=None, related=None) -> list:
+        return self.render(list(self.values(queryset, fields)), fields, related)
+
+    def _related(self, name, ids, queryset=None) -> dict:
+        """owner id -> rendered related rows, one query for every owner."""
+        if not ids:
+            return {}
+        child = self.nested[name]
+        owner = self.model._meta.get_field(name).related_query_name()
+        if queryset is None:
+            queryset = child.model._default_manager.all()
+        # Same join and default ordering as prefetch_related(name)
+        rows = list(
+            queryset
+            .filter(**{f'{owner}__in': ids})
+            .values(owner, *child.columns())
+        )
+        grouped = defaultdict(list)
+        for row, item in zip(rows, child.render(rows)):
+            grouped[row[owner]].append(item)
+        return grouped
+
+
+@functools.cache
+def compile_serializer(serializer_class) -> ValuesSerializer:
+    return ValuesSerializer(serializer_class)
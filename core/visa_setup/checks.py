@@ -0,0 +1,21 @@
+"""System checks for the visa_setup settings."""
+import os
+
+from django.core.checks import Error, Tags, register
+
+from .upload_spool import spool_dir
+
+
+@register(Tags.files)
+def check_upload_spool_dir(app_configs, **kwargs):
+    """UPLOAD_SPOOL_DIR, or the directory it would be created in, must be writable."""
+    path = spool_dir()
+    existing = next((parent for parent in (path, *path.parents) if parent.exists()), None)
+    if existing is not None and existing.is_dir() and os.access(existing, os.W_OK | os.X_OK):
+        return []
+    return [Error(
+        f"UPLOAD_SPOOL_DIR {path} is not writable, document uploads cannot be spooled.",
+        hint="Point UPLOAD_SPOOL_DIR at a writable directory the upload worker can read.",
+        obj='UPLOAD_SPOOL_DIR',
+        id='visa_setup.E001',
+    )]
@@ -0,0 +1,112 @@
+"""
+Upload intents: document files sent straight to storage.
+
+The client asks for an intent for one required document slot of its
+application and gets a signed upload URL plus an intent token. It sends the
+file bytes to that URL, then confirms the intent; the confirm step checks the
+object landed in storage and points the application's document at it. The
+intent token is signed and expires after ``UPLOAD_INTENT_MAX_AGE`` seconds, so
+no upload state is kept server side between the two calls.
+
+Intents are only issued for the file types the other upload paths accept,
+and an object larger than ``MAX_FILE_SIZE`` is deleted instead of being
+recorded. An intent is confirmed once: repeating the confirm changes nothing,
+so it cannot send a reviewed document back to pending.
+"""
+import logging
+import mimetypes
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+from core.storage_backends import get_storage
+from core.supabase_client import _generate_unique_filename
+
+from .models import ApplicationDocument
+from .uploads import UploadResult, save_documents
+
+logger = logging.getLogger(__name__)
+
+SALT = 'visa_setup.direct_uploads'
+FOLDER = 'uploads'
+# Same rules as the multipart document uploads
+ALLOWED_EXTENSIONS = ('.pdf', '.docx', '.doc', '.jpg', '.jpeg', '.png')
+MAX_FILE_SIZE = 1024 * 1024 * 10
+
+
+class IntentError(Exception):
+    """An intent that cannot be issued or confirmed."""
+
+
+def max_age() -> int:
+    return getattr(settings, 'UPLOAD_INTENT_MAX_AGE', 900)
+
+
+def create_intent(application, required_document_id, file_name, content_type=None) -> dict:
+    """
+    Signed upload URL and intent token for one document slot of ``application``.
+    Raises ``IntentError`` for a file type that is not allowed.
+    """
+    if not file_name.lower().endswith(ALLOWED_EXTENSIONS):
+        raise IntentError("File type not allowed. Use PDF, DOCX, DOC, JPG, JPEG, or PNG")
+    path = f"{FOLDER}/{_generate_unique_filename(file_name)}"
+    upload = get_storage().create_upload(path)
+    content_type = content_type or mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    intent = signing.dumps(
+        {'application': application.id, 'required_document': required_document_id, 'path': path},
+        salt=SALT,
+    )
+    logger.info("Upload intent for application %s document %s -> %s", application.id, required_document_id, path)
+    return {
+        'intent': intent,
+        'path': path,
+        'upload_url': upload['url'],
+        'method': upload['method'],
+        'headers': {**upload['headers'], 'Content-Type': content_type},
+        'expires_in': max_age(),
+    }
+
+
+def confirm_intent(application, intent) -> int:
+    """
+    Record the uploaded object as the document of the intent's slot and
+    return the required document id. Raises ``IntentError`` when the token
+    is invalid, expired or for another application, or the object is missing
+    or too large. Confirming an intent again changes nothing.
+    """
+    try:
+        data = signing.loads(intent, salt=SALT, max_age=max_age())
+    except signing.SignatureExpired:
+        raise IntentError("Upload intent has expired")
+    except signing.BadSignature:
+        raise IntentError("Invalid upload intent")
+    if data['application'] != application.id:
+        raise IntentError("Upload intent belongs to another application")
+
+    storage = get_storage()
+    path, required_document_id = data['path'], data['required_document']
+    url = storage.public_url(path)
+    if ApplicationDocument.objects.filter(
+        application=application, required_document_id=required_document_id, file=url,
+    ).exists():
+        return required_document_id
+
+    size = storage.size(path)
+    if size is None:
+        raise IntentError("File has not been uploaded yet")
+    if size > MAX_FILE_SIZE:
+        storage.delete(path)
+        raise IntentError("File size cannot exceed 10MB")
+
+    # Single use, also once the document has been replaced by a later upload
+    used_key = f"upload-intent:used:{path}"
+    if not cache.add(used_key, application.id, max_age()):
+        return required_document_id
+    try:
+        save_documents(application, {required_document_id: UploadResult(url=url)})
+    except Exception:
+        cache.delete(used_key)
+        raise
+    logger.info("Confirmed upload of application %s document %s", application.id, required_document_id)
+    return required_document_id
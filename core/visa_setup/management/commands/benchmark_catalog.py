@@ -0,0 +1,131 @@
+"""
+Compare the serializer and the values-based read paths of the visa type list.
+
+Synthetic visa types (with nested processes, overviews, notes and documents)
+are created inside a transaction that is rolled back at the end, so the
+command leaves the database untouched. Each size is timed on both paths,
+best of ``--repeat`` runs, and the rendered bytes are compared.
+
+``--search`` instead times typeahead queries on an in-memory search index
+over ``--search-size`` synthetic visa types and reports p50 / p95 latency.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from visa_setup import search
+from visa_setup.catalog import VISA_TYPE_NESTED
+from visa_setup.catalog_values import compile_serializer
+from visa_setup.models import Notes, RequiredDocuments, VisaOverview, VisaProcess, VisaType
+from visa_setup.serializers import DetailedVisaTypeSerializer
+
+
+def serializer_path() -> bytes:
+    visa_types = VisaType.objects.filter(active=True).prefetch_related(*VISA_TYPE_NESTED)
+    return JSONRenderer().render(DetailedVisaTypeSerializer(visa_types, many=True).data)
+
+
+def values_path() -> bytes:
+    compiled = compile_serializer(DetailedVisaTypeSerializer)
+    return JSONRenderer().render(compiled.serialize(VisaType.objects.filter(active=True)))
+
+
+def seed(count: int, start: int) -> None:
+    """Add ``count`` visa types with three entries in every nested relation."""
+    visa_types = VisaType.objects.bulk_create(
+        VisaType(name=f"Benchmark {i}", headings=f"Heading {i}", description="Lorem ipsum " * 20, price="99.00")
+        for i in range(start, start + count)
+    )
+    nested = {
+        'processes': (VisaProcess, lambda i: VisaProcess(points=f"Step {i}")),
+        'overviews': (VisaOverview, lambda i: VisaOverview(points=f"Point {i}", overview="Overview " * 10)),
+        'notes': (Notes, lambda i: Notes(notes=f"Note {i}")),
+        'required_documents': (RequiredDocuments, lambda i: RequiredDocuments(
+            document_name=f"Document {i}", description="Requirement " * 10)),
+    }
+    for name, (model, make) in nested.items():
+        items = model.objects.bulk_create(make(i) for i in range(len(visa_types) * 3))
+        field = VisaType._meta.get_field(name)
+        through = field.remote_field.through
+        through.objects.bulk_create(
+            through(**{field.m2m_column_name(): visa_type.id, field.m2m_reverse_name(): items[index * 3 + offset].id})
+            for index, visa_type in enumerate(visa_types)
+            for offset in range(3)
+        )
+
+
+# Typeahead queries timed by --search: short prefixes are the costly ones
+SEARCH_QUERIES = ("vi", "visa1", "work 12", "stud", "family3 travel", "tra")
+
+
+def search_documents(count: int) -> list:
+    """Synthetic index documents: a short title and a long body of overlapping words."""
+    words = [f"{stem}{i}" for i in range(200) for stem in ("visa", "work", "study", "family", "travel")]
+    return [
+        (('visa_type', i), [(f"{words[i % 1000]} {words[(i * 7) % 1000]}", 1.0),
+                            (" ".join(words[(i * j) % 1000] for j in range(30)), 0.2)])
+        for i in range(count)
+    ]
+
+
+def search_latencies(index, rounds: int) -> list:
+    """Sorted seconds per query, every query with cold prefix expansions."""
+    timings = []
+    for query in SEARCH_QUERIES * rounds:
+        # The cache only makes repeats cheaper
+        index._term_scores.cache_clear()
+        started = time.perf_counter()
+        index.search(query, limit=20)
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the serializer and values-based visa type list renderers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000', help="Comma separated visa type counts")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per path, the best one is reported")
+        parser.add_argument('--search', action='store_true', help="Time search typeahead instead of the list renderers")
+        parser.add_argument('--search-size', type=int, default=5000, help="Visa types in the search index")
+
+    def handle(self, *args, **options):
+        if options['search']:
+            return self.search(options['search_size'], options['repeat'])
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        self.stdout.write(f"{'visa types':>10} {'serializer ms':>14} {'values ms':>10} {'speedup':>8} "
+                          f"{'queries':>9} {'identical':>9}")
+        with transaction.atomic():
+            seeded = 0
+            for size in sizes:
+                seed(size - seeded, seeded)
+                seeded = size
+                serializer_ms, serializer_body, serializer_queries = self.measure(serializer_path, options['repeat'])
+                values_ms, values_body, values_queries = self.measure(values_path, options['repeat'])
+                self.stdout.write(
+                    f"{size:>10} {serializer_ms:>14.1f} {values_ms:>10.1f} {serializer_ms / values_ms:>7.1f}x "
+                    f"{f'{serializer_queries}/{values_queries}':>9} {str(serializer_body == values_body):>9}"
+                )
+            transaction.set_rollback(True)
+
+    def search(self, size: int, repeat: int):
+        index = search.InvertedIndex(search_documents(size))
+        timings = search_latencies(index, 20 * repeat)
+        percentile = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))] * 1000
+        self.stdout.write(
+            f"{size} visa types, {len(timings)} queries: "
+            f"p50 {percentile(0.5):.2f} ms, p95 {percentile(0.95):.2f} ms"
+        )
+
+    def measure(self, path, repeat: int):
+        best = None
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                body = path()
+                elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best, body, len(queries)
@@ -0,0 +1,135 @@
+"""
+Render the public catalog endpoints to static JSON files for CDN hosting.
+
+Files mirror the API URLs (``/api/countries/3/`` -> ``api/countries/3/index.json``)
+and hold the exact bytes the API serves, rendered by the catalog builders.
+``manifest.json`` records the sha256 and size of every file.
+
+With ``--incremental`` the lists and detail files are rendered as usual (they
+are cheap, a constant number of queries) and compared with the manifest; the
+per-country visa type lists, one query batch each, are only re-rendered for
+countries whose detail changed or that offer a visa type that changed. Files
+whose hash matches the manifest are never rewritten, so a CDN sync only
+uploads what changed.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from django.utils import timezone
+
+from visa_setup import catalog
+from visa_setup.models import Country
+
+MANIFEST_NAME = 'manifest.json'
+# Where core/urls.py mounts visa_setup.urls
+API_PREFIX = 'api'
+
+
+def _path(url_name, **kwargs) -> str:
+    # Reversed within visa_setup.urls, adminpanel reuses some of its url names
+    url = reverse(url_name, urlconf='visa_setup.urls', kwargs=kwargs).strip('/')
+    return f"{API_PREFIX}/{url}/index.json"
+
+
+def _write_atomic(path: Path, body: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(body)
+    os.replace(tmp, path)
+
+
+def _ids(files, url_name) -> dict:
+    """id -> path of the files of one detail endpoint listed in ``files``."""
+    prefix, _, suffix = _path(url_name, id=0).partition('/0/')
+    found = {}
+    for path in files:
+        head, _, tail = path.partition(prefix + '/')
+        middle, _, rest = tail.partition('/')
+        if not head and middle.isdigit() and rest == suffix:
+            found[int(middle)] = path
+    return found
+
+
+class Command(BaseCommand):
+    help = "Export the public catalog as static JSON files plus a manifest of hashes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', help="Directory the JSON tree is written to")
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help="Only re-render per-country visa type lists affected since the last manifest",
+        )
+
+    def handle(self, *args, **options):
+        root = Path(options['output_dir'])
+        manifest_path = root / MANIFEST_NAME
+        previous = json.loads(manifest_path.read_text())['files'] if manifest_path.exists() else {}
+        incremental = options['incremental'] and bool(previous)
+        if options['incremental'] and not previous:
+            self.stdout.write("No manifest found, running a full export")
+
+        rendered = self.render_catalog()
+        active_ids = set(_ids(rendered, 'country-detail'))
+        country_ids = active_ids
+        if incremental:
+            changed_visa_types = self.changed(rendered, previous, 'visa-type-detail')
+            affected = self.changed(rendered, previous, 'country-detail') | set(
+                Country.objects.filter(types__id__in=changed_visa_types).values_list('id', flat=True)
+            )
+            exported = _ids(previous, 'visa-type-processes')
+            country_ids = active_ids & (affected | (active_ids - set(exported)))
+            # Unaffected countries keep the files the last export wrote
+            for country_id in active_ids - country_ids:
+                rendered[exported[country_id]] = None
+        for country_id in sorted(country_ids):
+            for name, snapshot in catalog.build_country_visa_types(country_id).items():
+                rendered[_path('visa-type-processes', id=name)] = snapshot.body
+
+        files, written = {}, 0
+        for path, body in sorted(rendered.items()):
+            if body is None:
+                files[path] = previous[path]
+                continue
+            entry = {'sha256': hashlib.sha256(body).hexdigest(), 'bytes': len(body)}
+            files[path] = entry
+            if previous.get(path) != entry or not (root / path).exists():
+                _write_atomic(root / path, body)
+                written += 1
+
+        removed = set(previous) - set(files)
+        for path in removed:
+            (root / path).unlink(missing_ok=True)
+
+        manifest = {'generated_at': timezone.now().isoformat(), 'files': files}
+        _write_atomic(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode())
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {len(files)} files to {root}: {written} written, "
+            f"{len(files) - written} unchanged, {len(removed)} removed"
+        ))
+
+    def render_catalog(self) -> dict:
+        """path -> body of every list, country detail, visa type detail and settings."""
+        rendered = {}
+        rendered[_path('country-list')] = catalog.build_countries()[catalog.LIST_NAME].body
+        country_ids = Country.objects.filter(active=True).values_list('id', flat=True)
+        for name, snapshot in catalog.build_countries_by_id(list(country_ids)).items():
+            rendered[_path('country-detail', id=name)] = snapshot.body
+        for name, snapshot in catalog.build_visa_types().items():
+            path = _path('visa-type-list') if name == catalog.LIST_NAME else _path('visa-type-detail', id=name)
+            rendered[path] = snapshot.body
+        for snapshot in catalog.build_settings().values():
+            rendered[_path('settings')] = snapshot.body
+        return rendered
+
+    def changed(self, rendered: dict, previous: dict, url_name: str) -> set:
+        """Ids of one detail endpoint that are new, gone or hash differently."""
+        now, before = _ids(rendered, url_name), _ids(previous, url_name)
+        changed = set(now) ^ set(before)
+        for entity_id in set(now) & set(before):
+            if previous[before[entity_id]]['sha256'] != hashlib.sha256(rendered[now[entity_id]]).hexdigest():
+                changed.add(entity_id)
+        return changed
@@ -0,0 +1,54 @@
+"""
+Upload spooled document files to storage.
+
+Runs until interrupted, claiming due ``UploadJob`` rows in batches and polling
+when the queue is empty; ``--once`` drains what is due now and exits (for cron
+or tests). Several workers can run side by side. A batch that fails (the
+database went away, the spool is unreadable) is logged and retried after the
+poll interval instead of stopping the worker.
+"""
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from visa_setup import upload_spool
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Upload spooled document files to storage, retrying failures with exponential backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process the jobs that are due now, then exit.")
+        parser.add_argument('--batch-size', type=int, default=10, help="Jobs claimed (and uploaded concurrently) at a time.")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when no job is due.")
+        parser.add_argument('--retry-failed', action='store_true', help="Queue jobs that ran out of attempts again first.")
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(f"Requeued {upload_spool.retry_failed()} failed job(s)")
+        processed = 0
+        try:
+            while True:
+                try:
+                    claimed = upload_spool.run_once(options['batch_size'])
+                except Exception:
+                    if options['once']:
+                        raise
+                    logger.exception("Upload worker batch failed, retrying in %ss", options['poll_interval'])
+                    # Drop a connection the failure may have broken
+                    close_old_connections()
+                    time.sleep(options['poll_interval'])
+                    continue
+                processed += claimed
+                if claimed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} upload job(s)"))
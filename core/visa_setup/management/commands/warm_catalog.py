@@ -0,0 +1,21 @@
+"""
+Build the catalog list snapshots ahead of traffic.
+
+Run after a deploy or a cache flush so the first requests are served from the
+cache: the country and visa type lists (which also fill the visa type
+details), site settings and the bootstrap document are built once each.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from visa_setup import catalog
+
+
+class Command(BaseCommand):
+    help = "Build the catalog list snapshots, visa type details and bootstrap document into the cache."
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        catalog.warm()
+        self.stdout.write(self.style.SUCCESS(f"Warmed the catalog in {(time.perf_counter() - started) * 1000:.0f} ms"))
@@ -0,0 +1,15 @@
+from . import catalog
+
+
+class DeferredCatalogRebuildMiddleware:
+    """
+    Collect catalog invalidations made while handling a request and flush them
+    once after it, so a save plus its m2m updates rebuild each entry once.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with catalog.deferred_rebuild():
+            return self.get_response(request)
@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models import Q
 from django.core.validators import FileExtensionValidator
+from django.utils import timezone
 
 
 class Notes(models.Model):
@@ -61,6 +63,10 @@ class VisaType(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Visa Type'
         verbose_name_plural = 'Visa Types'
+        indexes = [
+            # Public list and keyset pages: active rows newest first
+            models.Index(fields=['-created_at', 'id'], condition=Q(active=True), name='visatype_active_created_idx'),
+        ]
 
 
 class Country(models.Model):
@@ -81,6 +87,10 @@ class Country(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Public list and keyset pages: active rows by name
+            models.Index(fields=['name', 'id'], condition=Q(active=True), name='country_active_name_idx'),
+        ]
 
 
 
@@ -105,12 +115,23 @@ class VisaApplication(models.Model):
     def __str__(self):
         return f"{self.user.email} - {self.visa_type.name} - {self.country.name}"
 
+    class Meta:
+        indexes = [
+            # A user's applications, newest first
+            models.Index(fields=['user', '-created_at'], name='visaapp_user_created_idx'),
+            # Admin review queues per status and the admin list
+            models.Index(fields=['status', '-created_at'], name='visaapp_status_created_idx'),
+            models.Index(fields=['-created_at'], name='visaapp_created_idx'),
+        ]
+
 
 class ApplicationDocument(models.Model):
     application = models.ForeignKey(VisaApplication, on_delete=models.CASCADE, related_name='documents')
     required_document = models.ForeignKey(RequiredDocuments, on_delete=models.CASCADE)
     file = models.URLField(blank=True, null=True)
     status = models.CharField(max_length=20, default='pending', choices=[
+        ('uploading', 'Uploading'),
+        ('upload_failed', 'Upload Failed'),
         ('pending', 'Pending Review'),
         ('approved', 'Approved'),
         ('rejected', 'Rejected')
@@ -125,6 +146,62 @@ class ApplicationDocument(models.Model):
 
     class Meta:
         unique_together = ['application', 'required_document']
+        indexes = [
+            # Document review queue: pending documents oldest first
+            models.Index(fields=['status', 'created_at'], name='appdoc_status_created_idx'),
+        ]
+
+
+class UploadJob(models.Model):
+    """A spooled document file waiting to be uploaded to storage by the upload worker."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('superseded', 'Superseded'),
+    ]
+    document = models.ForeignKey(ApplicationDocument, on_delete=models.CASCADE, related_name='upload_jobs')
+    # Relative to UPLOAD_SPOOL_DIR
+    spool_path = models.CharField(max_length=255)
+    # SHA-256 of the file, computed while it was spooled
+    sha256 = models.CharField(max_length=64, blank=True)
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    folder = models.CharField(max_length=100, default='uploads')
+    bucket = models.CharField(max_length=63, default='visa')
+    status = models.CharField(max_length=20, default='pending', choices=STATUS_CHOICES)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.file_name} ({self.status})"
+
+    class Meta:
+        indexes = [
+            # The worker's queue: pending jobs that are due
+            models.Index(fields=['status', 'next_attempt_at'], name='uploadjob_due_idx'),
+        ]
+
+
+class StoredObject(models.Model):
+    """A file in storage, indexed by the SHA-256 of its content so identical uploads share it."""
+    bucket = models.CharField(max_length=63)
+    sha256 = models.CharField(max_length=64)
+    path = models.CharField(max_length=255)
+    url = models.URLField(max_length=500)
+    size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.bucket}/{self.path}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'sha256'], name='storedobject_bucket_sha256_uniq'),
+        ]
 
 
 
@@ -143,6 +220,11 @@ class Consultation(models.Model):
 
     class Meta:
         ordering = ['-scheduled_at']
+        indexes = [
+            models.Index(fields=['-scheduled_at'], name='consultation_scheduled_idx'),
+            # The admin list orders by creation
+            models.Index(fields=['-created_at'], name='consultation_created_idx'),
+        ]
 
 
 class Settings(models.Model):
@@ -0,0 +1,281 @@
+"""
+Full-text search over the public catalog.
+
+Countries match on name, code and description, visa types on name, headings
+and description and on the names and descriptions of the documents they
+require. Every query term is matched as a prefix so results follow what is
+being typed, and hits are ranked by field weight.
+
+On PostgreSQL the search runs against GIN indexes (weighted tsvector
+expressions plus pg_trgm on names for typos), created by ``ensure_indexes``
+after migrate. Where the database user may not create the pg_trgm extension,
+the typo matching is left out and prefix search still works. Other databases
+use an in-memory inverted index built once per catalog generation, which is
+what the tests exercise.
+"""
+import bisect
+import functools
+import heapq
+import logging
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.db import DatabaseError, connection, connections, transaction
+
+from . import catalog
+from .models import Country, RequiredDocuments, VisaType
+
+logger = logging.getLogger(__name__)
+
+COUNTRY = 'country'
+VISA_TYPE = 'visa_type'
+TYPES = (COUNTRY, VISA_TYPE)
+
+# Field weights, mirrored by the tsvector weights A-D on PostgreSQL
+WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+SEARCH_FIELDS = {
+    COUNTRY: (('name', 'A'), ('code', 'A'), ('description', 'C')),
+    VISA_TYPE: (('name', 'A'), ('headings', 'B'), ('description', 'C')),
+    # Matches in required documents count towards the visa types needing them
+    'document': (('document_name', 'B'), ('description', 'D')),
+}
+# A prefix-only match (typing "stud" for "student") counts for half
+PREFIX_FACTOR = 0.5
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text) -> list:
+    return _TOKEN.findall((text or '').lower())
+
+
+# ---------------- In-memory fallback ----------------
+
+class InvertedIndex:
+    """Token -> {document key: weight} postings with prefix lookup."""
+
+    def __init__(self, documents):
+        """``documents``: iterable of (key, [(text, weight), ...])."""
+        postings = defaultdict(lambda: defaultdict(float))
+        for key, fields in documents:
+            for text, weight in fields:
+                for token in tokenize(text):
+                    postings[token][key] += weight
+        self.postings = {token: dict(keys) for token, keys in postings.items()}
+        self.tokens = sorted(self.postings)
+        self.size = len({key for keys in self.postings.values() for key in keys}) or 1
+        # Typeahead repeats the same short prefixes, which are the costly ones
+        self._term_scores = functools.lru_cache(maxsize=4096)(self._expand)
+
+    def _expand(self, term) -> dict:
+        """key -> weight of the documents containing ``term`` or a word it prefixes."""
+        best = {}
+        start = bisect.bisect_right(self.tokens, term)
+        for token in self.tokens[start:bisect.bisect_left(self.tokens, term + '\uffff', start)]:
+            for key, weight in self.postings[token].items():
+                if weight > best.get(key, 0.0):
+                    best[key] = weight
+        scores = {key: weight * PREFIX_FACTOR for key, weight in best.items()}
+        # Where the word itself occurs it counts in full
+        scores.update(self.postings.get(term, {}))
+        return scores
+
+    def search(self, query, limit=None) -> list:
+        """(key, score) pairs matching every term, best first."""
+        scores = None
+        for term in tokenize(query):
+            term_scores = self._term_scores(term)
+            # Rare terms say more about a document than common ones
+            idf = math.log(1 + self.size / (1 + len(term_scores)))
+            if scores is None:
+                scores = {key: weight * idf for key, weight in term_scores.items()}
+            else:
+                scores = {key: score + term_scores[key] * idf for key, score in scores.items() if key in term_scores}
+            if not scores:
+                return []
+        order = lambda item: (-item[1], item[0])
+        if limit:
+            return heapq.nsmallest(limit, (scores or {}).items(), key=order)
+        return sorted((scores or {}).items(), key=order)
+
+
+class _CatalogIndex:
+    """The in-memory index of this process, rebuilt once the catalog generations move."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = None
+        self._entries = {}
+
+    def get(self):
+        version = (catalog.get_generation(catalog.COUNTRIES), catalog.get_generation(catalog.VISA_TYPES))
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._index, self._entries = build_index()
+                    self._version = version
+        return self._index, self._entries
+
+
+def build_index():
+    """Inverted index over the active catalog plus the display row of every hit."""
+    documents, entries = [], {}
+    for row in Country.objects.filter(active=True).values('id', 'name', 'image', 'code', 'description'):
+        key = (COUNTRY, row['id'])
+        entries[key] = row
+        documents.append((key, [(row[name], WEIGHTS[w]) for name, w in SEARCH_FIELDS[COUNTRY]]))
+    visa_type_fields = defaultdict(list)
+    for row in VisaType.objects.filter(active=True).values('id', 'name', 'image', 'headings', 'description'):
+        key = (VISA_TYPE, row['id'])
+        entries[key] = row
+        visa_type_fields[key] += [(row[name], WEIGHTS[w]) for name, w in SEARCH_FIELDS[VISA_TYPE]]
+    for row in RequiredDocuments.objects.filter(visa_types__active=True).values(
+        'visa_types', 'document_name', 'description'
+    ):
+        key = (VISA_TYPE, row['visa_types'])
+        visa_type_fields[key] += [(row[name], WEIGHTS[w]) for name, w in SEARCH_FIELDS['document']]
+    documents += visa_type_fields.items()
+    logger.info("Built catalog search index over %d documents", len(entries))
+    return InvertedIndex(documents), entries
+
+
+_memory_index = _CatalogIndex()
+
+
+def _memory_search(query, types, limit) -> list:
+    index, entries = _memory_index.get()
+    hits = []
+    ranked = index.search(query, limit if set(types) == set(TYPES) else None)
+    for (kind, entity_id), score in ranked:
+        if kind in types:
+            hits.append((kind, entries[(kind, entity_id)], score))
+            if len(hits) == limit:
+                break
+    return hits
+
+
+# ---------------- PostgreSQL ----------------
+
+def _vector_sql(table, fields) -> str:
+    # Must stay identical to the index expressions for the planner to use them
+    return ' || '.join(
+        f"setweight(to_tsvector('english'::regconfig, coalesce({table}.{column}, '')), '{weight}')"
+        for column, weight in fields
+    )
+
+
+# Whether pg_trgm is installed, per database alias
+_trigram = {}
+
+
+def _has_trigram(cursor, using='default') -> bool:
+    if using not in _trigram:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        _trigram[using] = cursor.fetchone() is not None
+    return _trigram[using]
+
+
+def _index_statements(trigram=True) -> list:
+    statements = []
+    for model, kind in ((Country, COUNTRY), (VisaType, VISA_TYPE), (RequiredDocuments, 'document')):
+        table = model._meta.db_table
+        statements.append(
+            f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} "
+            f"USING gin (({_vector_sql(table, SEARCH_FIELDS[kind])}))"
+        )
+    for model in (Country, VisaType) if trigram else ():
+        table = model._meta.db_table
+        statements.append(
+            f"CREATE INDEX IF NOT EXISTS {table}_name_trgm_idx ON {table} USING gin (name gin_trgm_ops)"
+        )
+    return statements
+
+
+def ensure_indexes(using='default', **kwargs) -> None:
+    """
+    post_migrate hook: create the search indexes on PostgreSQL. Without the
+    privilege to create pg_trgm only the full-text indexes are created.
+    """
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    with db.cursor() as cursor:
+        try:
+            with transaction.atomic(using=using):
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except DatabaseError as e:
+            logger.warning("Could not create the pg_trgm extension, search runs without typo matching: %s", e)
+        _trigram.pop(using, None)
+        trigram = _has_trigram(cursor, using)
+        for statement in _index_statements(trigram):
+            cursor.execute(statement)
+    logger.info("Ensured catalog search indexes (trigram: %s)", trigram)
+
+
+def _tsquery(query) -> str:
+    return ' & '.join(f"{term}:*" for term in tokenize(query))
+
+
+def _postgres_search(query, types, limit) -> list:
+    tsquery = _tsquery(query)
+    hits = []
+    with connection.cursor() as cursor:
+        # Typo tolerance needs pg_trgm: name similarity adds to the rank and matches on its own
+        trigram = _has_trigram(cursor, connection.alias)
+        similar = " + similarity(name, %s)" if trigram else ""
+        typo = " OR name %% %s" if trigram else ""
+        typo_params = [query] if trigram else []
+        if COUNTRY in types:
+            table = Country._meta.db_table
+            cursor.execute(
+                f"SELECT id, name, image, ts_rank(v, q){similar} AS score "
+                f"FROM {table}, to_tsquery('english', %s) q, LATERAL (SELECT {_vector_sql(table, SEARCH_FIELDS[COUNTRY])} AS v) s "
+                f"WHERE active AND ({_vector_sql(table, SEARCH_FIELDS[COUNTRY])} @@ q{typo}) "
+                f"ORDER BY score DESC, id LIMIT %s",
+                [*typo_params, tsquery, *typo_params, limit],
+            )
+            hits += [(COUNTRY, {'id': i, 'name': n, 'image': img}, score) for i, n, img, score in cursor.fetchall()]
+        if VISA_TYPE in types:
+            table = VisaType._meta.db_table
+            documents = RequiredDocuments._meta.db_table
+            field = VisaType._meta.get_field('required_documents')
+            through = field.remote_field.through._meta.db_table
+            cursor.execute(
+                f"WITH direct AS ("
+                f"  SELECT id, ts_rank(v, q){similar} AS score "
+                f"  FROM {table}, to_tsquery('english', %s) q, LATERAL (SELECT {_vector_sql(table, SEARCH_FIELDS[VISA_TYPE])} AS v) s "
+                f"  WHERE active AND ({_vector_sql(table, SEARCH_FIELDS[VISA_TYPE])} @@ q{typo})"
+                f"), via_documents AS ("
+                f"  SELECT t.{field.m2m_column_name()} AS id, max(ts_rank(v, q)) AS score "
+                f"  FROM {documents} JOIN {through} t ON t.{field.m2m_reverse_name()} = {documents}.id, "
+                f"  to_tsquery('english', %s) q, LATERAL (SELECT {_vector_sql(documents, SEARCH_FIELDS['document'])} AS v) s "
+                f"  WHERE {_vector_sql(documents, SEARCH_FIELDS['document'])} @@ q "
+                f"  GROUP BY t.{field.m2m_column_name()}"
+                f") "
+                f"SELECT vt.id, vt.name, vt.image, sum(m.score) AS score "
+                f"FROM (SELECT * FROM direct UNION ALL SELECT * FROM via_documents) m "
+                f"JOIN {table} vt ON vt.id = m.id WHERE vt.active "
+                f"GROUP BY vt.id, vt.name, vt.image ORDER BY score DESC, vt.id LIMIT %s",
+                [*typo_params, tsquery, *typo_params, tsquery, limit],
+            )
+            hits += [(VISA_TYPE, {'id': i, 'name': n, 'image': img}, score) for i, n, img, score in cursor.fetchall()]
+    hits.sort(key=lambda hit: -hit[2])
+    return hits[:limit]
+
+
+def search(query, types=TYPES, limit=20) -> list:
+    """Ranked hits for ``query`` as plain dicts, best first."""
+    if not tokenize(query):
+        return []
+    if connection.vendor == 'postgresql':
+        hits = _postgres_search(query, types, limit)
+    else:
+        hits = _memory_search(query, types, limit)
+    return [
+        {'type': kind, 'id': row['id'], 'name': row['name'], 'image': row['image'] or None,
+         'score': round(float(score), 4)}
+        for kind, row, score in hits
+    ]
@@ -5,6 +5,7 @@ from .models import (
     Consultation, Settings, VisaType, Country, VisaProcess, VisaOverview, Notes, 
     RequiredDocuments, VisaApplication, ApplicationDocument
 )
+from .uploads import save_documents, upload_errors, upload_files
 
 class visaProcessSerializer(serializers.ModelSerializer):
     class Meta:
@@ -220,32 +221,11 @@ class VisaApplicationSerializer(serializers.ModelSerializer):
             **validated_data
         )
         
-        # Create ApplicationDocument for each required document (if files provided)
-        for file_info in files:
-            required_document_id = file_info['required_document_id']
-            file = file_info['file']
-            required_document = RequiredDocuments.objects.get(id=required_document_id)
-            
-            # Upload to Supabase
-            try:
-                from core.supabase_client import upload_file_to_supabase
-                file_url = upload_file_to_supabase(file)
-                
-                ApplicationDocument.objects.create(
-                    application=visa_application,
-                    required_document=required_document,
-                    file=file_url,
-                    status='pending'
-                )
-            except Exception as e:
-                # Fallback: create without file URL
-                ApplicationDocument.objects.create(
-                    application=visa_application,
-                    required_document=required_document,
-                    file=None,
-                    status='pending'
-                )
-        
+        # Upload all document files in parallel, then create their rows in one batch
+        results = upload_files({int(file_info['required_document_id']): file_info['file'] for file_info in files})
+        self.upload_errors = upload_errors(results)
+        save_documents(visa_application, results)
+
         return visa_application
 
 
@@ -326,6 +306,7 @@ class UserVisaApplicationSerializer(serializers.ModelSerializer):
         )
 
         # Handle uploaded files
+        files = {}
         for key, file in request.FILES.items():
             if key.startswith("required_documents["):
                 # validate the file size and type pdf, docx, doc, jpg, jpeg, png
@@ -333,33 +314,18 @@ class UserVisaApplicationSerializer(serializers.ModelSerializer):
                     raise serializers.ValidationError("File size cannot exceed 10MB")
                 if not (file.name.endswith('.pdf') or file.name.endswith('.docx') or file.name.endswith('.doc') or file.name.endswith('.jpg') or file.name.endswith('.jpeg') or file.name.endswith('.png')):
                     raise serializers.ValidationError("File type is not allowed")
-                doc_id = key.split("[")[1].split("]")[0]
                 try:
-                    required_doc = RequiredDocuments.objects.get(id=doc_id)
-                    
-                    # Upload to Supabase
-                    try:
-                        from core.supabase_client import upload_file_to_supabase
-                        file_url = upload_file_to_supabase(file)
-                        
-                        ApplicationDocument.objects.create(
-                            application=application,
-                            required_document=required_doc,
-                            file=file_url,
-                            status='pending'
-                        )
-                    except Exception as e:
-                        # Fallback: create without file URL
-                        ApplicationDocument.objects.create(
-                            application=application,
-                            required_document=required_doc,
-                            file=None,
-                            status='pending'
-                        )
-                        
-                except RequiredDocuments.DoesNotExist:
+                    files[int(key.split("[")[1].split("]")[0])] = file
+                except ValueError:
                     continue
 
+        # Files for unknown required documents are skipped
+        known = set(RequiredDocuments.objects.filter(id__in=files).values_list('id', flat=True))
+        # Upload them in parallel, then create their rows in one batch
+        results = upload_files({doc_id: file for doc_id, file in files.items() if doc_id in known})
+        self.upload_errors = upload_errors(results)
+        save_documents(application, results)
+
         return application
 
 
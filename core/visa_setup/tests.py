@@ -1,3 +1,1849 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, ProgrammingError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from storage3._sync.file_api import SyncBucketProxy
+from storage3.utils import SyncClient
+
+from accounts.models import User
+from core import supabase_client
+from core.storage_backends import LocalStorage, SupabaseStorage
+
+from . import application_cache, catalog, direct_uploads, search, upload_spool, uploads
+from .management.commands.benchmark_catalog import SEARCH_QUERIES, search_documents
+from .cache_tiers import LocalCache, TieredCache, catalog_cache
+from .catalog_values import compile_serializer
+from .checks import check_upload_spool_dir
+from .models import (
+    ApplicationDocument, Consultation, Country, Notes, RequiredDocuments, Settings, StoredObject, UploadJob,
+    VisaApplication, VisaOverview, VisaProcess, VisaType,
+)
+from .serializers import CountrySerializer, CountryDetailsSerializer, DetailedVisaTypeSerializer
+
+
+def seed_catalog(countries=2, visa_types=3):
+    """Create active countries that each offer every seeded visa type."""
+    created_types = []
+    for i in range(visa_types):
+        visa_type = VisaType.objects.create(
+            name=f"Visa {i}", headings=f"Heading {i}", description=f"Description {i}", price="10.50",
+        )
+        visa_type.processes.add(VisaProcess.objects.create(points=f"Process {i}"))
+        visa_type.overviews.add(VisaOverview.objects.create(points=f"Point {i}", overview=f"Overview {i}"))
+        visa_type.notes.add(Notes.objects.create(notes=f"Note {i}"))
+        visa_type.required_documents.add(RequiredDocuments.objects.create(document_name=f"Doc {i}"))
+        created_types.append(visa_type)
+    created_countries = []
+    for i in range(countries):
+        country = Country.objects.create(name=f"Country {i}", description=f"About {i}", code=f"C{i}")
+        country.types.set(created_types)
+        created_countries.append(country)
+    return created_countries, created_types
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.countries, self.visa_types = seed_catalog()
+        cache.clear()
+
+    def test_snapshots_match_serializer_output(self):
+        response = self.client.get('/api/countries/')
+        self.assertEqual(response.status_code, 200)
+        expected = CountrySerializer(Country.objects.filter(active=True), many=True).data
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(expected)))
+
+        country = self.countries[0]
+        response = self.client.get(f'/api/countries/{country.id}/')
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(CountryDetailsSerializer(country).data)))
+
+        response = self.client.get('/api/visa-types/')
+        expected = DetailedVisaTypeSerializer(VisaType.objects.filter(active=True), many=True).data
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(expected)))
+
+    def test_cache_hit_serves_bytes_without_queries(self):
+        first = self.client.get('/api/visa-types/')
+        snapshot = catalog.get_visa_types()
+        self.assertEqual(first.content, snapshot.body)
+        self.assertEqual(int(first['Content-Length']), snapshot.content_length)
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/visa-types/')
+            detail = self.client.get(f'/api/visa-types/{self.visa_types[0].id}/')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(detail.status_code, 200)
+
+    def test_warm_catalog_fills_the_list_snapshots(self):
+        Settings.objects.create(email="info@example.com")
+        catalog_cache.local.clear()
+        output = io.StringIO()
+        call_command('warm_catalog', stdout=output)
+        self.assertIn("Warmed the catalog", output.getvalue())
+        with self.assertNumQueries(0):
+            for url in ('/api/countries/', '/api/visa-types/', f'/api/visa-types/{self.visa_types[0].id}/',
+                        '/api/settings/', '/api/bootstrap/'):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_signals_refresh_snapshots(self):
+        country = self.countries[0]
+        self.client.get(f'/api/country-visa-types/{country.id}/')
+        visa_type = self.visa_types[0]
+        visa_type.name = "Renamed visa"
+        with self.captureOnCommitCallbacks(execute=True):
+            visa_type.save()
+        response = self.client.get(f'/api/country-visa-types/{country.id}/')
+        self.assertIn("Renamed visa", [item['name'] for item in json.loads(response.content)])
+
+        visa_type.active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            visa_type.save()
+        self.assertEqual(self.client.get(f'/api/visa-types/{visa_type.id}/').status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            country.delete()
+        self.assertEqual(self.client.get(f'/api/countries/{country.id}/').status_code, 404)
+        self.assertEqual(len(json.loads(self.client.get('/api/countries/').content)), 1)
+
+    def test_clearing_a_visa_types_countries_refreshes_them(self):
+        country = self.countries[0]
+        visa_type = country.types.filter(active=True).first()
+
+        def listed():
+            response = self.client.get(f'/api/country-visa-types/{country.id}/')
+            return [item['id'] for item in json.loads(response.content)]
+
+        self.assertIn(visa_type.id, listed())
+        with self.captureOnCommitCallbacks(execute=True):
+            visa_type.countries.clear()
+        self.assertNotIn(visa_type.id, listed())
+        details = json.loads(self.client.get(f'/api/countries/{country.id}/').content)
+        self.assertNotIn(visa_type.id, [item['id'] for item in details['types']])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.countries, self.visa_types = seed_catalog()
+        Settings.objects.create(email="info@example.com", phone_number="123")
+
+    def test_endpoints_answer_304_without_queries(self):
+        paths = [
+            '/api/countries/', f'/api/countries/{self.countries[0].id}/',
+            '/api/visa-types/', f'/api/visa-types/{self.visa_types[0].id}/',
+            f'/api/country-visa-types/{self.countries[0].id}/', '/api/settings/',
+        ]
+        for path in paths:
+            first = self.client.get(path)
+            self.assertEqual(first.status_code, 200, path)
+            self.assertTrue(first.has_header('ETag'), path)
+            self.assertTrue(first.has_header('Last-Modified'), path)
+            with self.assertNumQueries(0):
+                by_etag = self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+                by_date = self.client.get(path, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+            self.assertEqual(by_etag.status_code, 304, path)
+            self.assertEqual(by_etag.content, b'')
+            self.assertEqual(by_date.status_code, 304, path)
+
+    def test_etag_changes_with_content(self):
+        first = self.client.get('/api/visa-types/')
+        with self.captureOnCommitCallbacks(execute=True):
+            catalog.mark_dirty(catalog.VISA_TYPES)
+        rebuilt = self.client.get('/api/visa-types/')
+        self.assertEqual(rebuilt['ETag'], first['ETag'])
+        self.assertEqual(rebuilt['Last-Modified'], first['Last-Modified'])
+
+        visa_type = self.visa_types[0]
+        visa_type.price = "99.00"
+        with self.captureOnCommitCallbacks(execute=True):
+            visa_type.save()
+        response = self.client.get('/api/visa-types/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_settings_snapshot_follows_admin_edits(self):
+        first = self.client.get('/api/settings/')
+        site_settings = Settings.objects.first()
+        site_settings.email = "hello@example.com"
+        with self.captureOnCommitCallbacks(execute=True):
+            site_settings.save()
+        response = self.client.get('/api/settings/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['email'], "hello@example.com")
+
+
+class GenerationNamespaceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.countries, self.visa_types = seed_catalog(countries=5)
+
+    def test_admin_save_does_not_query_per_country(self):
+        for country in self.countries:
+            self.client.get(f'/api/countries/{country.id}/')
+        visa_type = self.visa_types[0]
+        visa_type.name = "Renamed visa"
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(1):
+            visa_type.save()
+        with mock.patch.object(catalog, 'rebuild'), self.assertNumQueries(0):
+            for callback in callbacks:
+                callback()
+
+    def test_bump_invalidates_whole_family(self):
+        country = self.countries[0]
+        self.client.get(f'/api/country-visa-types/{country.id}/')
+        generation = catalog.get_generation(catalog.COUNTRY_VISA_TYPES)
+        visa_type = self.visa_types[0]
+        visa_type.name = "Renamed visa"
+        with self.captureOnCommitCallbacks(execute=True):
+            visa_type.save()
+        self.assertGreater(catalog.get_generation(catalog.COUNTRY_VISA_TYPES), generation)
+        for country in self.countries:
+            response = self.client.get(f'/api/country-visa-types/{country.id}/')
+            self.assertIn("Renamed visa", [item['name'] for item in json.loads(response.content)])
+
+    def test_evicted_generation_restarts_without_reusing_entries(self):
+        self.client.get('/api/visa-types/')
+        generation = catalog.get_generation(catalog.VISA_TYPES)
+        cache.delete(f"catalog:gen:{catalog.VISA_TYPES}")
+        self.assertNotEqual(catalog.get_generation(catalog.VISA_TYPES), generation)
+
+
+class DeferredRebuildTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.countries, self.visa_types = seed_catalog(countries=3)
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="x")
+        self.client.force_authenticate(admin)
+
+    def test_admin_country_update_flushes_once(self):
+        country = self.countries[0]
+        type_ids = ",".join(str(vt.id) for vt in self.visa_types[:2])
+        with mock.patch.object(catalog, 'bump', wraps=catalog.bump) as bump, \
+                mock.patch.object(catalog, 'build_countries', wraps=catalog.build_countries) as rebuild_countries, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                f'/api/admin/countries/{country.id}/',
+                {'name': 'Updated', 'type_ids': type_ids}, format='multipart',
+            )
+        self.assertEqual(response.status_code, 200)
+        bump.assert_called_once()
+        self.assertCountEqual(bump.call_args.args, [catalog.COUNTRIES, catalog.COUNTRY_VISA_TYPES])
+        rebuild_countries.assert_called_once()
+
+        payload = json.loads(self.client.get(f'/api/country-visa-types/{country.id}/').content)
+        self.assertEqual(len(payload), 2)
+
+    def test_bulk_assignment_costs_one_rebuild(self):
+        country = Country.objects.create(name="New", description="New", code="NEW")
+        ids = ",".join(str(vt.id) for vt in self.visa_types)
+        with mock.patch.object(catalog, 'rebuild', wraps=catalog.rebuild) as rebuild, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/admin/countries/{country.id}/bulk-assign-visa-types/', {'visa_type_ids': ids})
+        rebuild.assert_called_once()
+
+    def test_deferred_block_flushes_once(self):
+        with mock.patch.object(catalog, 'bump') as bump:
+            with self.captureOnCommitCallbacks(execute=True), catalog.deferred_rebuild():
+                country = self.countries[0]
+                country.name = "Renamed"
+                country.save()
+                self.visa_types[0].save()
+            bump.assert_called_once()
+
+
+class SharedCacheTests(TestCase):
+    """Two cache aliases on one file-based location stand in for two workers."""
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        backend = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': self.location,
+        }
+        shared = override_settings(CACHES={'default': backend, 'other_worker': backend})
+        shared.enable()
+        self.addCleanup(shared.disable)
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.countries, self.visa_types = seed_catalog()
+
+    def test_invalidation_reaches_other_workers(self):
+        other_worker = caches['other_worker']
+        self.client.get('/api/visa-types/')
+        generation_key = f"catalog:gen:{catalog.VISA_TYPES}"
+        seen_before = other_worker.get(generation_key)
+        self.assertEqual(seen_before, catalog.get_generation(catalog.VISA_TYPES))
+
+        visa_type = self.visa_types[0]
+        visa_type.name = "Renamed visa"
+        with self.captureOnCommitCallbacks(execute=True):
+            visa_type.save()
+
+        generation = other_worker.get(generation_key)
+        self.assertNotEqual(generation, seen_before)
+        snapshot = other_worker.get(f"catalog:{catalog.VISA_TYPES}:g{generation}:{catalog.LIST_NAME}")
+        self.assertIn("Renamed visa", [item['name'] for item in json.loads(snapshot.body)])
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tiered = TieredCache(l1_max_entries=2, l1_ttl=60)
+
+    def test_get_many_batches_misses_into_one_shared_call(self):
+        cache.set_many({'a': 1, 'b': 2})
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as shared_get_many:
+            self.assertEqual(self.tiered.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+            self.assertEqual(self.tiered.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        shared_get_many.assert_called_once_with(['a', 'b', 'c'])
+        self.assertEqual(self.tiered.stats(), {
+            'l1': {'hits': 2, 'misses': 3},
+            'l2': {'hits': 2, 'misses': 1},
+        })
+
+    def test_set_many_writes_both_tiers(self):
+        self.tiered.set_many({'a': 1, 'b': 2}, 30)
+        self.assertEqual(cache.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        cache.clear()
+        self.assertEqual(self.tiered.get('a'), 1)
+        self.assertEqual(self.tiered.stats()['l1']['hits'], 1)
+
+    def test_local_tier_is_bounded_and_expires(self):
+        local = LocalCache(max_entries=2, ttl=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+        self.assertEqual(len(local), 2)
+        self.assertEqual(local.get('b', None), None)
+        self.assertEqual(local.get('a'), 1)
+        with mock.patch('visa_setup.cache_tiers.time.monotonic', return_value=10 ** 9):
+            self.assertEqual(local.get('a', None), None)
+
+    def test_catalog_hits_are_served_from_l1(self):
+        seed_catalog()
+        client = APIClient()
+        client.get('/api/visa-types/')
+        catalog_cache.reset_stats()
+        with mock.patch.object(cache, 'get', wraps=cache.get) as shared_get:
+            client.get('/api/visa-types/')
+        # Only the generation check and the throttle reach the shared cache
+        shared_keys = [call.args[0] for call in shared_get.call_args_list]
+        self.assertFalse([key for key in shared_keys if key.startswith('catalog:visa_types:g')])
+        self.assertEqual(catalog_cache.stats()['l1'], {'hits': 1, 'misses': 0})
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            seed_catalog()
+
+    def _hold_fill_lock(self, family, name):
+        generation = catalog.get_generation(family)
+        cache.add(f"catalog:lock:{family}:g{generation}:{name}", 1, 30)
+
+    def test_concurrent_misses_build_once(self):
+        calls = []
+
+        def slow_builder():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'shared': catalog.render_snapshot({'built': True})}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                catalog._get_or_build('single_flight_test', 'shared', slow_builder)
+            ))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({snapshot.body for snapshot in results}, {b'{"built":true}'})
+
+    def test_waiters_are_served_the_previous_build(self):
+        previous = self.client.get('/api/visa-types/')
+        catalog.bump(catalog.VISA_TYPES)
+        self._hold_fill_lock(catalog.VISA_TYPES, catalog.LIST_NAME)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/visa-types/')
+        self.assertEqual(response.content, previous.content)
+
+    def test_waiters_pick_up_the_new_build(self):
+        cache.clear()
+        self._hold_fill_lock(catalog.VISA_TYPES, catalog.LIST_NAME)
+        generation = catalog.get_generation(catalog.VISA_TYPES)
+        built = catalog.render_snapshot([{'id': 1}])
+
+        def finish_other_fill(seconds):
+            cache.set(f"catalog:{catalog.VISA_TYPES}:g{generation}:{catalog.LIST_NAME}", built)
+
+        with mock.patch('visa_setup.catalog.time.sleep', side_effect=finish_other_fill), \
+                self.assertNumQueries(0):
+            self.assertEqual(catalog.get_visa_types(), built)
+
+
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.client = APIClient()
+        self.countries, self.visa_types = seed_catalog()
+
+    @override_settings(
+        CATALOG_CACHE_TTLS={'visa_types': {'soft': 0, 'hard': 3600}},
+        CATALOG_REFRESH_IN_BACKGROUND=False,
+    )
+    def test_stale_entry_is_served_then_refreshed_once(self):
+        self.client.get('/api/visa-types/')
+        # Edits to nested rows do not bump a generation, the soft TTL catches them
+        RequiredDocuments.objects.update(description="Updated requirements")
+        with mock.patch.object(catalog, 'build_visa_types', wraps=catalog.build_visa_types) as builder:
+            stale = self.client.get('/api/visa-types/')
+        builder.assert_called_once()
+        self.assertNotIn("Updated requirements", stale.content.decode())
+        fresh = self.client.get('/api/visa-types/')
+        self.assertIn("Updated requirements", fresh.content.decode())
+
+    @override_settings(CATALOG_CACHE_TTLS={'settings': {'soft': 0, 'hard': 3600}})
+    def test_refresh_runs_in_background(self):
+        Settings.objects.create(email="info@example.com")
+        self.client.get('/api/settings/')
+        with mock.patch('visa_setup.catalog.threading.Thread') as thread, self.assertNumQueries(0):
+            response = self.client.get('/api/settings/')
+        self.assertEqual(response.status_code, 200)
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+
+    def test_fresh_entries_are_not_revalidated(self):
+        self.client.get('/api/countries/')
+        with mock.patch.object(catalog, '_revalidate') as revalidate:
+            self.client.get('/api/countries/')
+        revalidate.assert_not_called()
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.countries, self.visa_types = seed_catalog(countries=5, visa_types=5)
+
+    def walk(self, url, limit):
+        ids, cursor = [], None
+        while True:
+            params = {'limit': limit}
+            if cursor:
+                params['cursor'] = cursor
+            page = json.loads(self.client.get(url, params).content)
+            self.assertLessEqual(len(page['results']), limit)
+            ids += [item['id'] for item in page['results']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_visa_type_pages_follow_created_at_then_id(self):
+        # Rows sharing a timestamp must still be paged exactly once each
+        tied = self.visa_types[1].created_at
+        VisaType.objects.filter(id__in=[v.id for v in self.visa_types[1:4]]).update(created_at=tied)
+        catalog.bump(catalog.VISA_TYPES)
+        expected = list(VisaType.objects.filter(active=True).order_by('-created_at', 'id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/visa-types/', 2), expected)
+
+    def test_country_pages_follow_name_then_id(self):
+        expected = list(Country.objects.filter(active=True).order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/countries/', 2), expected)
+
+    def test_pages_are_cached_separately(self):
+        first = json.loads(self.client.get('/api/countries/', {'limit': 2}).content)
+        with self.assertNumQueries(0):
+            self.client.get('/api/countries/', {'limit': 2})
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/countries/', {'limit': 2, 'cursor': first['next_cursor']})
+        self.assertEqual(len(json.loads(second.content)['results']), 2)
+
+    def test_page_cost_does_not_grow_with_the_catalog(self):
+        with self.assertNumQueries(5):
+            self.client.get('/api/visa-types/', {'limit': 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            seed_catalog(countries=0, visa_types=10)
+        with self.assertNumQueries(5):
+            page = self.client.get('/api/visa-types/', {'limit': 2})
+        self.assertEqual(len(json.loads(page.content)['results']), 2)
+
+    def test_bad_parameters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/visa-types/', {'cursor': 'not-a-cursor'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/countries/', {'cursor': catalog.encode_cursor([1, 'x'])}).status_code, 400)
+        self.assertEqual(self.client.get('/api/countries/', {'limit': 'ten'}).status_code, 400)
+
+    def test_cursor_with_an_impossible_date_is_rejected(self):
+        cursor = catalog.encode_cursor(["2024-13-45T00:00:00", 1])
+        self.assertEqual(self.client.get('/api/visa-types/', {'cursor': cursor}).status_code, 400)
+
+    def test_full_list_stays_the_default(self):
+        self.assertIsInstance(json.loads(self.client.get('/api/countries/').content), list)
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.countries, self.visa_types = seed_catalog()
+        cache.clear()
+        catalog_cache.local.clear()
+
+    def test_card_fields_skip_every_prefetch(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/visa-types/', {'fields': 'price,id,name,image'})
+        rows = json.loads(response.content)
+        self.assertEqual([list(row) for row in rows], [['id', 'name', 'image', 'price']] * 3)
+        self.assertEqual(rows[0]['price'], '10.50')
+
+    def test_expand_embeds_only_named_relations(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                f'/api/country-visa-types/{self.countries[0].id}/', {'expand': 'notes'}
+            )
+        row = json.loads(response.content)[0]
+        self.assertIn('notes', row)
+        self.assertIn('description', row)
+        self.assertNotIn('processes', row)
+
+    def test_each_combination_has_its_own_entry(self):
+        cards = self.client.get('/api/visa-types/', {'fields': 'id,name'})
+        full = self.client.get('/api/visa-types/')
+        self.assertNotEqual(cards['ETag'], full['ETag'])
+        with self.assertNumQueries(0):
+            again = self.client.get('/api/visa-types/', {'fields': 'name,id'})
+        self.assertEqual(again.content, cards.content)
+        # A write invalidates every combination with the family
+        with self.captureOnCommitCallbacks(execute=True):
+            VisaType.objects.filter(id=self.visa_types[0].id).first().save()
+        self.assertEqual(len(json.loads(self.client.get('/api/visa-types/', {'fields': 'id'}).content)), 3)
+
+    def test_fields_combine_with_pages(self):
+        page = json.loads(self.client.get('/api/visa-types/', {'limit': 2, 'fields': 'id,name'}).content)
+        self.assertEqual([list(row) for row in page['results']], [['id', 'name']] * 2)
+        self.assertIsNotNone(page['next_cursor'])
+
+    def test_unknown_fields_are_rejected(self):
+        self.assertEqual(self.client.get('/api/visa-types/', {'fields': 'id,password'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/visa-types/', {'expand': 'name'}).status_code, 400)
+
+
+class CompressedSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.countries, self.visa_types = seed_catalog()
+
+    def test_gzip_variant_is_served_when_accepted(self):
+        plain = self.client.get('/api/visa-types/')
+        with mock.patch('visa_setup.catalog.gzip.compress') as compress:
+            zipped = self.client.get('/api/visa-types/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        # Hot payloads are compressed once at build time, never per request
+        compress.assert_not_called()
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(zipped.content), plain.content)
+        self.assertLess(int(zipped['Content-Length']), int(plain['Content-Length']))
+        self.assertEqual(zipped['ETag'], f"W/{plain['ETag']}")
+        for response in (plain, zipped):
+            self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_identity_when_compression_is_refused(self):
+        response = self.client.get('/api/visa-types/', HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        json.loads(response.content)
+
+    def test_conditional_get_matches_either_variant(self):
+        zipped = self.client.get('/api/visa-types/', HTTP_ACCEPT_ENCODING='gzip')
+        response = self.client.get('/api/visa-types/', HTTP_IF_NONE_MATCH=zipped['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_small_bodies_are_not_compressed(self):
+        Settings.objects.create(email="info@example.com")
+        response = self.client.get('/api/settings/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_negotiation_prefers_brotli_then_quality(self):
+        available = {'gzip': b'', 'br': b''}
+        self.assertEqual(catalog.negotiate_encoding('gzip, br', available), 'br')
+        self.assertEqual(catalog.negotiate_encoding('gzip;q=1, br;q=0.5', available), 'gzip')
+        self.assertEqual(catalog.negotiate_encoding('*', {'gzip': b''}), 'gzip')
+        self.assertIsNone(catalog.negotiate_encoding('', available))
+        self.assertIsNone(catalog.negotiate_encoding('br', {'gzip': b''}))
+
+
+class ExportCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.client = APIClient()
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.countries, self.visa_types = seed_catalog(countries=3, visa_types=2)
+            Settings.objects.create(email="info@example.com")
+            # A third visa type only offered by the last country
+            self.extra = VisaType.objects.create(name="Visa X", headings="X", description="X")
+            self.countries[2].types.add(self.extra)
+
+    def export(self, *args):
+        call_command('export_catalog', self.output, *args, stdout=io.StringIO())
+        with open(os.path.join(self.output, 'manifest.json')) as manifest:
+            return json.load(manifest)['files']
+
+    def read(self, url):
+        with open(os.path.join(self.output, url.strip('/'), 'index.json'), 'rb') as exported:
+            return exported.read()
+
+    def test_files_hold_the_api_bytes(self):
+        files = self.export()
+        urls = ['/api/countries/', '/api/visa-types/', '/api/settings/']
+        urls += [f'/api/countries/{c.id}/' for c in self.countries]
+        urls += [f'/api/country-visa-types/{c.id}/' for c in self.countries]
+        urls += [f'/api/visa-types/{v.id}/' for v in self.visa_types + [self.extra]]
+        self.assertEqual(len(files), len(urls))
+        for url in urls:
+            body = self.read(url)
+            self.assertEqual(body, self.client.get(url).content, url)
+            entry = files[url.strip('/') + '/index.json']
+            self.assertEqual(entry['sha256'], hashlib.sha256(body).hexdigest())
+
+    def test_incremental_only_renders_affected_countries(self):
+        self.export()
+        self.extra.description = "Changed"
+        self.extra.save()
+        self.countries[0].active = False
+        self.countries[0].save()
+        with mock.patch.object(catalog, 'build_country_visa_types', wraps=catalog.build_country_visa_types) as build:
+            files = self.export('--incremental')
+        build.assert_called_once_with(self.countries[2].id)
+        self.assertIn(b"Changed", self.read(f'/api/country-visa-types/{self.countries[2].id}/'))
+        self.assertNotIn(f'api/countries/{self.countries[0].id}/index.json', files)
+        self.assertFalse(os.path.exists(os.path.join(self.output, f'api/countries/{self.countries[0].id}')
+                                        + '/index.json'))
+        self.assertIn(f'api/country-visa-types/{self.countries[1].id}/index.json', files)
+
+    def test_unchanged_files_are_not_rewritten(self):
+        self.export()
+        with mock.patch('visa_setup.management.commands.export_catalog._write_atomic') as write:
+            self.export('--incremental')
+        # Only the manifest itself is written again
+        self.assertEqual(write.call_count, 1)
+
+
+class ValuesPathParityTests(TestCase):
+    def setUp(self):
+        self.countries, self.visa_types = seed_catalog()
+        # Edge cases of the formatted fields: empty and set images, odd prices,
+        # null document timestamps and inactive types embedded in country details
+        VisaType.objects.filter(id=self.visa_types[0].id).update(image="", price="0")
+        VisaType.objects.filter(id=self.visa_types[1].id).update(image="https://cdn.example.com/v.png", price="1234.5")
+        RequiredDocuments.objects.filter(document_name="Doc 2").update(created_at=None, document_file=None)
+        inactive = VisaType.objects.create(name="Old", headings="Old", description="Old", active=False)
+        self.countries[0].types.add(inactive)
+        Country.objects.filter(id=self.countries[1].id).update(image="https://cdn.example.com/c.png")
+
+    def assertSameBytes(self, serializer_class, queryset, prefetch=(), fields=None):
+        rows = serializer_class(queryset.prefetch_related(*prefetch), many=True).data
+        if fields is not None:
+            rows = [{name: value for name, value in row.items() if name in fields} for row in rows]
+        expected = JSONRenderer().render(rows)
+        actual = JSONRenderer().render(compile_serializer(serializer_class).serialize(queryset, fields))
+        self.assertEqual(actual, expected)
+
+    def test_visa_types_match_serializer(self):
+        self.assertSameBytes(DetailedVisaTypeSerializer, VisaType.objects.all(), catalog.VISA_TYPE_NESTED)
+        self.assertSameBytes(
+            DetailedVisaTypeSerializer, VisaType.objects.filter(countries=self.countries[0].id, active=True),
+            catalog.VISA_TYPE_NESTED,
+        )
+        for shape in [('id', 'name', 'image', 'price'), ('name', 'notes', 'created_at')]:
+            self.assertSameBytes(
+                DetailedVisaTypeSerializer, VisaType.objects.all(), catalog.VISA_TYPE_NESTED, fields=shape
+            )
+
+    def test_countries_match_serializer(self):
+        self.assertSameBytes(CountrySerializer, Country.objects.all())
+        self.assertSameBytes(CountryDetailsSerializer, Country.objects.all(), ('types',))
+
+    def test_unsupported_method_fields_fail_loudly(self):
+        class WithMethod(CountrySerializer):
+            summary = serializers.SerializerMethodField()
+
+            class Meta(CountrySerializer.Meta):
+                fields = CountrySerializer.Meta.fields + ['summary']
+
+        with self.assertRaises(ImproperlyConfigured):
+            compile_serializer(WithMethod)
+
+    def test_benchmark_reports_identical_output(self):
+        output = io.StringIO()
+        call_command('benchmark_catalog', sizes='2,4', repeat=1, stdout=output)
+        rows = output.getvalue().splitlines()[1:]
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(all(row.endswith('True') for row in rows))
+        # The synthetic rows are rolled back
+        self.assertFalse(VisaType.objects.filter(name__startswith="Benchmark").exists())
+
+
+class BatchLookupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.countries, self.visa_types = seed_catalog()
+        cache.clear()
+        catalog_cache.local.clear()
+
+    def test_results_follow_request_order_with_markers(self):
+        first, second, third = self.visa_types
+        response = self.client.get('/api/visa-types/', {'ids': f'{third.id},999,{first.id},{third.id}'})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)
+        self.assertEqual([item['id'] for item in results], [third.id, 999, first.id, third.id])
+        self.assertEqual(results[1], {'id': 999, 'error': 'Visa type not found'})
+        self.assertEqual(results[0], json.loads(self.client.get(f'/api/visa-types/{third.id}/').content))
+
+    def test_hits_use_one_multi_get_and_misses_one_build(self):
+        first, second, third = self.visa_types
+        self.client.get(f'/api/visa-types/{first.id}/')
+        catalog_cache.local.clear()
+        with mock.patch.object(catalog, 'build_visa_types_by_id', wraps=catalog.build_visa_types_by_id) as build, \
+                mock.patch.object(catalog_cache.shared, 'get_many', wraps=catalog_cache.shared.get_many) as get_many, \
+                self.assertNumQueries(5):
+            self.client.get('/api/visa-types/', {'ids': f'{first.id},{second.id},{third.id}'})
+        build.assert_called_once_with([second.id, third.id])
+        # One multi-get for the entries, the rest is the store of the misses
+        self.assertEqual(set(get_many.call_args_list[0].args[0]), {
+            catalog._entry_key(catalog.VISA_TYPES, catalog.get_generation(catalog.VISA_TYPES), vt.id)
+            for vt in self.visa_types
+        })
+        with self.assertNumQueries(0):
+            self.client.get(f'/api/visa-types/{third.id}/')
+
+    def test_countries_batch_and_conditional_get(self):
+        ids = f'{self.countries[1].id},{self.countries[0].id}'
+        response = self.client.get('/api/countries/', {'ids': ids})
+        self.assertEqual([item['id'] for item in json.loads(response.content)],
+                         [self.countries[1].id, self.countries[0].id])
+        again = self.client.get('/api/countries/', {'ids': ids}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_invalid_ids_are_rejected(self):
+        self.assertEqual(self.client.get('/api/visa-types/', {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/countries/', {'ids': ''}).status_code, 400)
+        too_many = ','.join(str(i) for i in range(1, 60))
+        self.assertEqual(self.client.get('/api/countries/', {'ids': too_many}).status_code, 400)
+
+
+class BootstrapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.countries, self.visa_types = seed_catalog(visa_types=8)
+            Settings.objects.create(email="info@example.com")
+
+    def test_bundles_the_three_parts(self):
+        response = self.client.get('/api/bootstrap/')
+        self.assertEqual(response.status_code, 200)
+        document = json.loads(response.content)
+        self.assertEqual(document['countries'], json.loads(self.client.get('/api/countries/').content))
+        self.assertEqual(document['settings'], json.loads(self.client.get('/api/settings/').content))
+        cards = document['visa_types']
+        self.assertEqual(len(cards['results']), 6)
+        self.assertEqual(list(cards['results'][0]), ['id', 'name', 'headings', 'image', 'price'])
+        self.assertIsNotNone(cards['next_cursor'])
+
+    def test_prebuilt_after_writes_and_served_without_queries(self):
+        first = self.client.get('/api/bootstrap/')
+        with self.assertNumQueries(0):
+            again = self.client.get('/api/bootstrap/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            site_settings = Settings.objects.first()
+            site_settings.email = "new@example.com"
+            site_settings.save()
+        with self.assertNumQueries(0):
+            rebuilt = self.client.get('/api/bootstrap/')
+        self.assertNotEqual(rebuilt['ETag'], first['ETag'])
+        self.assertIn(b"new@example.com", rebuilt.content)
+
+    def test_unrelated_changes_keep_the_document(self):
+        first = self.client.get('/api/bootstrap/')
+        catalog.bump(catalog.COUNTRY_VISA_TYPES)
+        with mock.patch.object(catalog, 'build_bootstrap') as build:
+            self.assertEqual(self.client.get('/api/bootstrap/')['ETag'], first['ETag'])
+        build.assert_not_called()
+
+    def test_previous_build_is_served_while_another_request_rebuilds(self):
+        first = self.client.get('/api/bootstrap/')
+        catalog.bump(catalog.SETTINGS)
+        generation = catalog.get_generation(catalog.BOOTSTRAP)
+        cache.add(catalog._lock_key(catalog.BOOTSTRAP, generation, catalog.BOOTSTRAP_NAME), 1)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/bootstrap/')
+        self.assertEqual(response['ETag'], first['ETag'])
+
+    @override_settings(
+        CATALOG_CACHE_TTLS={'bootstrap': {'soft': 0, 'hard': 3600}},
+        CATALOG_REFRESH_IN_BACKGROUND=False,
+    )
+    def test_stale_document_is_served_then_refreshed_once(self):
+        first = self.client.get('/api/bootstrap/')
+        with mock.patch.object(catalog, 'build_bootstrap', wraps=catalog.build_bootstrap) as build:
+            stale = self.client.get('/api/bootstrap/')
+        build.assert_called_once()
+        self.assertEqual(stale.content, first.content)
+
+    def test_ignores_bad_tokens(self):
+        # Public document: no JWT parsing, so a stale token cannot fail it
+        response = self.client.get('/api/bootstrap/', HTTP_AUTHORIZATION='Bearer expired')
+        self.assertEqual(response.status_code, 200)
+
+
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.student = VisaType.objects.create(
+                name="Student Visa", headings="Study abroad", description="For universities",
+            )
+            self.work = VisaType.objects.create(
+                name="Work Permit", headings="Employment", description="Needs a student loan waiver",
+            )
+            self.work.required_documents.add(RequiredDocuments.objects.create(
+                document_name="Bank statement", description="Six months of statements",
+            ))
+            VisaType.objects.create(name="Student Exchange", headings="Old", description="Old", active=False)
+            self.canada = Country.objects.create(name="Canada", description="Maple", code="CA")
+
+    def results(self, **params):
+        response = self.client.get('/api/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [(hit['type'], hit['id']) for hit in json.loads(response.content)['results']]
+
+    def test_name_matches_outrank_description_matches(self):
+        self.assertEqual(self.results(q='student'), [('visa_type', self.student.id), ('visa_type', self.work.id)])
+
+    def test_prefix_typeahead_and_documents(self):
+        self.assertEqual(self.results(q='canad'), [('country', self.canada.id)])
+        self.assertEqual(self.results(q='bank stat'), [('visa_type', self.work.id)])
+        self.assertEqual(self.results(q='stud', type='country'), [])
+
+    def test_index_follows_catalog_generations(self):
+        self.results(q='visa')
+        with mock.patch('visa_setup.search.build_index', wraps=search.build_index) as build:
+            self.results(q='visa')
+            build.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                tourist = VisaType.objects.create(name="Tourist Visa", headings="Travel", description="Trips")
+            self.assertIn(('visa_type', tourist.id), self.results(q='tourist'))
+            build.assert_called_once()
+
+    def test_short_queries_are_rejected(self):
+        self.assertEqual(self.client.get('/api/search/', {'q': 'a'}).status_code, 400)
+
+    def test_limited_typeahead_on_5k_visa_types_keeps_the_full_ranking(self):
+        # Latency is measured by `benchmark_catalog --search`, not asserted here
+        index = search.InvertedIndex(search_documents(5000))
+        matched = 0
+        for query in SEARCH_QUERIES:
+            ranked = index.search(query)
+            matched += bool(ranked)
+            self.assertEqual(index.search(query, limit=20), ranked[:20])
+        self.assertGreater(matched, len(SEARCH_QUERIES) // 2)
+
+    def test_benchmark_reports_search_latency(self):
+        output = io.StringIO()
+        call_command('benchmark_catalog', search=True, search_size=200, repeat=1, stdout=output)
+        self.assertIn('p95', output.getvalue())
+
+    def test_vendor_selects_the_search_path(self):
+        with mock.patch.object(search, '_postgres_search', return_value=[]) as postgres:
+            self.results(q='student')
+            postgres.assert_not_called()
+            with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                    mock.patch.object(search, '_memory_search') as memory:
+                self.assertEqual(self.results(q='student'), [])
+                memory.assert_not_called()
+            postgres.assert_called_once()
+
+    def test_indexes_are_only_created_on_postgres(self):
+        with mock.patch.object(connection, 'cursor') as cursor:
+            search.ensure_indexes()
+        cursor.assert_not_called()
+
+    def run_on_postgres(self, extension_allowed=True):
+        """SQL of a search and of ensure_indexes against a mocked PostgreSQL connection."""
+        executed = []
+        installed = []
+
+        def execute(sql, params=None):
+            if sql.startswith('CREATE EXTENSION'):
+                if not extension_allowed:
+                    raise ProgrammingError('permission denied to create extension "pg_trgm"')
+                installed.append(True)
+            executed.append((sql, params))
+
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value.execute.side_effect = execute
+        cursor.__enter__.return_value.fetchall.return_value = []
+        cursor.__enter__.return_value.fetchone.side_effect = lambda: (1,) if installed else None
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                mock.patch.object(connection, 'cursor', return_value=cursor), \
+                mock.patch.dict(search._trigram, clear=True):
+            search.ensure_indexes()
+            search.search('student visa')
+        ddl = [sql for sql, _ in executed if sql.startswith('CREATE')]
+        queries = [(sql, params) for sql, params in executed if sql.startswith(('SELECT id', 'WITH'))]
+        return ddl, queries
+
+    def test_postgres_queries_use_the_indexed_expressions(self):
+        ddl, queries = self.run_on_postgres()
+        self.assertIn("CREATE EXTENSION IF NOT EXISTS pg_trgm", ddl)
+        for model, kind in ((Country, 'country'), (VisaType, 'visa_type'), (RequiredDocuments, 'document')):
+            expression = search._vector_sql(model._meta.db_table, search.SEARCH_FIELDS[kind])
+            self.assertTrue(any(expression in statement for statement in ddl))
+            self.assertTrue(any(f"{expression} @@ q" in sql for sql, _ in queries))
+        self.assertEqual(sum('gin_trgm_ops' in statement for statement in ddl), 2)
+        for sql, params in queries:
+            self.assertIn('similarity(name, %s)', sql)
+            self.assertEqual(sql.count('%s'), len(params))
+
+    def test_postgres_without_trigram_privilege_degrades(self):
+        with self.assertLogs('visa_setup.search', 'WARNING'):
+            ddl, queries = self.run_on_postgres(extension_allowed=False)
+        self.assertEqual(len(ddl), 3)
+        self.assertFalse(any('gin_trgm_ops' in statement for statement in ddl))
+        self.assertEqual(len(queries), 2)
+        for sql, params in queries:
+            self.assertNotIn('similarity', sql)
+            self.assertNotIn('%%', sql)
+            self.assertEqual(sql.count('%s'), len(params))
+
+
+class IndexUsageTests(TestCase):
+    """EXPLAIN the hot queries of the public and admin views on a seeded dataset."""
+
+    def setUp(self):
+        self.countries, self.visa_types = seed_catalog(countries=5, visa_types=5)
+        self.user = User.objects.create_user(email="user@example.com", username="user", password="x")
+        for visa_type in self.visa_types:
+            application = VisaApplication.objects.create(
+                user=self.user, visa_type=visa_type, country=self.countries[0], status='submitted',
+            )
+            ApplicationDocument.objects.create(
+                application=application, required_document=visa_type.required_documents.first(),
+            )
+            Consultation.objects.create(scheduled_at=application.created_at, email_or_phone="x")
+        if connection.vendor == 'postgresql':
+            # A seeded table this small is cheaper to scan; only check that an index is usable
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f"{index_name} not used by:\n{queryset.query}\n{plan}")
+
+    def test_catalog_lists(self):
+        self.assertUsesIndex(
+            VisaType.objects.filter(active=True).order_by(*catalog.VISA_TYPE_ORDERING), 'visatype_active_created_idx'
+        )
+        self.assertUsesIndex(
+            Country.objects.filter(active=True).order_by(*catalog.COUNTRY_ORDERING), 'country_active_name_idx'
+        )
+
+    def test_application_queries(self):
+        self.assertUsesIndex(
+            VisaApplication.objects.filter(user=self.user).order_by('-created_at'), 'visaapp_user_created_idx'
+        )
+        self.assertUsesIndex(
+            VisaApplication.objects.filter(status='submitted').order_by('-created_at'), 'visaapp_status_created_idx'
+        )
+        self.assertUsesIndex(VisaApplication.objects.order_by('-created_at'), 'visaapp_created_idx')
+        self.assertUsesIndex(
+            ApplicationDocument.objects.filter(status='pending').order_by('created_at'), 'appdoc_status_created_idx'
+        )
+
+    def test_consultation_orderings(self):
+        self.assertUsesIndex(Consultation.objects.all(), 'consultation_scheduled_idx')
+        self.assertUsesIndex(Consultation.objects.order_by('-created_at'), 'consultation_created_idx')
+
+
+class CountryTypesPrefetchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.local.clear()
+        self.client = APIClient()
+        self.countries, self.visa_types = seed_catalog(countries=3, visa_types=4)
+        VisaType.objects.filter(id__in=[v.id for v in self.visa_types[:2]]).update(active=False)
+        cache.clear()
+
+    def test_list_loads_no_visa_types(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/countries/')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn(VisaType._meta.db_table, queries[0]['sql'])
+
+    def test_details_load_only_active_types_and_rendered_columns(self):
+        country = self.countries[0]
+        with CaptureQueriesContext(connection) as queries:
+            detail = json.loads(self.client.get(f'/api/countries/{country.id}/').content)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual([t['id'] for t in detail['types']], [v.id for v in reversed(self.visa_types[2:])])
+        types_sql = queries[1]['sql']
+        self.assertNotIn('"description"', types_sql)
+        # Rows loaded for the types: only the active half
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM ({types_sql}) rows")
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_batch_details_share_one_types_query(self):
+        ids = ','.join(str(c.id) for c in self.countries)
+        with self.assertNumQueries(2):
+            results = json.loads(self.client.get('/api/countries/', {'ids': ids}).content)
+        self.assertTrue(all(len(item['types']) == 2 for item in results))
+
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@dataclass(frozen=True)
+class Budget:
+    """At most ``queries`` queries for ``method path``, at any row count."""
+    method: str
+    path: str
+    queries: int
+    # Payload, or a function of the seed context returning one (for files)
+    data: object = None
+    status: int = 200
+    # Context key of the access token to send: 'user', 'admin' or None
+    auth: str = None
+
+
+class QueryBudgetMixin:
+    """
+    Runs every endpoint in ``budgets`` once against a small and once against a
+    large seed, each rolled back afterwards, with cold caches. Fails when an
+    endpoint issues more queries than its budget, or more queries for the
+    large seed than for the small one: a query per row somewhere.
+
+    Paths and string payload values are formatted with the seed context.
+    """
+    budgets = ()
+    sizes = (2, 6)
+
+    def setUp(self):
+        # Spooled and directly uploaded files go to disk, outside the rolled back transaction
+        spool = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool)
+        overrides = self.settings(
+            UPLOAD_SPOOL_DIR=os.path.join(spool, 'spool'), LOCAL_STORAGE_ROOT=os.path.join(spool, 'storage'),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def seed(self, size) -> dict:
+        """``size`` countries, visa types, applications and consultations."""
+        countries, visa_types = seed_catalog(countries=size, visa_types=size)
+        Settings.objects.create(email="info@example.com", phone_number="123")
+        password = 'Budget#pass42'
+        user = User.objects.create_user(
+            email='applicant@example.com', username='applicant', password=password,
+            first_name='Ada', last_name='Applicant',
+        )
+        admin = User.objects.create_superuser(
+            email='admin@example.com', username='admin', password=password,
+            first_name='Ed', last_name='Admin',
+        )
+        applications = []
+        for country, visa_type in zip(countries, visa_types):
+            application = VisaApplication.objects.create(user=user, country=country, visa_type=visa_type)
+            for document in visa_type.required_documents.all():
+                ApplicationDocument.objects.create(
+                    application=application, required_document=document, file='https://files.example.com/doc.pdf',
+                )
+            applications.append(application)
+        consultations = [
+            Consultation.objects.create(scheduled_at=timezone.now(), email_or_phone=f'client{i}@example.com')
+            for i in range(size)
+        ]
+        visa_type = visa_types[0]
+        refresh = RefreshToken.for_user(user)
+        return {
+            'country': countries[0].id,
+            'visa_type': visa_type.id,
+            'visa_types': ','.join(str(v.id) for v in visa_types),
+            'process': visa_type.processes.get().id,
+            'overview': visa_type.overviews.get().id,
+            'note': visa_type.notes.get().id,
+            'document': visa_type.required_documents.get().id,
+            'application': applications[0].id,
+            'consultation': consultations[0].id,
+            'email': user.email,
+            'admin_email': admin.email,
+            'password': password,
+            'refresh': str(refresh),
+            'user': str(refresh.access_token),
+            'admin': str(RefreshToken.for_user(admin).access_token),
+            'upload_token': LocalStorage().create_upload('uploads/budget.pdf')['url'].rstrip('/').rpartition('/')[2],
+        }
+
+    def count_queries(self, budget, size) -> int:
+        cache.clear()
+        catalog_cache.local.clear()
+        with transaction.atomic():
+            context = self.seed(size)
+            client = APIClient()
+            if budget.auth:
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {context[budget.auth]}')
+            data = budget.data(context) if callable(budget.data) else {
+                key: value.format(**context) if isinstance(value, str) else value
+                for key, value in (budget.data or {}).items()
+            }
+            request = getattr(client, budget.method.lower())
+            # Storage is not what is being measured (and connects on import)
+            storage = mock.Mock(upload_file_to_supabase=mock.Mock(return_value='https://files.example.com/new.pdf'))
+            with mock.patch.dict('sys.modules', {'core.supabase_client': storage}):
+                with CaptureQueriesContext(connection) as queries:
+                    response = request(budget.path.format(**context), data)
+            transaction.set_rollback(True)
+        self.assertEqual(response.status_code, budget.status, response.content[:300])
+        return len(queries)
+
+    def test_query_budgets(self):
+        small, large = self.sizes
+        for budget in self.budgets:
+            with self.subTest(f'{budget.method} {budget.path} -> {budget.status}'), self.settings(PASSWORD_HASHERS=FAST_HASHERS):
+                queries = self.count_queries(budget, small)
+                queries_large = self.count_queries(budget, large)
+                self.assertLessEqual(queries_large, budget.queries, "over the query budget")
+                self.assertEqual(queries_large, queries, f"query count grows with rows ({small} rows: {queries})")
+
+
+def uploaded_intent(application_id, required_document_id) -> str:
+    """Intent token of a file already sent to the local storage stand-in."""
+    intent = direct_uploads.create_intent(VisaApplication(pk=application_id), required_document_id, 'passport.pdf')
+    LocalStorage().save(intent['path'], [b'%PDF-1.4'])
+    return intent['intent']
+
+
+@override_settings(STORAGE_BACKEND='core.storage_backends.LocalStorage')
+class VisaSetupQueryBudgetTests(QueryBudgetMixin, TestCase):
+    budgets = (
+        Budget('GET', '/api/visa-types/', 5),
+        Budget('GET', '/api/visa-types/?limit=2', 5),
+        Budget('GET', '/api/visa-types/?ids={visa_types}', 5),
+        Budget('GET', '/api/visa-types/?fields=id,name,required_documents', 2),
+        Budget('GET', '/api/visa-types/{visa_type}/', 5),
+        Budget('GET', '/api/countries/', 1),
+        Budget('GET', '/api/countries/?limit=2', 1),
+        Budget('GET', '/api/countries/{country}/', 2),
+        Budget('GET', '/api/country-visa-types/{country}/', 6),
+        Budget('GET', '/api/settings/', 1),
+        Budget('GET', '/api/bootstrap/', 3),
+        Budget('GET', '/api/search/?q=visa', 3),
+        Budget('POST', '/api/book-consultation/', 1, {'scheduled_at': '2030-01-01T10:00:00Z', 'email_or_phone': 'x@example.com'}, status=201),
+        Budget('GET', '/api/visa-applications/', 5, auth='user'),
+        Budget('GET', '/api/visa-applications/{application}/', 5, auth='user'),
+        Budget('POST', '/api/visa-applications/', 12, {'country_id': '{country}', 'visa_type_id': '{visa_type}'}, status=201, auth='user'),
+        Budget('PATCH', '/api/visa-applications/{application}/', 23, lambda c: {
+            'required_documents_files': json.dumps([{'required_document_id': c['document']}]),
+            f"file_{c['document']}": SimpleUploadedFile('passport.pdf', b'%PDF-1.4'),
+        }, auth='user'),
+        Budget('GET', '/api/v2/visa-applications/', 5, auth='user'),
+        Budget('GET', '/api/v2/visa-applications/{application}/', 5, auth='user'),
+        Budget('POST', '/api/v2/visa-applications/', 9, {'country_id': '{country}', 'visa_type_id': '{visa_type}'}, status=201, auth='user'),
+        Budget('PUT', '/api/v2/visa-applications/{application}/', 15, lambda c: {
+            f"required_documents[{c['document']}]": SimpleUploadedFile('passport.pdf', b'%PDF-1.4'),
+        }, auth='user'),
+        Budget('POST', '/api/v2/visa-applications/{application}/uploads/', 3, {
+            'required_document_id': '{document}', 'file_name': 'passport.pdf',
+        }, status=201, auth='user'),
+        Budget('POST', '/api/v2/visa-applications/{application}/uploads/confirm/', 10, lambda c: {
+            'intent': uploaded_intent(c['application'], c['document']),
+        }, auth='user'),
+        Budget('PUT', '/api/storage/local/{upload_token}/', 0, {
+            'file': SimpleUploadedFile('passport.pdf', b'%PDF-1.4'),
+        }, status=201),
+    )
+
+
+class ApplicationCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        countries, visa_types = seed_catalog(countries=1, visa_types=3)
+        self.user = User.objects.create_user(
+            email='applicant@example.com', username='applicant', password='x', first_name='Ada', last_name='A',
+        )
+        self.admin = User.objects.create_superuser(
+            email='admin@example.com', username='admin', password='x', first_name='Ed', last_name='E',
+        )
+        self.applications = [
+            VisaApplication.objects.create(user=self.user, country=countries[0], visa_type=visa_type)
+            for visa_type in visa_types
+        ]
+        self.country, self.visa_types = countries[0], visa_types
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def listed(self, version=''):
+        return json.loads(self.client.get(f'/api/{version}visa-applications/').content)['Applications:']
+
+    def test_lists_are_newest_first_and_shapes_do_not_collide(self):
+        v1, v2 = self.listed(), self.listed('v2/')
+        newest_first = [a.id for a in reversed(self.applications)]
+        self.assertEqual([a['id'] for a in v1], newest_first)
+        self.assertEqual([a['id'] for a in v2], newest_first)
+        self.assertIn('required_documents', v1[0])
+        self.assertNotIn('required_documents', v2[0])
+
+    def test_cached_list_and_detail_need_no_queries(self):
+        self.listed()
+        with self.assertNumQueries(0):
+            self.listed()
+            detail = self.client.get(f'/api/visa-applications/{self.applications[0].id}/')
+        self.assertEqual(detail.status_code, 200)
+
+    def test_other_users_application_is_not_found(self):
+        other = User.objects.create_user(email='o@example.com', username='other', password='x', first_name='O', last_name='O')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(f'/api/v2/visa-applications/{self.applications[0].id}/').status_code, 404)
+
+    def test_admin_update_replaces_only_that_entry(self):
+        self.listed()
+        self.listed('v2/')
+        target, untouched = self.applications[1], self.applications[0]
+        admin = APIClient()
+        admin.force_authenticate(self.admin)
+        with mock.patch.object(application_cache, '_serialize', wraps=application_cache._serialize) as full:
+            response = admin.put(f'/api/admin/visa-applications/{target.id}/', {'status': 'approved'})
+        self.assertEqual(response.status_code, 200)
+        full.assert_not_called()
+        with self.assertNumQueries(0):
+            v1, v2 = self.listed(), self.listed('v2/')
+        self.assertEqual({a['id']: a['status'] for a in v1}[target.id], 'approved')
+        self.assertEqual({a['id']: a['status'] for a in v2}[target.id], 'approved')
+        self.assertEqual({a['id']: a['status'] for a in v1}[untouched.id], 'draft')
+
+    def test_create_and_delete_patch_the_index(self):
+        self.listed('v2/')
+        response = self.client.post('/api/v2/visa-applications/', {
+            'country_id': self.country.id, 'visa_type_id': self.visa_types[0].id,
+        })
+        self.assertEqual(response.status_code, 201)
+        created = json.loads(response.content)['Application']['id']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.listed('v2/')[0]['id'], created)
+
+        admin = APIClient()
+        admin.force_authenticate(self.admin)
+        self.assertEqual(admin.delete(f'/api/admin/visa-applications/{created}/').status_code, 204)
+        with self.assertNumQueries(0):
+            self.assertNotIn(created, [a['id'] for a in self.listed('v2/')])
+
+    def test_index_patches_wait_for_the_lock(self):
+        self.listed()
+        key = application_cache.index_key(self.user.id, application_cache.V1)
+        cache.add(f"{key}:lock", 1)
+        removed = self.applications[0].id
+
+        def other_writer_done(seconds):
+            cache.delete(f"{key}:lock")
+
+        with mock.patch('visa_setup.application_cache.time.sleep', side_effect=other_writer_done) as sleep:
+            application_cache.remove(self.user.id, removed)
+        sleep.assert_called()
+        self.assertEqual(cache.get(key), [a.id for a in reversed(self.applications) if a.id != removed])
+
+    def test_busy_index_lock_drops_the_index(self):
+        self.listed()
+        key = application_cache.index_key(self.user.id, application_cache.V1)
+        cache.add(f"{key}:lock", 1)
+        with mock.patch.object(application_cache, 'INDEX_LOCK_WAIT', 0):
+            application_cache.remove(self.user.id, self.applications[0].id)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(len(self.listed()), 3)
+
+    def test_expired_entries_are_serialized_alone(self):
+        self.listed()
+        cache.delete(application_cache.entry_key(self.user.id, application_cache.V1, self.applications[0].id))
+        with CaptureQueriesContext(connection) as queries:
+            listed = self.listed()
+        self.assertEqual(len(listed), 3)
+        self.assertIn('IN (%d)' % self.applications[0].id, queries[0]['sql'])
+
+    def test_application_deleted_behind_the_cache_drops_out(self):
+        self.listed()
+        VisaApplication.objects.filter(pk=self.applications[0].pk).delete()
+        cache.delete(application_cache.entry_key(self.user.id, application_cache.V1, self.applications[0].id))
+        self.assertEqual(len(self.listed()), 2)
+        self.assertEqual(
+            cache.get(application_cache.index_key(self.user.id, application_cache.V1)),
+            [a.id for a in reversed(self.applications[1:])],
+        )
+
+
+class ConcurrentUploadTests(TestCase):
+    delay = 0.2
+
+    def setUp(self):
+        cache.clear()
+        self.active = self.peak = 0
+        self.lock = threading.Lock()
+        self.storage = mock.Mock(upload_file_to_supabase=mock.Mock(side_effect=self.upload))
+        patcher = mock.patch.dict('sys.modules', {'core.supabase_client': self.storage})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, file, folder="uploads", bucket="visa", name=None):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if file.name.startswith('broken'):
+            raise ConnectionError("storage unavailable")
+        return f'https://files.example.com/{file.name}'
+
+    def files(self, count, broken=()):
+        return {
+            i: SimpleUploadedFile(f"{'broken' if i in broken else 'doc'}{i}.pdf", f'%PDF-1.4 {i}'.encode())
+            for i in range(1, count + 1)
+        }
+
+    def test_uploads_run_in_parallel(self):
+        started = time.monotonic()
+        results = uploads.upload_files(self.files(4))
+        self.assertLess(time.monotonic() - started, 2 * self.delay)
+        self.assertEqual(list(results), [1, 2, 3, 4])
+        self.assertEqual(results[3].url, 'https://files.example.com/doc3.pdf')
+
+    @override_settings(STORAGE_UPLOAD_CONCURRENCY=2)
+    def test_concurrency_is_capped(self):
+        uploads.upload_files(self.files(5))
+        self.assertEqual(self.peak, 2)
+
+    def test_failures_are_reported_per_file(self):
+        results = uploads.upload_files(self.files(3, broken={2}))
+        self.assertEqual(uploads.upload_errors(results), {2: "storage unavailable"})
+        self.assertTrue(results[1].ok and results[3].ok)
+
+    def test_failed_uploads_keep_the_current_file(self):
+        countries, visa_types = seed_catalog(countries=1, visa_types=1)
+        user = User.objects.create_user(email='a@example.com', username='applicant', password='x', first_name='A', last_name='A')
+        application = VisaApplication.objects.create(user=user, country=countries[0], visa_type=visa_types[0])
+        document = ApplicationDocument.objects.create(
+            application=application, required_document=visa_types[0].required_documents.get(),
+            file='https://files.example.com/old.pdf', status='approved',
+        )
+        uploads.save_documents(application, {document.required_document_id: uploads.UploadResult(error='storage unavailable')})
+        document.refresh_from_db()
+        self.assertEqual((document.file, document.status), ('https://files.example.com/old.pdf', 'approved'))
+
+    def test_submission_writes_documents_in_one_batch(self):
+        countries, visa_types = seed_catalog(countries=1, visa_types=1)
+        visa_type = visa_types[0]
+        visa_type.required_documents.add(*[RequiredDocuments.objects.create(document_name=f"Extra {i}") for i in range(2)])
+        user = User.objects.create_user(email='a@example.com', username='applicant', password='x', first_name='A', last_name='A')
+        client = APIClient()
+        client.force_authenticate(user)
+        documents = list(visa_type.required_documents.order_by('id'))
+        data = {'country_id': countries[0].id, 'visa_type_id': visa_type.id}
+        for i, document in enumerate(documents):
+            name = 'broken.pdf' if i == 1 else f'doc{i}.pdf'
+            data[f'required_documents[{document.id}]'] = SimpleUploadedFile(name, f'%PDF-1.4 {i}'.encode())
+
+        table = ApplicationDocument._meta.db_table
+        started = time.monotonic()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/v2/visa-applications/', data)
+        self.assertLess(time.monotonic() - started, 2 * self.delay)
+        self.assertEqual(response.status_code, 201)
+        inserts = [q for q in queries if q['sql'].startswith(f'INSERT INTO "{table}"')]
+        self.assertEqual(len(inserts), 1)
+
+        body = json.loads(response.content)
+        self.assertEqual(body['upload_errors'], {str(documents[1].id): "storage unavailable"})
+        files = dict(ApplicationDocument.objects.values_list('required_document_id', 'file'))
+        self.assertEqual(files[documents[0].id], 'https://files.example.com/doc0.pdf')
+        self.assertNotIn(documents[1].id, files)
+
+
+class _StreamingTransport(httpx.BaseTransport):
+    """Storage stand-in that consumes request bodies chunk by chunk, like a socket."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.body_sizes = []
+
+    def handle_request(self, request):
+        self.body_sizes.append(sum(len(chunk) for chunk in request.stream))
+        if self.failures:
+            self.failures -= 1
+            return httpx.Response(500, json={'message': 'unavailable'})
+        return httpx.Response(200, json={'Key': 'visa/uploads/file.pdf'})
+
+
+class StreamingUploadTests(TestCase):
+    def setUp(self):
+        self.transport = _StreamingTransport()
+        session = SyncClient(base_url='https://storage.example.com/storage/v1/', transport=self.transport)
+        client = mock.Mock()
+        client.storage.from_.side_effect = lambda bucket: SyncBucketProxy(bucket, session)
+        patcher = mock.patch.object(supabase_client, 'get_supabase', return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def uploaded_file(self, size):
+        file = TemporaryUploadedFile('scan.pdf', 'application/pdf', size, None)
+        self.addCleanup(file.close)
+        block = b'x' * (1024 * 1024)
+        for offset in range(0, size, len(block)):
+            file.write(block[:size - offset])
+        return file
+
+    def peak_memory(self, file):
+        tracemalloc.start()
+        try:
+            supabase_client.upload_file_to_supabase(file)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_peak_memory_does_not_grow_with_file_size(self):
+        small = self.peak_memory(self.uploaded_file(256 * 1024))
+        large = self.peak_memory(self.uploaded_file(10 * 1024 * 1024))
+        self.assertLess(large, 1024 * 1024)
+        self.assertLess(large - small, 8 * supabase_client.UPLOAD_CHUNK_SIZE)
+
+    def test_whole_file_is_sent(self):
+        file = self.uploaded_file(3 * 1024 * 1024 + 7)
+        url = supabase_client.upload_file_to_supabase(file, folder='documents')
+        self.assertIn('/object/public/visa/documents/', url)
+        self.assertGreater(self.transport.body_sizes[0], file.size)
+        self.assertLess(self.transport.body_sizes[0], file.size + 1024)
+
+    def test_retry_rewinds_the_file(self):
+        self.transport.failures = 1
+        file = self.uploaded_file(512 * 1024)
+        supabase_client.upload_file_to_supabase(file)
+        first, retry = self.transport.body_sizes
+        self.assertEqual(first, retry)
+
+
+class DirectUploadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        overrides = self.settings(STORAGE_BACKEND='core.storage_backends.LocalStorage', LOCAL_STORAGE_ROOT=root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.root = root
+        countries, visa_types = seed_catalog(countries=1, visa_types=2)
+        self.user = User.objects.create_user(
+            email='applicant@example.com', username='applicant', password='x', first_name='Ada', last_name='A',
+        )
+        self.application = VisaApplication.objects.create(user=self.user, country=countries[0], visa_type=visa_types[0])
+        self.required_document = visa_types[0].required_documents.get()
+        self.other_document = visa_types[1].required_documents.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def intent(self, required_document_id=None, application=None):
+        return self.client.post(
+            f'/api/v2/visa-applications/{(application or self.application).id}/uploads/',
+            {'required_document_id': required_document_id or self.required_document.id, 'file_name': 'passport.pdf'},
+            format='json',
+        )
+
+    def confirm(self, intent, application=None):
+        return self.client.post(
+            f'/api/v2/visa-applications/{(application or self.application).id}/uploads/confirm/',
+            {'intent': intent}, format='json',
+        )
+
+    def send(self, intent, body=b'%PDF-1.4 scan'):
+        return APIClient().generic(
+            intent['method'], intent['upload_url'], body, content_type=intent['headers']['Content-Type'],
+        )
+
+    def test_upload_goes_to_storage_then_confirm_records_it(self):
+        intent = self.intent().json()
+        self.assertEqual(intent['headers']['Content-Type'], 'application/pdf')
+        self.assertEqual(self.send(intent).status_code, 201)
+        with open(os.path.join(self.root, 'visa', intent['path']), 'rb') as stored:
+            self.assertEqual(stored.read(), b'%PDF-1.4 scan')
+
+        response = self.confirm(intent['intent'])
+        self.assertEqual(response.status_code, 200)
+        document = ApplicationDocument.objects.get(application=self.application, required_document=self.required_document)
+        self.assertEqual(document.file, f"http://localhost:8000/media/storage/visa/{intent['path']}")
+        self.assertEqual(response.json()['document']['file'], document.file)
+        detail = self.client.get(f'/api/v2/visa-applications/{self.application.id}/').json()
+        self.assertEqual(detail['visa_type']['required_documents'][0]['document_file'], document.file)
+
+    def test_confirm_before_upload_is_rejected(self):
+        intent = self.intent().json()
+        response = self.confirm(intent['intent'])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ApplicationDocument.objects.exists())
+
+    def test_only_slots_of_the_visa_type_get_intents(self):
+        self.assertEqual(self.intent(self.other_document.id).status_code, 400)
+        other = User.objects.create_user(email='o@example.com', username='other', password='x', first_name='O', last_name='O')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.intent().status_code, 404)
+
+    def test_intents_are_bound_to_their_application(self):
+        intent = self.intent().json()
+        self.send(intent)
+        other = VisaApplication.objects.create(
+            user=self.user, country=self.application.country, visa_type=self.application.visa_type,
+        )
+        self.assertEqual(self.confirm(intent['intent'], other).status_code, 400)
+        self.assertEqual(self.confirm(intent['intent'][:-1] + 'x').status_code, 400)
+
+    def test_only_allowed_file_types_get_intents(self):
+        response = self.client.post(
+            f'/api/v2/visa-applications/{self.application.id}/uploads/',
+            {'required_document_id': self.required_document.id, 'file_name': 'payload.html'}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_oversized_uploads_are_deleted_not_recorded(self):
+        intent = self.intent().json()
+        self.send(intent, b'x' * 11)
+        with mock.patch.object(direct_uploads, 'MAX_FILE_SIZE', 10):
+            self.assertEqual(self.confirm(intent['intent']).status_code, 400)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'visa', intent['path'])))
+        self.assertFalse(ApplicationDocument.objects.exists())
+
+    def test_confirming_again_changes_nothing(self):
+        intent = self.intent().json()
+        self.send(intent)
+        self.confirm(intent['intent'])
+        ApplicationDocument.objects.update(status='approved', admin_notes='Looks good')
+        self.assertEqual(self.confirm(intent['intent']).status_code, 200)
+        document = ApplicationDocument.objects.get()
+        self.assertEqual((document.status, document.admin_notes), ('approved', 'Looks good'))
+
+        # Nor once a later upload replaced the file
+        ApplicationDocument.objects.update(file='https://files.example.com/newer.pdf')
+        self.confirm(intent['intent'])
+        self.assertEqual(ApplicationDocument.objects.get().file, 'https://files.example.com/newer.pdf')
+
+    def test_intents_and_upload_urls_expire(self):
+        intent = self.intent().json()
+        with self.settings(UPLOAD_INTENT_MAX_AGE=-1):
+            self.assertEqual(self.send(intent).status_code, 403)
+            self.assertEqual(self.confirm(intent['intent']).status_code, 400)
+
+
+class SupabaseStorageTests(TestCase):
+    def setUp(self):
+        self.requests = []
+        session = SyncClient(base_url='https://storage.example.com/storage/v1/', transport=httpx.MockTransport(self.handle))
+        client = mock.Mock()
+        client.storage.from_.side_effect = lambda bucket: SyncBucketProxy(bucket, session)
+        patcher = mock.patch.object(supabase_client, 'get_supabase', return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handle(self, request):
+        self.requests.append(request)
+        if request.url.path.startswith('/storage/v1/object/upload/sign/'):
+            return httpx.Response(200, json={'url': '/object/upload/sign/visa/uploads/a.pdf?token=signed'})
+        if request.url.path == '/storage/v1/object/list/visa':
+            return httpx.Response(200, json=[{'name': 'a.pdf', 'metadata': {'size': 42}}, {'name': 'a.pdf.bak'}])
+        return httpx.Response(404, json={'message': 'not found'})
+
+    def test_signed_upload_url_and_existence_check(self):
+        storage = SupabaseStorage()
+        upload = storage.create_upload('uploads/a.pdf')
+        self.assertEqual(upload['method'], 'PUT')
+        self.assertIn('/object/upload/sign/visa/uploads/a.pdf?token=signed', upload['url'])
+        self.assertEqual(storage.size('uploads/a.pdf'), 42)
+        self.assertIsNone(storage.size('uploads/b.pdf'))
+        listed = json.loads(self.requests[-1].content)
+        self.assertEqual((listed['prefix'], listed['search']), ('uploads', 'b.pdf'))
+
+
+class UploadSpoolTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        spool = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool)
+        overrides = self.settings(UPLOAD_SPOOL_DIR=spool)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.spool = spool
+        self.failing = False
+        self.uploaded = []
+        self.storage = mock.Mock(upload_file_to_supabase=mock.Mock(side_effect=self.upload))
+        patcher = mock.patch.dict('sys.modules', {'core.supabase_client': self.storage})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        countries, visa_types = seed_catalog(countries=1, visa_types=1)
+        self.user = User.objects.create_user(
+            email='applicant@example.com', username='applicant', password='x', first_name='Ada', last_name='A',
+        )
+        self.application = VisaApplication.objects.create(user=self.user, country=countries[0], visa_type=visa_types[0])
+        self.required_document = visa_types[0].required_documents.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, file, folder="uploads", bucket="visa", name=None):
+        if self.failing:
+            raise ConnectionError("storage unavailable")
+        self.uploaded.append(file.read())
+        return f'https://files.example.com/{file.name}'
+
+    def put(self, name='passport.pdf', body=b'%PDF-1.4 scan'):
+        return self.client.put(
+            f'/api/v2/visa-applications/{self.application.id}/',
+            {f'required_documents[{self.required_document.id}]': SimpleUploadedFile(name, body)},
+        )
+
+    def document(self):
+        return ApplicationDocument.objects.get(application=self.application, required_document=self.required_document)
+
+    def spooled(self):
+        return os.listdir(self.spool)
+
+    def test_request_spools_and_worker_uploads(self):
+        self.assertEqual(self.put().status_code, 200)
+        self.assertFalse(self.storage.upload_file_to_supabase.called)
+        self.assertEqual((self.document().status, self.document().file), ('uploading', None))
+        self.assertEqual(len(self.spooled()), 1)
+
+        call_command('run_upload_worker', '--once', stdout=io.StringIO())
+        self.assertEqual(self.uploaded, [b'%PDF-1.4 scan'])
+        self.assertEqual((self.document().status, self.document().file), ('pending', 'https://files.example.com/passport.pdf'))
+        self.assertEqual(self.spooled(), [])
+        detail = self.client.get(f'/api/v2/visa-applications/{self.application.id}/').json()
+        self.assertEqual(detail['visa_type']['required_documents'][0]['document_file'], self.document().file)
+
+    def test_patch_submits_with_documents_uploading(self):
+        response = self.client.patch(f'/api/visa-applications/{self.application.id}/', {
+            'required_documents_files': json.dumps([{'required_document_id': self.required_document.id}]),
+            f'file_{self.required_document.id}': SimpleUploadedFile('passport.pdf', b'%PDF-1.4'),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['application']['status'], 'submitted')
+        self.assertEqual(self.document().status, 'uploading')
+        self.assertEqual(UploadJob.objects.get().status, 'pending')
+
+    @override_settings(UPLOAD_MAX_ATTEMPTS=3)
+    def test_failures_back_off_then_stop_without_losing_the_file(self):
+        self.put()
+        self.failing = True
+        delays = []
+        for _ in range(3):
+            UploadJob.objects.update(next_attempt_at=timezone.now())
+            started = timezone.now()
+            upload_spool.run_once()
+            job = UploadJob.objects.get()
+            delays.append(round((job.next_attempt_at - started).total_seconds()))
+        self.assertEqual(delays[:2], [5, 10])
+        self.assertEqual((job.status, job.attempts, job.last_error), ('failed', 3, 'storage unavailable'))
+        self.assertEqual(self.document().status, 'upload_failed')
+        self.assertEqual(len(self.spooled()), 1)
+
+        self.failing = False
+        call_command('run_upload_worker', '--once', '--retry-failed', stdout=io.StringIO())
+        self.assertEqual(UploadJob.objects.get().status, 'done')
+        self.assertEqual((self.document().status, self.document().file), ('pending', 'https://files.example.com/passport.pdf'))
+
+    @override_settings(UPLOAD_MAX_ATTEMPTS=1)
+    def test_reupload_supersedes_a_failed_one(self):
+        self.put('old.pdf', b'old')
+        self.failing = True
+        upload_spool.run_once()
+        self.assertEqual(self.document().status, 'upload_failed')
+
+        self.failing = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.put('new.pdf', b'new')
+        upload_spool.run_once()
+        self.assertEqual(
+            sorted(UploadJob.objects.values_list('file_name', 'status')),
+            [('new.pdf', 'done'), ('old.pdf', 'superseded')],
+        )
+        call_command('run_upload_worker', '--once', '--retry-failed', stdout=io.StringIO())
+        self.assertEqual(self.uploaded, [b'new'])
+        self.assertEqual((self.document().status, self.document().file), ('pending', 'https://files.example.com/new.pdf'))
+
+    def test_worker_survives_a_failed_batch(self):
+        command = 'visa_setup.management.commands.run_upload_worker'
+        with mock.patch.object(upload_spool, 'run_once', side_effect=[DatabaseError('connection lost'), 1, 0, KeyboardInterrupt]), \
+                mock.patch(f'{command}.close_old_connections') as close, \
+                mock.patch(f'{command}.time.sleep') as sleep, \
+                self.assertLogs(command, 'ERROR'):
+            output = io.StringIO()
+            call_command('run_upload_worker', stdout=output)
+        close.assert_called_once()
+        self.assertEqual(sleep.call_count, 2)
+        self.assertIn("Processed 1 upload job(s)", output.getvalue())
+
+    def test_unwritable_spool_dir_fails_the_checks(self):
+        # A read-only filesystem, as the BASE_DIR default on Vercel
+        with mock.patch('visa_setup.checks.os.access', return_value=False):
+            errors = check_upload_spool_dir(None)
+        self.assertEqual([error.id for error in errors], ['visa_setup.E001'])
+        self.assertEqual(check_upload_spool_dir(None), [])
+
+    def test_reupload_supersedes_the_pending_one(self):
+        self.put('old.pdf', b'old')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.put('new.pdf', b'new')
+        self.assertEqual(
+            sorted(UploadJob.objects.values_list('file_name', 'status')),
+            [('new.pdf', 'pending'), ('old.pdf', 'superseded')],
+        )
+        self.assertEqual(len(self.spooled()), 1)
+        upload_spool.run_once()
+        self.assertEqual(self.uploaded, [b'new'])
+        self.assertEqual(self.document().file, 'https://files.example.com/new.pdf')
+
+    def test_admin_reupload_is_spooled_and_keeps_the_current_file(self):
+        ApplicationDocument.objects.create(
+            application=self.application, required_document=self.required_document,
+            file='https://files.example.com/old.pdf', status='rejected',
+        )
+        admin = User.objects.create_superuser(email='admin@example.com', username='admin', password='x', first_name='E', last_name='E')
+        self.client.force_authenticate(admin)
+        self.failing = True
+        response = self.client.put(
+            f'/api/admin/visa-applications/{self.application.id}/',
+            {f'required_documents[{self.required_document.id}]': SimpleUploadedFile('new.pdf', b'new')},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.storage.upload_file_to_supabase.called)
+        upload_spool.run_once()
+        self.assertEqual((self.document().status, self.document().file), ('uploading', 'https://files.example.com/old.pdf'))
+
+    def test_backoff_is_exponential_and_capped(self):
+        self.assertEqual([upload_spool.backoff(n) for n in (1, 2, 3, 8, 20)], [5, 10, 20, 600, 600])
+
+
+class ContentAddressedUploadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        spool = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool)
+        overrides = self.settings(UPLOAD_SPOOL_DIR=spool)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.spool = spool
+        self.failing = False
+        self.storage = mock.Mock(upload_file_to_supabase=mock.Mock(side_effect=self.upload))
+        patcher = mock.patch.dict('sys.modules', {'core.supabase_client': self.storage})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, file, folder="uploads", bucket="visa", name=None):
+        if self.failing:
+            raise ConnectionError("storage unavailable")
+        return f'https://files.example.com/{folder}/{name}'
+
+    def test_identical_files_are_uploaded_once(self):
+        body = b'%PDF-1.4 passport'
+        results = uploads.upload_files({
+            1: SimpleUploadedFile('passport.PDF', body), 2: SimpleUploadedFile('copy.pdf', body),
+        })
+        digest = hashlib.sha256(body).hexdigest()
+        self.assertEqual(self.storage.upload_file_to_supabase.call_count, 1)
+        self.assertEqual(self.storage.upload_file_to_supabase.call_args.kwargs['name'], f'{digest}.pdf')
+        self.assertEqual(results[1].url, results[2].url)
+        stored = StoredObject.objects.get()
+        self.assertEqual((stored.sha256, stored.path, stored.size), (digest, f'uploads/{digest}.pdf', len(body)))
+
+        again = uploads.upload_files({3: SimpleUploadedFile('rescan.pdf', body)})
+        self.assertEqual(self.storage.upload_file_to_supabase.call_count, 1)
+        self.assertEqual(again[3].url, stored.url)
+
+    def test_failed_uploads_are_not_indexed(self):
+        self.failing = True
+        self.assertFalse(uploads.upload_files({1: SimpleUploadedFile('scan.pdf', b'scan')})[1].ok)
+        self.assertFalse(StoredObject.objects.exists())
+        self.failing = False
+        self.assertTrue(uploads.upload_files({1: SimpleUploadedFile('scan.pdf', b'scan')})[1].ok)
+        self.assertEqual(self.storage.upload_file_to_supabase.call_count, 2)
+
+    def test_resubmitted_document_skips_the_spool(self):
+        countries, visa_types = seed_catalog(countries=1, visa_types=1)
+        user = User.objects.create_user(email='a@example.com', username='applicant', password='x', first_name='A', last_name='A')
+        application = VisaApplication.objects.create(user=user, country=countries[0], visa_type=visa_types[0])
+        required_document = visa_types[0].required_documents.get()
+        client = APIClient()
+        client.force_authenticate(user)
+        body = b'%PDF-1.4 passport'
+
+        def put():
+            return client.put(
+                f'/api/v2/visa-applications/{application.id}/',
+                {f'required_documents[{required_document.id}]': SimpleUploadedFile('passport.pdf', body)},
+            )
+
+        put()
+        job = UploadJob.objects.get()
+        self.assertEqual(job.sha256, hashlib.sha256(body).hexdigest())
+        upload_spool.run_once()
+        document = ApplicationDocument.objects.get()
+        document.status = 'rejected'
+        document.save()
+
+        self.assertEqual(put().status_code, 200)
+        self.assertEqual(UploadJob.objects.count(), 1)
+        self.assertEqual(os.listdir(self.spool), [])
+        document.refresh_from_db()
+        self.assertEqual((document.status, document.file), ('pending', StoredObject.objects.get().url))
+        self.assertEqual(self.storage.upload_file_to_supabase.call_count, 1)
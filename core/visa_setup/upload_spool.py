@@ -0,0 +1,241 @@
+"""
+Durable spool of document uploads.
+
+A request writes the document files to ``UPLOAD_SPOOL_DIR`` and records one
+``UploadJob`` per file, marks the documents ``uploading`` and returns without
+waiting for storage. ``manage.py run_upload_worker`` then claims due jobs,
+uploads them (concurrently, through ``upload_files``) and points each document
+at its file. A failed upload is retried with exponential backoff; after
+``UPLOAD_MAX_ATTEMPTS`` the job is marked failed, its document
+``upload_failed``, and its spool file kept, so the upload can be retried later
+and no document silently loses its file. Re-uploading a document supersedes
+its unfinished and failed jobs, so a retry never brings back an older file.
+
+Claims are leases: a claimed job is pushed ``UPLOAD_CLAIM_LEASE`` seconds into
+the future, so several workers can share the queue and the job of a worker
+that died becomes due again.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import application_cache
+from .models import ApplicationDocument, UploadJob, VisaApplication
+from .uploads import stored_urls, upload_files
+
+logger = logging.getLogger(__name__)
+
+
+def spool_dir() -> Path:
+    return Path(getattr(settings, 'UPLOAD_SPOOL_DIR', os.path.join(settings.BASE_DIR, 'upload_spool')))
+
+
+def backoff(attempts) -> float:
+    """Seconds to wait before the next try of a job that failed ``attempts`` times."""
+    base = getattr(settings, 'UPLOAD_RETRY_BASE_DELAY', 5)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'UPLOAD_RETRY_MAX_DELAY', 600))
+
+
+def _max_attempts() -> int:
+    return getattr(settings, 'UPLOAD_MAX_ATTEMPTS', 8)
+
+
+def _remove(paths) -> None:
+    for path in paths:
+        try:
+            (spool_dir() / path).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _write(file) -> tuple:
+    """Copy an uploaded file into the spool in chunks; returns its spool path and SHA-256."""
+    name = f"{uuid.uuid4().hex}{Path(file.name or '').suffix}"
+    directory = spool_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    with open(directory / name, 'wb') as out:
+        for chunk in file.chunks():
+            digest.update(chunk)
+            out.write(chunk)
+    return name, digest.hexdigest()
+
+
+def spool_documents(application, files, folder="uploads", bucket="visa") -> None:
+    """
+    Spool ``{required document id: file}`` for upload and mark the documents
+    ``uploading``. A document keeps its current file until the new one is in
+    storage; spooled uploads of it that had not finished or had failed are
+    superseded. Files whose content is already in storage are not spooled:
+    their documents point at the stored file right away.
+    """
+    written = {}
+    try:
+        for required_document_id, file in files.items():
+            written[required_document_id] = _write(file)
+        urls = stored_urls((digest for _, digest in written.values()), bucket)
+        with transaction.atomic():
+            existing = {
+                document.required_document_id: document
+                for document in ApplicationDocument.objects.filter(application=application, required_document_id__in=files)
+            }
+            now = timezone.now()
+            created, updated, queued = [], [], []
+            for required_document_id in files:
+                url = urls.get(written[required_document_id][1])
+                document = existing.get(required_document_id)
+                if document is None:
+                    document = ApplicationDocument(application=application, required_document_id=required_document_id)
+                    created.append(document)
+                else:
+                    document.admin_notes = ''
+                    document.rejection_reason = ''
+                    document.updated_at = now
+                    updated.append(document)
+                if url is None:
+                    document.status = 'uploading'
+                    queued.append(required_document_id)
+                else:
+                    document.file = url
+                    document.status = 'pending'
+            if created:
+                ApplicationDocument.objects.bulk_create(created)
+            if updated:
+                ApplicationDocument.objects.bulk_update(updated, ['file', 'status', 'admin_notes', 'rejection_reason', 'updated_at'])
+                stale = UploadJob.objects.filter(document__in=updated, status__in=('pending', 'failed'))
+                superseded = list(stale.values_list('spool_path', flat=True))
+                stale.update(status='superseded', updated_at=now)
+                transaction.on_commit(lambda: _remove(superseded))
+
+            documents = {document.required_document_id: document for document in (*created, *updated)}
+            jobs = []
+            for required_document_id in queued:
+                file = files[required_document_id]
+                path, digest = written[required_document_id]
+                jobs.append(UploadJob(
+                    document=documents[required_document_id], spool_path=path, sha256=digest, file_name=file.name,
+                    content_type=getattr(file, 'content_type', None) or mimetypes.guess_type(file.name)[0] or '',
+                    folder=folder, bucket=bucket, next_attempt_at=now,
+                ))
+            UploadJob.objects.bulk_create(jobs)
+    except Exception:
+        _remove(path for path, _ in written.values())
+        raise
+    # Already in storage, their spooled copies are not needed
+    _remove(written[required_document_id][0] for required_document_id in files if required_document_id not in queued)
+    logger.info(
+        "Spooled %d upload(s) of application %s, %d already in storage",
+        len(queued), application.id, len(files) - len(queued),
+    )
+
+
+def claim(limit) -> list:
+    """Lease up to ``limit`` due jobs to this worker, oldest due first."""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            UploadJob.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        lease = timedelta(seconds=getattr(settings, 'UPLOAD_CLAIM_LEASE', 300))
+        UploadJob.objects.filter(id__in=ids).update(next_attempt_at=now + lease)
+    return list(UploadJob.objects.select_related('document').filter(id__in=ids).order_by('next_attempt_at', 'id'))
+
+
+def _complete(job, url) -> bool:
+    now = timezone.now()
+    with transaction.atomic():
+        # A job superseded while it was uploading must not overwrite the newer file
+        if not UploadJob.objects.filter(pk=job.pk, status='pending').update(
+            status='done', attempts=F('attempts') + 1, last_error='', updated_at=now,
+        ):
+            return False
+        ApplicationDocument.objects.filter(pk=job.document_id).update(file=url, status='pending', updated_at=now)
+    _remove([job.spool_path])
+    return True
+
+
+def _fail(job, error) -> None:
+    attempts = job.attempts + 1
+    now = timezone.now()
+    changes = {'attempts': attempts, 'last_error': error, 'updated_at': now}
+    if attempts < _max_attempts():
+        changes['next_attempt_at'] = now + timedelta(seconds=backoff(attempts))
+        logger.warning("Upload of %s for document %s failed (attempt %d): %s", job.file_name, job.document_id, attempts, error)
+        UploadJob.objects.filter(pk=job.pk, status='pending').update(**changes)
+        return
+    logger.error("Upload of %s for document %s failed %d times, giving up: %s", job.file_name, job.document_id, attempts, error)
+    with transaction.atomic():
+        if UploadJob.objects.filter(pk=job.pk, status='pending').update(status='failed', **changes):
+            ApplicationDocument.objects.filter(pk=job.document_id, status='uploading').update(
+                status='upload_failed', updated_at=now,
+            )
+
+
+def process(jobs) -> int:
+    """Upload claimed jobs and record the outcome of each; returns how many completed."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job.folder, job.bucket), []).append(job)
+    completed = 0
+    applications = set()
+    for (folder, bucket), group in groups.items():
+        files = {}
+        try:
+            for job in group:
+                try:
+                    file = File(open(spool_dir() / job.spool_path, 'rb'), name=job.file_name)
+                except OSError as e:
+                    _fail(job, f"Spool file unavailable: {e}")
+                    continue
+                file.content_type = job.content_type
+                files[job.id] = file
+            results = upload_files(
+                files, folder=folder, bucket=bucket, digests={job.id: job.sha256 for job in group},
+            )
+        finally:
+            for file in files.values():
+                file.close()
+        for job in group:
+            result = results.get(job.id)
+            if result is None:
+                continue
+            if not result.ok:
+                _fail(job, result.error)
+            elif _complete(job, result.url):
+                completed += 1
+                applications.add(job.document.application_id)
+    for application_id in applications:
+        application_cache.put(VisaApplication(pk=application_id))
+    return completed
+
+
+def run_once(limit=10) -> int:
+    """Claim and process one batch of due jobs; returns how many were claimed."""
+    jobs = claim(limit)
+    if jobs:
+        completed = process(jobs)
+        logger.info("Upload worker: %d of %d job(s) completed", completed, len(jobs))
+    return len(jobs)
+
+
+def retry_failed() -> int:
+    """Queue failed jobs again, with a fresh attempt budget."""
+    now = timezone.now()
+    with transaction.atomic():
+        failed = UploadJob.objects.filter(status='failed')
+        documents = list(failed.values_list('document_id', flat=True))
+        ApplicationDocument.objects.filter(pk__in=documents, status='upload_failed').update(status='uploading', updated_at=now)
+        return failed.update(status='pending', attempts=0, next_attempt_at=now, updated_at=now)
@@ -0,0 +1,161 @@
+"""
+Upload stage for the document files of one submission.
+
+Storage round trips dominate a submission with several documents, so its
+files are uploaded in parallel on a small thread pool, capped per request by
+``STORAGE_UPLOAD_CONCURRENCY``; the request then waits about as long as the
+slowest single upload. A failed upload is reported for its own file and does
+not stop the others. The resulting ``ApplicationDocument`` rows are written
+in one batch afterwards, from the request thread.
+
+Storage is content addressed: files are stored under the SHA-256 of their
+content and ``StoredObject`` maps digests to what is already in the bucket,
+so re-submitting the same scan reuses the stored file without uploading it.
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ApplicationDocument, StoredObject
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UploadResult:
+    """Public URL of an uploaded file, or why the upload failed."""
+    url: str = None
+    error: str = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _concurrency() -> int:
+    return getattr(settings, 'STORAGE_UPLOAD_CONCURRENCY', 4)
+
+
+def file_digest(file) -> str:
+    """SHA-256 hex digest of an uploaded file, read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_name(digest, file_name) -> str:
+    """Storage name of a file with the given content digest."""
+    return f"{digest}{Path(file_name or '').suffix.lower()}"
+
+
+def stored_urls(digests, bucket="visa") -> dict:
+    """digest -> URL of the files already in ``bucket``, in one query."""
+    return dict(
+        StoredObject.objects.filter(bucket=bucket, sha256__in=set(digests)).values_list('sha256', 'url')
+    )
+
+
+def upload_files(files, folder="uploads", bucket="visa", digests=None) -> dict:
+    """
+    Upload ``{key: file}`` concurrently; returns ``{key: UploadResult}`` in the same order.
+    ``digests`` holds SHA-256 digests already computed for some keys. Files
+    whose content is already stored, or repeated within ``files``, are not
+    uploaded again.
+    """
+    if not files:
+        return {}
+    digests = {key: (digests or {}).get(key) or file_digest(file) for key, file in files.items()}
+    urls = stored_urls(digests.values(), bucket)
+    # One upload per distinct content that is not stored yet
+    missing = {}
+    for key, digest in digests.items():
+        if digest not in urls:
+            missing.setdefault(digest, key)
+    if len(missing) < len(files):
+        logger.info("%d of %d file(s) already stored or repeated, not uploaded again", len(files) - len(missing), len(files))
+
+    uploaded = {}
+    if missing:
+        uploaded = _upload({digest: files[key] for digest, key in missing.items()}, folder, bucket)
+        stored = [
+            StoredObject(
+                bucket=bucket, sha256=digest, path=f"{folder}/{content_name(digest, files[key].name)}",
+                url=uploaded[digest].url, size=files[key].size or 0,
+            )
+            for digest, key in missing.items() if uploaded[digest].ok
+        ]
+        StoredObject.objects.bulk_create(stored, ignore_conflicts=True)
+    return {
+        key: UploadResult(url=urls[digest]) if digest in urls else uploaded[digest]
+        for key, digest in digests.items()
+    }
+
+
+def _upload(files, folder, bucket) -> dict:
+    """Upload ``{digest: file}`` under content-addressed names, in parallel."""
+    try:
+        from core.supabase_client import upload_file_to_supabase
+    except Exception as e:
+        logger.error("Storage client unavailable: %s", e)
+        return {digest: UploadResult(error=str(e)) for digest in files}
+
+    def upload(item):
+        digest, file = item
+        try:
+            url = upload_file_to_supabase(
+                file, folder=folder, bucket=bucket, name=content_name(digest, getattr(file, 'name', '')),
+            )
+            return digest, UploadResult(url=url)
+        except Exception as e:
+            logger.warning("Upload of %s failed: %s", getattr(file, 'name', digest), e)
+            return digest, UploadResult(error=str(e))
+
+    workers = min(len(files), _concurrency())
+    if workers <= 1:
+        return dict(map(upload, files.items()))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload') as pool:
+        return dict(pool.map(upload, files.items()))
+
+
+def upload_errors(results) -> dict:
+    """key -> error message of the uploads that failed."""
+    return {key: result.error for key, result in results.items() if not result.ok}
+
+
+def save_documents(application, results) -> None:
+    """
+    Point the application's documents at their uploaded files, in one batch.
+    ``results`` maps required document ids to upload results. Documents that
+    already exist are sent back to pending review. Failed uploads are skipped:
+    their document keeps its current file, or is not created.
+    """
+    results = {key: result for key, result in results.items() if result.ok}
+    existing = {
+        document.required_document_id: document
+        for document in ApplicationDocument.objects.filter(application=application, required_document_id__in=results)
+    }
+    now = timezone.now()
+    created, updated = [], []
+    for required_document_id, result in results.items():
+        document = existing.get(required_document_id)
+        if document is None:
+            created.append(ApplicationDocument(
+                application=application, required_document_id=required_document_id, file=result.url, status='pending',
+            ))
+        else:
+            document.file = result.url
+            document.status = 'pending'
+            document.admin_notes = ''
+            document.rejection_reason = ''
+            document.updated_at = now
+            updated.append(document)
+    if created:
+        ApplicationDocument.objects.bulk_create(created)
+    if updated:
+        ApplicationDocument.objects.bulk_update(updated, ['file', 'status', 'admin_notes', 'rejection_reason', 'updated_at'])
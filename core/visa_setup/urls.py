@@ -1,7 +1,7 @@
 
 from django.urls import path, include
 
-from .views import SettingsView, VisaTypeView, CountryView,CountryVisaTypesView, VisaApplicationView,UserVisaApplicationView,BookConsultationView
+from .views import SettingsView, VisaTypeView, CountryView,CountryVisaTypesView, VisaApplicationView,UserVisaApplicationView,BookConsultationView,BootstrapView,CatalogSearchView,ApplicationUploadIntentView,ApplicationUploadConfirmView,LocalStorageUploadView
 
 
 urlpatterns = [
@@ -15,8 +15,13 @@ urlpatterns = [
 
     path('v2/visa-applications/', UserVisaApplicationView.as_view(), name='visa-application-list'),
     path('v2/visa-applications/<int:application_id>/', UserVisaApplicationView.as_view(), name='visa-application-detail'),
+    path('v2/visa-applications/<int:application_id>/uploads/', ApplicationUploadIntentView.as_view(), name='visa-application-upload-intent'),
+    path('v2/visa-applications/<int:application_id>/uploads/confirm/', ApplicationUploadConfirmView.as_view(), name='visa-application-upload-confirm'),
+    path('storage/local/<str:token>/', LocalStorageUploadView.as_view(), name='local-storage-upload'),
     path('settings/', SettingsView.as_view(), name='settings'),
     path('book-consultation/', BookConsultationView.as_view(), name='book-consultation'),
+    path('bootstrap/', BootstrapView.as_view(), name='bootstrap'),
+    path('search/', CatalogSearchView.as_view(), name='catalog-search'),
     
     
 ]
@@ -1,24 +1,61 @@
-from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.shortcuts import get_object_or_404
 from rest_framework import status
-from .serializers import ConsultationSerializer, SettingsSerializer, VisaTypeSerializer, CountrySerializer, DetailedVisaTypeSerializer, VisaApplicationSerializer,UserVisaApplicationSerializer,CountryDetailsSerializer
-from .models import Settings, VisaType, Country, VisaApplication, RequiredDocuments, ApplicationDocument
-from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from .serializers import ConsultationSerializer, VisaApplicationSerializer,UserVisaApplicationSerializer
+from .models import VisaApplication, RequiredDocuments
+from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.core.cache import cache
 from django.conf import settings
+from django.core import signing
+from core.storage_backends import LocalStorage, get_storage
+from core.supabase_client import UPLOAD_CHUNK_SIZE
+from . import application_cache, catalog, direct_uploads, search
+from .upload_spool import spool_documents
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _page_params(request):
+    """
+    (limit, cursor) when the client asked for a page with ?limit= / ?cursor=,
+    None for the full list existing clients read.
+    """
+    params = request.query_params
+    if 'limit' not in params and 'cursor' not in params:
+        return None
+    limit = int(params.get('limit') or settings.CATALOG_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, settings.CATALOG_MAX_PAGE_SIZE), params.get('cursor') or None
+
+
+def _batch_ids(request):
+    """Ids asked for with ?ids=1,2,3 in request order, None without the parameter."""
+    value = request.query_params.get('ids')
+    if value is None:
+        return None
+    ids = [int(part) for part in value.split(',') if part.strip()]
+    if not ids or len(ids) > settings.CATALOG_MAX_BATCH_IDS:
+        raise ValueError(f"ids must list between 1 and {settings.CATALOG_MAX_BATCH_IDS} ids")
+    return ids
+
+
+def _visa_type_shape(request):
+    """Field subset requested with ?fields= / ?expand=, None for full rows."""
+    def names(param):
+        value = request.query_params.get(param)
+        return None if value is None else [name.strip() for name in value.split(',') if name.strip()]
+    return catalog.visa_type_shape(names('fields'), names('expand'))
+
+
 
 class CountryView(APIView):
 
     """
     API View to get the list of countries and individual country details.
+    The list is paginated by name with ?limit= / ?cursor=, or returned whole;
+    ?ids=1,2,3 returns those country details in request order.
     No authentication required.
     """
     permission_classes = [AllowAny]
@@ -26,46 +63,34 @@ class CountryView(APIView):
     def get(self, request, id=None):
         if id:
             try:
-                cache_key = f"country:{id}"
-                country = cache.get(cache_key)
-                if country is not None:
-                    logger.info("Serving country %s from cache", id)
-                if country is None:
-                    country = Country.objects.filter(id=id, active=True).prefetch_related(
-                        'types'
-                    ).first()
-                    cache.set(cache_key, country, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                    logger.info("Cached country %s", id)
-                if not country:
+                snapshot = catalog.get_country(id)
+                if snapshot is None:
                     return Response(
                         {"error": "Country not found"},
                         status=status.HTTP_404_NOT_FOUND
                     )
-                serializer = CountryDetailsSerializer(country, context={'request': request})
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                return catalog.snapshot_response(request, snapshot)
             except Exception as e:
                 return Response(
                     {"error": "Failed to fetch country", "details": str(e)},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 ) 
         try:
-            cache_key = "countries:active"
-            countries = cache.get(cache_key)
-            if countries is not None:
-                logger.info("Serving countries list from cache")
-            if countries is None:
-                countries_qs = Country.objects.filter(active=True).prefetch_related(
-                    'types'
-                )
-                countries_list = list(countries_qs)
-                cache.set(cache_key, countries_list, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                for c in countries_list:
-                    per_country_key = f"country:{c.id}"
-                    cache.set(per_country_key, c, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                logger.info("Cached countries list and hydrated %d country detail entries", len(countries_list))
-                countries = countries_list
-            serializer = CountrySerializer(countries, many=True, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            ids = _batch_ids(request)
+            page = _page_params(request)
+        except ValueError:
+            return Response(
+                {"error": "ids must be a comma separated list of integers and limit a positive integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            if ids is not None:
+                return catalog.snapshot_response(request, catalog.get_countries_by_id(ids))
+            if page is None:
+                return catalog.snapshot_response(request, catalog.get_countries())
+            return catalog.snapshot_response(request, catalog.get_country_page(*page))
+        except catalog.InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(
                 {"error": "Failed to fetch countries", "details": str(e)},
@@ -76,6 +101,9 @@ class CountryView(APIView):
 class VisaTypeView(APIView):
     """
     API View to get visa types and their details.
+    The list is paginated newest first with ?limit= / ?cursor=, or returned whole,
+    and ?fields= / ?expand= trim it to the fields and nested arrays a client needs.
+    ?ids=1,2,3 returns those visa type details in request order.
     No authentication required.
     """
     permission_classes = [AllowAny]
@@ -83,23 +111,13 @@ class VisaTypeView(APIView):
     def get(self, request, id=None):
         if id:
             try:
-                cache_key = f"visa_type:{id}"
-                visa_type = cache.get(cache_key)
-                if visa_type is not None:
-                    logger.info("Serving visa type %s from cache", id)
-                if visa_type is None:
-                    visa_type = VisaType.objects.filter(id=id, active=True).prefetch_related(
-                        'processes', 'overviews', 'notes', 'required_documents'
-                    ).first()
-                    cache.set(cache_key, visa_type, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                    logger.info("Cached visa type %s", id)
-                if not visa_type:
+                snapshot = catalog.get_visa_type(id)
+                if snapshot is None:
                     return Response(
                         {"error": "Visa type not found"},
                         status=status.HTTP_404_NOT_FOUND
                     )
-                serializer = DetailedVisaTypeSerializer(visa_type, context={'request': request})
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                return catalog.snapshot_response(request, snapshot)
             except Exception as e:
                 return Response(
                     {"error": "Failed to fetch visa type", "details": str(e)},
@@ -107,23 +125,22 @@ class VisaTypeView(APIView):
                 )
         else:
             try:
-                cache_key = "visa_types:active"
-                visa_types = cache.get(cache_key)
-                if visa_types is not None:
-                    logger.info("Serving visa types list from cache")
-                if visa_types is None:
-                    visa_types_qs = VisaType.objects.filter(active=True).prefetch_related(
-                        'processes', 'overviews', 'notes', 'required_documents'
-                    )
-                    visa_types_list = list(visa_types_qs)
-                    cache.set(cache_key, visa_types_list, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                    for vt in visa_types_list:
-                        per_vt_key = f"visa_type:{vt.id}"
-                        cache.set(per_vt_key, vt, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                    logger.info("Cached visa types list and hydrated %d visa type entries", len(visa_types_list))
-                    visa_types = visa_types_list
-                serializer = DetailedVisaTypeSerializer(visa_types, many=True, context={'request': request})
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                ids = _batch_ids(request)
+                page = _page_params(request)
+            except ValueError:
+                return Response(
+                    {"error": "ids must be a comma separated list of integers and limit a positive integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                if ids is not None:
+                    return catalog.snapshot_response(request, catalog.get_visa_types_by_id(ids))
+                shape = _visa_type_shape(request)
+                if page is None:
+                    return catalog.snapshot_response(request, catalog.get_visa_types(shape))
+                return catalog.snapshot_response(request, catalog.get_visa_type_page(*page, shape=shape))
+            except (catalog.InvalidCursor, catalog.InvalidFields) as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
                 return Response(
                     {"error": "Failed to fetch visa types", "details": str(e)},
@@ -134,6 +151,7 @@ class VisaTypeView(APIView):
 class CountryVisaTypesView(APIView):
     """
     API View to get visa types available for a specific country.
+    Accepts the same ?fields= / ?expand= as the visa type list.
     No authentication required.
     """
     permission_classes = [AllowAny]
@@ -145,33 +163,15 @@ class CountryVisaTypesView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         try:
-            country_cache_key = f"country:{id}"
-            country = cache.get(country_cache_key)
-            if country is not None:
-                logger.info("Serving country %s from cache (country lookup)", id)
-            if country is None:
-                country = Country.objects.filter(id=id, active=True).prefetch_related(
-                    'types'
-                ).first()
-                cache.set(country_cache_key, country, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                logger.info("Cached country %s (country lookup)", id)
-            if not country:
+            snapshot = catalog.get_country_visa_types(id, _visa_type_shape(request))
+            if snapshot is None:
                 return Response(
                     {"error": "Country not found"},
                     status=status.HTTP_404_NOT_FOUND
                 )
-            visa_types_cache_key = f"country:{id}:visa_types"
-            visa_types = cache.get(visa_types_cache_key)
-            if visa_types is not None:
-                logger.info("Serving visa types for country %s from cache", id)
-            if visa_types is None:
-                visa_types = country.types.filter(active=True).prefetch_related(
-                    'processes', 'overviews', 'notes', 'required_documents'
-                )
-                cache.set(visa_types_cache_key, list(visa_types), getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                logger.info("Cached visa types for country %s", id)
-            serializer = DetailedVisaTypeSerializer(visa_types, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return catalog.snapshot_response(request, snapshot)
+        except catalog.InvalidFields as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(
                 {"error": "Failed to fetch visa types for the country", "details": str(e)},
@@ -192,16 +192,20 @@ class VisaApplicationView(APIView):
         if serializer.is_valid():
             try:
                 visa_application = serializer.save()
+                application_cache.put(visa_application)
                 message = "Visa application created successfully"
                 if request.data.get('required_documents_files'):
                     message += " with all required documents"
                 else:
                     message += " (draft - documents can be uploaded later)"
                 
-                return Response({
+                response = {
                     "message": message,
                     "application": VisaApplicationSerializer(visa_application).data
-                }, status=status.HTTP_201_CREATED)
+                }
+                if serializer.upload_errors:
+                    response["upload_errors"] = serializer.upload_errors
+                return Response(response, status=status.HTTP_201_CREATED)
             except Exception as e:
                 return Response({
                     "error": "Failed to create visa application",
@@ -247,78 +251,27 @@ class VisaApplicationView(APIView):
                     "error": f"Missing required documents: {[RequiredDocuments.objects.get(id=doc_id).document_name for doc_id in missing_docs]}"
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Create or update ApplicationDocument for each required document
+            # Collect the file of every required document before uploading any
+            uploads = {}
             for file_info in files:
-                required_document_id = file_info['required_document_id']
-                file_key = f"file_{required_document_id}"
-                file = request.FILES.get(file_key)
+                required_document_id = int(file_info['required_document_id'])
+                file = request.FILES.get(f"file_{required_document_id}")
                 
                 if not file:
                     return Response({
                         "error": f"File not found for document ID {required_document_id}"
                     }, status=status.HTTP_400_BAD_REQUEST)
-                
-                required_document = RequiredDocuments.objects.get(id=required_document_id)
-                
-                # Check if document already exists
-                existing_doc = ApplicationDocument.objects.filter(
-                    application=application,
-                    required_document=required_document
-                ).first()
-                
-                if existing_doc:
-                    # Update existing document
-                    try:
-                        from core.supabase_client import upload_file_to_supabase
-                        file_url = upload_file_to_supabase(file)
-                        existing_doc.file = file_url
-                    except Exception as e:
-                        # Fallback: keep existing file or set to None
-                        existing_doc.file = None
-                    
-                    existing_doc.status = 'pending'
-                    existing_doc.rejection_reason = ''
-                    existing_doc.save()
-                else:
-                    # Create new document
-                    try:
-                        from core.supabase_client import upload_file_to_supabase
-                        file_url = upload_file_to_supabase(file)
-                        
-                        ApplicationDocument.objects.create(
-                            application=application,
-                            required_document=required_document,
-                            file=file_url,
-                            status='pending'
-                        )
-                    except Exception as e:
-                        # Fallback: create without file URL
-                        ApplicationDocument.objects.create(
-                            application=application,
-                            required_document=required_document,
-                            file=None,
-                            status='pending'
-                        )
+                uploads[required_document_id] = file
+
+            # Spool them for the upload worker; the documents are 'uploading' until it is done
+            spool_documents(application, uploads)
             
             # Update application status to submitted
             application.status = 'submitted'
             application.save()
             
-            # Invalidate and warm user-specific caches
-            user_cache_list_key = f"user:{request.user.id}:applications"
-            user_cache_detail_key = f"user:{request.user.id}:application:{application_id}"
-            cache.delete(user_cache_list_key)
-            cache.delete(user_cache_detail_key)
-            # Warm detail
-            application_refreshed = VisaApplication.objects.filter(id=application_id, user=request.user).select_related('country', 'visa_type', 'user').prefetch_related('documents__required_document').first()
-            if application_refreshed:
-                data_detail = VisaApplicationSerializer(application_refreshed).data
-                cache.set(user_cache_detail_key, data_detail, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            # Warm list
-            applications_qs = VisaApplication.objects.filter(user=request.user).select_related('country', 'visa_type', 'user').prefetch_related('documents__required_document')
-            data_list = VisaApplicationSerializer(applications_qs, many=True).data
-            cache.set(user_cache_list_key, data_list, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            logger.info("Invalidated and rewarmed cache keys: %s, %s", user_cache_list_key, user_cache_detail_key)
+            # Only this application's cached entries change
+            application_cache.put(application)
 
             return Response({
                 "message": "Application updated successfully with all required documents",
@@ -339,44 +292,15 @@ class VisaApplicationView(APIView):
         """Get all visa applications or specific application for the logged-in user with documents"""
         if application_id:
             try:
-                cache_key = f"user:{request.user.id}:application:{application_id}"
-                cached = cache.get(cache_key)
-                if cached is not None:
-                    logger.info("Serving user application %s from cache for user %s", application_id, request.user.id)
-                    return Response(cached, status=status.HTTP_200_OK)
-
-                visa_application = VisaApplication.objects.filter(
-                    id=application_id, 
-                    user=request.user
-                ).select_related(
-                    'country', 'visa_type', 'user'
-                ).prefetch_related('documents__required_document').first()
-                
-                if not visa_application:
+                data = application_cache.get_detail(request.user.id, application_cache.V1, application_id)
+                if data is None:
                     return Response({"error": "Application not found"}, status=status.HTTP_404_NOT_FOUND)
-                
-                serializer = VisaApplicationSerializer(visa_application)
-                data = serializer.data
-                cache.set(cache_key, data, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                logger.info("Cached user application %s for user %s", application_id, request.user.id)
                 return Response(data, status=status.HTTP_200_OK)
             except Exception as e:
                 return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         else:
             """Get all visa applications for the logged-in user with documents"""
-            cache_key = f"user:{request.user.id}:applications"
-            cached = cache.get(cache_key)
-            if cached is not None:
-                logger.info("Serving user applications list from cache for user %s", request.user.id)
-                return Response({"message":"Applications fetched successfully", "Applications:": cached}, status=status.HTTP_200_OK)
-
-            visa_applications = VisaApplication.objects.filter(user=request.user).select_related(
-                'country', 'visa_type', 'user'
-            ).prefetch_related('documents__required_document')
-            serializer = VisaApplicationSerializer(visa_applications, many=True)
-            data = serializer.data
-            cache.set(cache_key, data, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            logger.info("Cached user applications list for user %s", request.user.id)
+            data = application_cache.get_list(request.user.id, application_cache.V1)
             return Response({"message":"Applications fetched successfully", "Applications:": data}, status=status.HTTP_200_OK)
 
 
@@ -389,65 +313,29 @@ class UserVisaApplicationView(APIView):
         """Get all visa applications or specific application for the logged-in user with documents"""
         if application_id:
             try:
-                cache_key = f"user:{request.user.id}:application:{application_id}"
-                cached = cache.get(cache_key)
-                if cached is not None:
-                    logger.info("Serving v2 user application %s from cache for user %s", application_id, request.user.id)
-                    return Response(cached, status=status.HTTP_200_OK)
-
-                visa_application = VisaApplication.objects.filter(
-                    id=application_id, 
-                    user=request.user
-                ).select_related(
-                    'country', 'visa_type', 'user'
-                ).prefetch_related('documents__required_document').first()
-                
-                if not visa_application:
+                data = application_cache.get_detail(request.user.id, application_cache.V2, application_id)
+                if data is None:
                     return Response({"error": "Application not found"}, status=status.HTTP_404_NOT_FOUND)
-                
-                serializer = UserVisaApplicationSerializer(visa_application)
-                data = serializer.data
-                cache.set(cache_key, data, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-                logger.info("Cached v2 user application %s for user %s", application_id, request.user.id)
                 return Response(data, status=status.HTTP_200_OK)
             except Exception as e:
                 return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         else:
             """Get all visa applications for the logged-in user with documents"""
-            cache_key = f"user:{request.user.id}:applications"
-            cached = cache.get(cache_key)
-            if cached is not None:
-                logger.info("Serving v2 user applications list from cache for user %s", request.user.id)
-                return Response({"message":"Applications fetched successfully", "Applications:":cached}, status=status.HTTP_200_OK)
-
-            visa_applications = VisaApplication.objects.filter(user=request.user).select_related(
-                'country', 'visa_type', 'user'
-            ).prefetch_related('documents__required_document')
-            serializer = UserVisaApplicationSerializer(visa_applications, many=True)
-            data = serializer.data
-            cache.set(cache_key, data, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            logger.info("Cached v2 user applications list for user %s", request.user.id)
+            data = application_cache.get_list(request.user.id, application_cache.V2)
             return Response({"message":"Applications fetched successfully", "Applications:":data}, status=status.HTTP_200_OK)
 
     def post(self, request):
         serializer = UserVisaApplicationSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             visa_application = serializer.save()
-            list_key = f"user:{request.user.id}:applications"
-            detail_key = f"user:{request.user.id}:application:{visa_application.id}"
-            cache.delete(list_key)
-            cache.delete(detail_key)
-            # Warm detail and list
-            data_detail = UserVisaApplicationSerializer(visa_application).data
-            cache.set(detail_key, data_detail, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            apps_qs = VisaApplication.objects.filter(user=request.user).select_related('country', 'visa_type', 'user').prefetch_related('documents__required_document')
-            data_list = UserVisaApplicationSerializer(apps_qs, many=True).data
-            cache.set(list_key, data_list, getattr(settings, 'CACHE_DEFAULT_TTL', 300))
-            logger.info("Invalidated and rewarmed v2 cache keys after create: %s, %s", list_key, detail_key)
-            return Response({
+            application_cache.put(visa_application)
+            response = {
                 "message": "Application created successfully",
                 "Application": UserVisaApplicationSerializer(visa_application).data
-            }, status=status.HTTP_201_CREATED)
+            }
+            if serializer.upload_errors:
+                response["upload_errors"] = serializer.upload_errors
+            return Response(response, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def put(self, request, application_id=None):
@@ -456,65 +344,121 @@ class UserVisaApplicationView(APIView):
         except VisaApplication.DoesNotExist:
             return Response({'error': 'Application not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        updated = False
-
+        uploads = {}
         for key in request.FILES:
             if key.startswith("required_documents["):
                 try:
                     doc_id = int(key.split("[")[1].split("]")[0])
                 except (IndexError, ValueError):
                     continue  # skip invalid keys
+                uploads[doc_id] = request.FILES[key]
 
-                file = request.FILES[key]
+        # Check every required document before uploading any file
+        unknown = set(uploads) - set(RequiredDocuments.objects.filter(id__in=uploads).values_list('id', flat=True))
+        if unknown:
+            return Response({'error': f'Required document with ID {min(unknown)} does not exist'}, status=404)
 
-                try:
-                    required_doc = RequiredDocuments.objects.get(id=doc_id)
-                except RequiredDocuments.DoesNotExist:
-                    return Response({'error': f'Required document with ID {doc_id} does not exist'}, status=404)
+        if uploads:
+            # Spool for the upload worker; the documents are 'uploading' until it is done
+            spool_documents(app, uploads)
+            application_cache.put(app)
+            return Response({'message': 'Document(s) updated successfully'}, status=200)
+        else:
+            return Response({'error': 'No valid document found to update'}, status=400)
 
-                # Upload to Supabase
-                try:
-                    from core.supabase_client import upload_file_to_supabase
-                    file_url = upload_file_to_supabase(file)
-                    
-                    # Update or create ApplicationDocument with Supabase URL
-                    app_doc, created = ApplicationDocument.objects.get_or_create(
-                        application=app,
-                        required_document=required_doc,
-                        defaults={'file': file_url}
-                    )
 
-                    if not created:
-                        app_doc.file = file_url
-                        app_doc.status = 'pending'  # Reset status after upload
-                        app_doc.admin_notes = ''
-                        app_doc.rejection_reason = ''
-                        app_doc.save()
-                        
-                except Exception as e:
-                    # Fallback to local storage if Supabase upload fails
-                    app_doc, created = ApplicationDocument.objects.get_or_create(
-                        application=app,
-                        required_document=required_doc,
-                        defaults={'file': None}
-                    )
+class ApplicationUploadIntentView(APIView):
+    """
+    Issue a signed upload URL for one required document of an application;
+    the client sends the file straight to storage, then confirms the intent.
+    """
+    permission_classes = (IsAuthenticated,)
 
-                    if not created:
-                        app_doc.file = None
-                        app_doc.status = 'pending'  # Reset status after upload
-                        app_doc.admin_notes = ''
-                        app_doc.rejection_reason = ''
-                        app_doc.save()
+    def post(self, request, application_id):
+        try:
+            application = VisaApplication.objects.select_related('visa_type').get(pk=application_id, user=request.user)
+        except VisaApplication.DoesNotExist:
+            return Response({'error': 'Application not found'}, status=status.HTTP_404_NOT_FOUND)
 
-                updated = True
+        file_name = request.data.get('file_name')
+        if not file_name:
+            return Response({'error': 'file_name is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            required_document_id = int(request.data.get('required_document_id'))
+        except (TypeError, ValueError):
+            return Response({'error': 'required_document_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not application.visa_type.required_documents.filter(pk=required_document_id).exists():
+            return Response({
+                'error': f'Document {required_document_id} is not required for this visa type'
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-        if updated:
-            return Response({'message': 'Document(s) updated successfully'}, status=200)
-        else:
-            return Response({'error': 'No valid document found to update'}, status=400)
+        try:
+            intent = direct_uploads.create_intent(
+                application, required_document_id, file_name, request.data.get('content_type')
+            )
+        except direct_uploads.IntentError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error("Could not create upload intent for application %s: %s", application.id, e)
+            return Response({'error': 'Storage is unavailable', 'details': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(intent, status=status.HTTP_201_CREATED)
+
+
+class ApplicationUploadConfirmView(APIView):
+    """Record a file uploaded through an upload intent as the application's document."""
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, application_id):
+        try:
+            application = VisaApplication.objects.get(pk=application_id, user=request.user)
+        except VisaApplication.DoesNotExist:
+            return Response({'error': 'Application not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        intent = request.data.get('intent')
+        if not intent:
+            return Response({'error': 'intent is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            required_document_id = direct_uploads.confirm_intent(application, intent)
+        except direct_uploads.IntentError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        application_cache.put(application)
+        document = application.documents.get(required_document_id=required_document_id)
+        return Response({
+            'message': 'Document uploaded successfully',
+            'document': {
+                'id': document.id,
+                'required_document_id': required_document_id,
+                'file': document.file,
+                'status': document.status,
+            },
+        }, status=status.HTTP_200_OK)
+
+
+class LocalStorageUploadView(APIView):
+    """
+    Upload URL of the local storage stand-in: accepts the raw file body,
+    authorized by the signed token in the URL rather than by the user.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def put(self, request, token):
+        storage = get_storage()
+        if not isinstance(storage, LocalStorage):
+            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            path = storage.path_for_token(token, direct_uploads.max_age())
+        except signing.BadSignature:
+            return Response({'error': 'Invalid or expired upload URL'}, status=status.HTTP_403_FORBIDDEN)
 
+        stream = request.stream
+        chunks = iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b'') if stream is not None else ()
+        size = storage.save(path, chunks)
+        return Response({'path': path, 'size': size}, status=status.HTTP_201_CREATED)
 
-# lets implement book a consultation 
+
+# lets implement book a consultation
 class BookConsultationView(APIView):
     permission_classes = [AllowAny]
 
@@ -534,22 +478,62 @@ class SettingsView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request):
-        cache_key = "settings"
-        cached = cache.get(cache_key)
-        if cached is not None:
-            logger.info("Serving settings from cache")
-            return Response(cached, status=status.HTTP_200_OK)
-
         try:
-            site_settings = Settings.objects.first()
-            if not site_settings:
+            snapshot = catalog.get_settings()
+            if snapshot is None:
                 return Response({"error": "Settings not configured"}, status=status.HTTP_404_NOT_FOUND)
-            serializer = SettingsSerializer(site_settings)
-            data = serializer.data
-            cache_timeout = getattr(settings, 'CACHE_DEFAULT_TTL', 300)
-            cache.set(cache_key, data, cache_timeout)
-            logger.info("Cached settings")
-            return Response(data, status=status.HTTP_200_OK)
+            return catalog.snapshot_response(request, snapshot)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+class BootstrapView(APIView):
+    """
+    Countries, site settings and the first page of visa type cards for the
+    first paint of the public site, as one prebuilt document with one ETag.
+    Public, so JWT parsing is skipped. No authentication required.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            return catalog.snapshot_response(request, catalog.get_bootstrap())
+        except Exception as e:
+            return Response(
+                {"error": "Failed to fetch bootstrap data", "details": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class CatalogSearchView(APIView):
+    """
+    Ranked search over countries and visa types (including the documents
+    they require): ?q=<text>&type=country|visa_type&limit=<n>.
+    No authentication required.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if len(query) < 2 or len(query) > 100:
+            return Response(
+                {"error": "q must be between 2 and 100 characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        types = request.query_params.get('type')
+        types = search.TYPES if types is None else tuple(t for t in types.split(',') if t in search.TYPES)
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), settings.CATALOG_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({"error": "limit must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1 or not types:
+            return Response({"error": "Invalid limit or type"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return Response({"query": query, "results": search.search(query, types, limit)})
+        except Exception as e:
+            return Response(
+                {"error": "Search failed", "details": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )